@@ -0,0 +1,274 @@
+"""
+Schema-constrained JSON decoding for the engine's local MedGemma generation.
+
+    grammar = constrained_json.SchemaGrammar(REPORT_FIELDS, TokenVocabulary.from_tokenizer(tokenizer))
+    state = grammar.new_state(prompt_len)
+    model.generate(**inputs, logits_processor=LogitsProcessorList([state.logits_processor]),
+                   stopping_criteria=StoppingCriteriaList([state.stopping_criteria]))
+
+The schema is an ordered list of fields (a fixed choice, a free string, or a list of strings).
+It compiles to a small automaton over literal text (keys, quotes, commas - everything between
+two free strings) and free-string nodes. At each step the logits processor masks every token
+the automaton can't accept: inside a literal only tokens that continue it, inside a string
+only tokens without quote / backslash / control characters, plus the tokens that close the
+string and continue the following literal. Every string has a token budget after which it must
+close, so the object always closes within max_tokens() tokens (use at least that as
+max_new_tokens), and the stopping criterion ends generation on the token that emits the final "}".
+
+Allowed-token arrays are cached per automaton position on the grammar, so they are computed
+once per engine process, not per request. The processor and criterion are duck-typed for
+transformers (they only need `(input_ids, scores)`; torch is imported when masking), so the
+automaton itself runs without torch. One sequence per generate call.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+class Choice(NamedTuple):
+    """ One of a fixed set of strings. """
+    options: Tuple[str, ...]
+
+class String(NamedTuple):
+    """ Free text of at most `max_tokens` tokens (and at least one). """
+    max_tokens: int = 64
+
+class StringList(NamedTuple):
+    """ A list of 1..`max_items` strings of at most `max_tokens` tokens each. """
+    max_items: int = 4
+    max_tokens: int = 24
+
+# What _local_inference asks MedGemma for; SchemaGrammar.max_tokens() bounds its length
+REPORT_FIELDS = [
+    ("image_type", Choice(("medical", "non-medical"))),
+    ("image_findings", String(max_tokens=150)),
+    ("confidence", Choice(("high", "moderate", "low"))),
+    ("abnormalities", StringList(max_items=4, max_tokens=16)),
+    ("follow_up", String(max_tokens=40)),
+]
+
+_BYTE_TOKEN = re.compile(r"<0x([0-9A-Fa-f]{2})>")
+_UNSAFE = re.compile(r'["\\\x00-\x1f]')
+
+class TokenVocabulary:
+    """ Decoded text of every token id ("" for special / partial-byte tokens, which never match). """
+
+    def __init__(self, texts: Sequence[str], eos_token_id: int):
+        self.texts = list(texts)
+        self.eos_token_id = eos_token_id
+        self.string_safe = np.array([bool(t) and not _UNSAFE.search(t) for t in self.texts])
+        self.by_first: Dict[str, List[int]] = {}
+        for token_id, text in enumerate(self.texts):
+            if text:
+                self.by_first.setdefault(text[0], []).append(token_id)
+        self.quoted = [i for i, t in enumerate(self.texts) if '"' in t]
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer) -> "TokenVocabulary":
+        """ SentencePiece pieces ("▁" = space, "<0x0A>" = byte) mapped back to text. """
+        special = set(tokenizer.all_special_ids)
+        texts = []
+        for token_id, piece in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+            byte = _BYTE_TOKEN.fullmatch(piece or "")
+            if token_id in special or piece is None:
+                texts.append("")
+            elif byte:
+                value = int(byte.group(1), 16)
+                texts.append(chr(value) if value < 0x80 else "")
+            else:
+                texts.append(piece.replace("▁", " "))
+        return cls(texts, tokenizer.eos_token_id)
+
+class _StringNode:
+    def __init__(self, max_tokens: int, max_items: int = 1):
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.close: List[Tuple[str, object]] = []  # literal alternatives that start with the closing quote
+
+END = "end"
+
+class SchemaGrammar:
+    """ The compiled automaton for `fields` over `vocab`, plus its allowed-token cache. """
+
+    def __init__(self, fields: Sequence[Tuple[str, object]], vocab: TokenVocabulary):
+        self.vocab = vocab
+        self._allowed: Dict[tuple, np.ndarray] = {}
+        tail: List[Tuple[str, object]] = [("}", END)]
+        for position, (key, kind) in reversed(list(enumerate(fields))):
+            prefix = ("{" if position == 0 else ", ") + f'"{key}": '
+            if isinstance(kind, Choice):
+                tail = [(f'{prefix}"{option}"{text}', target) for option in kind.options for text, target in tail]
+            elif isinstance(kind, String):
+                node = _StringNode(kind.max_tokens)
+                node.close = [('"' + text, target) for text, target in tail]
+                tail = [(prefix + '"', node)]
+            elif isinstance(kind, StringList):
+                node = _StringNode(kind.max_tokens, kind.max_items)
+                node.close = [('", "', node)] + [('"]' + text, target) for text, target in tail]
+                tail = [(prefix + '["', node)]
+            else:
+                raise TypeError(f"Unsupported field type for {key!r}: {kind!r}")
+        self.start = tail
+
+    def max_tokens(self) -> int:
+        """
+        Most tokens any complete object can take: every string at its budget, every list full and
+        every literal spelled one character per token. max_new_tokens at least this large means
+        generation always ends on the closing brace.
+        """
+        memo: Dict[int, int] = {}
+
+        def literal(alternatives) -> int:
+            return max(len(text) + cost(target) for text, target in alternatives)
+
+        def cost(target) -> int:
+            if target is END:
+                return 0
+            if id(target) not in memo:
+                # max_items strings, joined by the list's own '", "' literal, then the way out
+                loops = [len(text) for text, next_node in target.close if next_node is target]
+                exits = [(text, next_node) for text, next_node in target.close if next_node is not target]
+                memo[id(target)] = (target.max_items * target.max_tokens
+                                    + (target.max_items - 1) * max(loops, default=0) + literal(exits))
+            return memo[id(target)]
+        return literal(self.start)
+
+    def new_state(self, prompt_len: int = 0) -> "DecodeState":
+        return DecodeState(self, prompt_len)
+
+    def allowed(self, key: tuple, compute) -> np.ndarray:
+        if key not in self._allowed:
+            self._allowed[key] = np.asarray(sorted(compute()), dtype=np.int64)
+        return self._allowed[key]
+
+    def literal_tokens(self, alternatives, consumed: str) -> set:
+        """ Tokens that extend `consumed` along one of the literal alternatives. """
+        rests = [text[len(consumed):] for text, _ in alternatives if text.startswith(consumed) and len(text) > len(consumed)]
+        allowed = set()
+        for first in {rest[0] for rest in rests}:
+            for token_id in self.vocab.by_first.get(first, ()):
+                text = self.vocab.texts[token_id]
+                if any(rest.startswith(text) for rest in rests):
+                    allowed.add(token_id)
+        return allowed
+
+    def closing_tokens(self, alternatives) -> set:
+        """ Tokens made of safe string text, the closing quote, then the start of a following literal. """
+        allowed = set()
+        for token_id in self.vocab.quoted:
+            text = self.vocab.texts[token_id]
+            quote = text.index('"')
+            if not _UNSAFE.search(text[:quote]) and any(alt.startswith(text[quote:]) for alt, _ in alternatives):
+                allowed.add(token_id)
+        return allowed
+
+class DecodeState:
+    """ Where one generation is in the grammar; advanced with each sampled token. """
+
+    def __init__(self, grammar: SchemaGrammar, prompt_len: int = 0):
+        self.grammar = grammar
+        self.prompt_len = prompt_len
+        self.seen = 0                      # generated tokens already applied
+        self.literal: Optional[list] = grammar.start  # alternatives of the literal being emitted
+        self.consumed = ""                 # literal text emitted so far
+        self.node: Optional[_StringNode] = None  # current (or just closed) string
+        self.tokens = 0                    # tokens in the current string
+        self.items = 0                     # strings in the current list
+        self.done = False
+        self.failed = False                # a token the grammar can't take (then nothing is masked)
+        self.logits_processor = _MaskLogits(self)
+        self.stopping_criteria = _StopWhenClosed(self)
+
+    @property
+    def list_full(self) -> bool:
+        return self.node is not None and self.items >= self.node.max_items
+
+    def _alternatives(self, literal) -> list:
+        """ `literal` without the "next item" alternative once the list is full. """
+        return [(text, target) for text, target in literal if not (target is self.node and self.list_full)]
+
+    def allowed(self) -> np.ndarray:
+        """ Token ids that may come next. """
+        grammar = self.grammar
+        if self.done:
+            return np.asarray([grammar.vocab.eos_token_id], dtype=np.int64)
+        alternatives = self._alternatives(self.literal if self.literal is not None else self.node.close)
+        if self.literal is not None:
+            consumed = self.consumed
+            key = (id(self.literal), self.list_full, consumed)
+            return grammar.allowed(key, lambda: grammar.literal_tokens(alternatives, consumed))
+        can_close = self.tokens > 0
+        can_continue = self.tokens < self.node.max_tokens
+        key = (id(self.node), self.list_full, can_close, can_continue)
+
+        def compute():
+            allowed = set(np.flatnonzero(grammar.vocab.string_safe).tolist()) if can_continue else set()
+            return allowed | grammar.closing_tokens(alternatives) if can_close else allowed
+        return grammar.allowed(key, compute)
+
+    def advance(self, token_id: int):
+        if self.done or self.failed:
+            return
+        texts = self.grammar.vocab.texts
+        text = texts[token_id] if 0 <= token_id < len(texts) else ""
+        if self.literal is None:
+            if '"' not in text:
+                self.tokens += 1
+                return
+            self.literal = self.node.close
+            text = text[text.index('"'):]
+        self.consumed += text
+        matches = [(alt, target) for alt, target in self._alternatives(self.literal) if alt.startswith(self.consumed)]
+        if not matches:
+            self.failed = True
+            return
+        finished = [target for alt, target in matches if alt == self.consumed]
+        if finished:
+            target = finished[0]
+            self.literal, self.consumed = None, ""
+            if target is END:
+                self.done = True
+            else:
+                self.items = self.items + 1 if target is self.node else 1
+                self.node, self.tokens = target, 0
+
+    def sync(self, input_ids):
+        """ Applies the tokens generated since the last call (`input_ids` is one sequence). """
+        generated = [int(t) for t in input_ids[self.prompt_len + self.seen:]]
+        for token_id in generated:
+            self.advance(token_id)
+        self.seen += len(generated)
+
+class _MaskLogits:
+    """ LogitsProcessor: every token the grammar can't take next gets -inf. """
+
+    def __init__(self, state: DecodeState):
+        self.state = state
+        self._device_ids: Dict[tuple, object] = {}
+
+    def __call__(self, input_ids, scores):
+        import torch
+        self.state.sync(input_ids[0])
+        if self.state.failed:
+            return scores
+        allowed = self.state.allowed()
+        if not len(allowed):  # the vocabulary can't spell the next literal
+            self.state.failed = True
+            return scores
+        key = (id(allowed), scores.device)
+        if key not in self._device_ids:
+            self._device_ids[key] = torch.as_tensor(allowed, device=scores.device)
+        ids = self._device_ids[key]
+        masked = torch.full_like(scores, float("-inf"))
+        masked[:, ids] = scores[:, ids]
+        return masked
+
+class _StopWhenClosed:
+    """ StoppingCriteria: true right after the token that closes the object. """
+
+    def __init__(self, state: DecodeState):
+        self.state = state
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.state.sync(input_ids[0])
+        return self.state.done
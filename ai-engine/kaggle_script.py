@@ -8,11 +8,14 @@
 #    - HF_TOKEN        : HuggingFace token (must have medgemma access)
 #    - NGROK_AUTH_TOKEN: ngrok auth token (free at ngrok.com)
 #    - GEMINI_API_KEY  : Google Gemini API key
-# 3. Paste this entire script into a cell and run it
-# 4. Copy the printed VITE_AI_SERVICE_URL into your .env file
+# 3. Upload the helper modules from ai-engine/ (metrics.py, tracing.py, structured_logging.py, text_dedup.py, llm.py,
+#    rate_limit.py, wire_encoding.py, json_extract.py, constrained_json.py, decode_budget.py) to /kaggle/working
+#    (or next to this script) so they can be imported
+# 4. Paste this entire script into a cell and run it
+# 5. Copy the printed VITE_AI_SERVICE_URL into your .env file
 # ============================================================
 
-import os, sys, json, io, subprocess, asyncio
+import os, sys, json, io, subprocess, asyncio, time, logging
 
 # --- INSTALL ---
 subprocess.run([sys.executable, "-m", "pip", "install", "-q",
@@ -23,15 +26,31 @@ subprocess.run([sys.executable, "-m", "pip", "install", "-q",
 
 import torch, re
 from PIL import Image
-import google.generativeai as genai
 import nest_asyncio
 nest_asyncio.apply()
-from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig
+from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig, StoppingCriteria, StoppingCriteriaList, LogitsProcessorList
 from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 import uvicorn
 from pyngrok import ngrok, conf
 
+# Helper modules shipped next to this script (notebook cells have no __file__)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else os.getcwd())
+os.environ.setdefault("TRACE_SERVICE_NAME", "medgemma-engine")
+import metrics
+import tracing
+import structured_logging
+from text_dedup import deduplicate_sentences
+import llm  # LLM_PROVIDER=fake runs the engine without network access
+import wire_encoding
+import json_extract
+import constrained_json
+import decode_budget
+
+structured_logging.setup_logging()
+logger = logging.getLogger("MedGemma-Engine")
+
 # Confirmed working Gemini models for this API key
 # gemini-flash-lite-latest = confirmed working for this API key
 # gemini-2.0-flash* = 429 rate limited (works when quota resets)
@@ -48,21 +67,20 @@ WORKING_GEMINI_MODEL = None  # set after startup detection
 
 def detect_gemini_model():
     global WORKING_GEMINI_MODEL
-    if not GEMINI_API_KEY:
-        print("⚠️ No GEMINI_API_KEY — chat/symptom analysis unavailable")
+    if not GEMINI_API_KEY and llm.get_provider().name != "fake":
+        logger.warning("No GEMINI_API_KEY - chat/symptom analysis unavailable")
         return
-    print("\n🔍 Auto-detecting working Gemini model...")
+    logger.info("Auto-detecting working Gemini model...")
     for m in GEMINI_MODELS:
         try:
-            gm = genai.GenerativeModel(m)
-            resp = gm.generate_content("Say OK")
-            if resp and resp.text:
+            text = llm.generate(m, "Say OK", priority="chat")
+            if text:
                 WORKING_GEMINI_MODEL = m
-                print(f"✅ Gemini model confirmed: {m}")
+                logger.info(f"Gemini model confirmed: {m}")
                 return
         except Exception as e:
-            print(f"   ✗ {m}: {str(e)[:60]}")
-    print("❌ No working Gemini model found. Check GEMINI_API_KEY in Kaggle Secrets.")
+            logger.info(f"Gemini model {m} unavailable: {str(e)[:60]}")
+    logger.error("No working Gemini model found. Check GEMINI_API_KEY in Kaggle Secrets.")
 
 # --- AUTH ---
 HF_TOKEN = NGROK_TOKEN = GEMINI_API_KEY = None
@@ -72,19 +90,21 @@ try:
     HF_TOKEN = secrets.get_secret("HF_TOKEN")
     NGROK_TOKEN = secrets.get_secret("NGROK_AUTH_TOKEN")
     GEMINI_API_KEY = secrets.get_secret("GEMINI_API_KEY")
-    print("✅ All secrets loaded.")
+    logger.info("All secrets loaded.")
 except Exception as e:
-    print(f"⚠️ Secrets error: {e}")
+    logger.warning(f"Secrets error: {e}")
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    print("✅ Gemini configured.")
+if GEMINI_API_KEY or llm.get_provider().name == "fake":
+    llm.get_provider().configure(GEMINI_API_KEY)
+    logger.info("Gemini configured.")
     detect_gemini_model()  # find working model at startup
 
 # --- MODEL ---
 MODEL_ID = "google/medgemma-1.5-4b-it"
+# Local reports are decoded under constrained_json.REPORT_FIELDS (false = free text + repair)
+LOCAL_CONSTRAINED_JSON = os.getenv("LOCAL_CONSTRAINED_JSON", "true").lower() != "false"
 device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"🔧 Device: {device}")
+logger.info(f"Device: {device}")
 
 model = processor = None
 
@@ -92,18 +112,18 @@ if HF_TOKEN:
     from huggingface_hub import login
     try:
         login(token=HF_TOKEN)
-        print(f"📦 Loading {MODEL_ID}...")
+        logger.info(f"Loading {MODEL_ID}...")
         quant = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16)
         processor = AutoProcessor.from_pretrained(MODEL_ID, token=HF_TOKEN)
         model = AutoModelForImageTextToText.from_pretrained(
             MODEL_ID, quantization_config=quant, device_map="auto", token=HF_TOKEN
         )
         model.eval()
-        print("✅ MedGemma-1.5-4b-it loaded (4-bit)!")
+        logger.info("MedGemma-1.5-4b-it loaded (4-bit)")
     except Exception as e:
-        print(f"❌ Model load failed: {e} → using Gemini fallback")
+        logger.error(f"Model load failed: {e} -> using Gemini fallback")
 else:
-    print("⚠️ No HF_TOKEN → Gemini fallback only")
+    logger.warning("No HF_TOKEN -> Gemini fallback only")
 
 # --- APP ---
 app = FastAPI(title="MedGemma AI Engine")
@@ -116,7 +136,42 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "healthy", "model": MODEL_ID if model else "Gemini Fallback", "device": device}
+    return {"status": "healthy", "model": MODEL_ID if model else "Gemini Fallback", "device": device,
+            "decode_budgets": decode_budget.stats()}
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+class _FirstTokenTimer(StoppingCriteria):
+    """ No-op stopping criterion; its first call marks the end of prefill. """
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return False
+
+# Keys _local_inference guarantees on a parsed report
+LOCAL_REPORT_SCHEMA = {
+    "image_type": "medical",
+    "limitations": "AI analysis — verify with a licensed radiologist.",
+    "what_is_not_seen": "See findings above.",
+    "attention_regions": [],
+}
+
+_report_grammar = None
+
+def _get_report_grammar():
+    """ Compiled once per process; its allowed-token cache then serves every request. """
+    global _report_grammar
+    if _report_grammar is None:
+        vocab = constrained_json.TokenVocabulary.from_tokenizer(processor.tokenizer)
+        _report_grammar = constrained_json.SchemaGrammar(constrained_json.REPORT_FIELDS, vocab)
+        # The grammar bounds the report, so its budget is that bound rather than a learned one
+        decode_budget.STEPS["report_constrained"] = decode_budget.Step(_report_grammar.max_tokens(), json=True, adaptive=False)
+    return _report_grammar
 
 def _local_inference(image: Image.Image, prompt: str) -> dict:
     image = image.convert("RGB")
@@ -139,56 +194,48 @@ Findings must be specific to this scan."""
     
     input_len = inputs["input_ids"].shape[-1]
     
-    with torch.inference_mode():
+    timer = _FirstTokenTimer()
+    monitor = decode_budget.OutputMonitor("report")
+    if LOCAL_CONSTRAINED_JSON:
+        # Greedy: masking after top_p could leave no token; temperature 0.05 was near-greedy anyway.
+        # No repetition penalty: it would skew the masked distribution, and the grammar can't loop
+        state = _get_report_grammar().new_state(input_len)
+        step = "report_constrained"
+        decoding = dict(do_sample=False, logits_processor=LogitsProcessorList([state.logits_processor]))
+        stopping = [timer, state.stopping_criteria]
+    else:
+        state = None
+        step = "report"
+        decoding = dict(do_sample=True, temperature=0.05, top_p=0.9,  # very low temperature for clinical precision
+                        repetition_penalty=1.5)  # high penalty to stop the "honesty/camaraderie" loops
+        stopping = [timer, decode_budget.StopWhenComplete(processor, input_len, monitor)]
+    max_new_tokens = decode_budget.max_new_tokens(step)  # learned for free text; the grammar's bound when constrained
+    started = time.perf_counter()
+    with tracing.span("local.generate", input_tokens=input_len, constrained=LOCAL_CONSTRAINED_JSON,
+                      max_new_tokens=max_new_tokens) as span, torch.inference_mode():
         out = model.generate(
             **inputs,
-            max_new_tokens=300,        # Tighter limit to prevent rambling
-            do_sample=True,
-            temperature=0.05,          # Very low for clinical precision
-            repetition_penalty=1.5,    # High penalty to stop the "honesty/camaraderie" loops
-            top_p=0.9,
+            max_new_tokens=max_new_tokens,
+            stopping_criteria=StoppingCriteriaList(stopping),
+            **decoding,
         )
-    decoded = processor.decode(out[0][input_len:], skip_special_tokens=True).strip()
-    print(f"[MedGemma raw output]: {decoded[:500]}...")
-
-    def deduplicate_sentences(text):
-        if not text or not isinstance(text, str): return text
-        raw_sentences = [s.strip() for s in text.split(".") if s.strip()]
-        unique_sentences = []
-        for s in raw_sentences:
-            words = set(s.lower().split())
-            if not words: continue
-            is_dupe = False
-            for existing in unique_sentences:
-                existing_words = set(existing.lower().split())
-                intersection = words.intersection(existing_words)
-                if len(intersection) / max(len(words), 1) > 0.7:
-                    is_dupe = True
-                    break
-            if not is_dupe:
-                unique_sentences.append(s)
-        return ". ".join(unique_sentences[:8]) + "."
-
-    # Robust JSON extraction
-    result = None
-    try:
-        json_match = re.search(r'\{.*\}', decoded, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-    except:
-        # Partial JSON handle: try to extract just the image_findings value if JSON is cut off
-        findings_match = re.search(r'"image_findings":\s*"([^"]*)', decoded)
-        if findings_match:
-            result = {"image_findings": findings_match.group(1)}
-    
-    if result:
-        if "image_findings" in result:
-            result["image_findings"] = deduplicate_sentences(result["image_findings"])
-        
-        result.setdefault("image_type", "medical")
-        result.setdefault("limitations", "AI analysis — verify with a licensed radiologist.")
-        result.setdefault("what_is_not_seen", "See findings above.")
-        result.setdefault("attention_regions", [])
+        ended = time.perf_counter()
+        prefill_done = timer.first_token_at or ended
+        if span: span.set("prefill_ms", round((prefill_done - started) * 1000, 1))
+    generated = out.shape[-1] - input_len
+    if state and not state.done:
+        logger.warning("Constrained report did not close", extra={"left_grammar": state.failed, "tokens": generated})
+    metrics.observe("local_prefill", prefill_done - started, "medgemma-kaggle")
+    metrics.observe("local_decode", ended - prefill_done, "medgemma-kaggle")
+    reason = "json_closed" if state and state.done else monitor.reason
+    decode_budget.record(step, generated, max_new_tokens, reason, ended - prefill_done, "medgemma-kaggle")
+    decoded = monitor.finish(processor.decode(out[0][input_len:], skip_special_tokens=True))
+    logger.debug("MedGemma raw output", extra={"raw_output": decoded, "chars": len(decoded)})
+
+    # Single-pass extraction; a reply cut off by max_new_tokens is repaired rather than regex-scraped
+    result = json_extract.extract(decoded, LOCAL_REPORT_SCHEMA)
+    if result and result.get("image_findings"):
+        result["image_findings"] = deduplicate_sentences(result["image_findings"])
         return result
 
     # Last resort fallback: strip JSON-like keys from raw text
@@ -207,7 +254,6 @@ Findings must be specific to this scan."""
 def _gemini_inference(image: Image.Image, prompt: str) -> dict:
     for m in GEMINI_MODELS:
         try:
-            gm = genai.GenerativeModel(m)
             p = f"""You are a medical radiologist AI. Analyze this image.
 Clinical context: {prompt}
 
@@ -227,30 +273,32 @@ Return ONLY valid JSON (no markdown) with these exact keys:
     - severity: exactly one of: "normal", "mild", "moderate", "severe"
 
 If the image is NOT a medical scan, set image_type to "non-medical" and set attention_regions to []."""
-            resp = gm.generate_content([p, image])
-            text = resp.text.strip().replace("```json","").replace("```","").strip()
-            try: return json.loads(text)
-            except:
-                m2 = re.search(r'\{.*\}', text, re.DOTALL)
-                if m2: return json.loads(m2.group())
+            with tracing.span("gemini", model=m), metrics.timed("gemini", m):
+                text = llm.generate(m, [p, image], priority="analysis")
+            result = json_extract.extract(text)
+            if result is not None:
+                return result
         except Exception as e:
-            print(f"{m} failed: {e}")
+            logger.warning(f"Gemini {m} failed: {e}")
     return {"image_findings": "Analysis unavailable. Check Gemini API key.", "confidence": "low",
             "uncertainties": "API error", "followUps": ["Check Kaggle Secrets"]}
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    from datetime import datetime
-    now = datetime.now().strftime("%H:%M:%S")
+    # Same request id as the backend (X-Request-ID), so both services' lines correlate
+    structured_logging.new_request_id(request.headers.get("X-Request-ID"))
     # Log incoming requests (except heartbeat to avoid spam)
     if request.url.path not in ["/test", "/health", "/"]:
-        print(f"📥 [{now}] {request.method} {request.url.path}")
-    try:
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        print(f"❌ [{now}] Error: {str(e)}")
-        raise
+        logger.info("Request", extra={"method": request.method, "path": request.url.path})
+    # Continue the backend's trace (traceparent header) so both hops land in one trace
+    with tracing.start_trace(f"engine {request.method} {request.url.path}", request.headers.get("traceparent")) as span:
+        try:
+            response = await call_next(request)
+            if span: span.set("http.status_code", response.status_code)
+            return response
+        except Exception as e:
+            logger.exception(f"Unhandled error on {request.url.path}")
+            raise
 
 # CORS MUST BE ADDED LAST TO BE OUTERMOST (Handles OPTIONS first)
 # allow_credentials=True is incompatible with origins="*"
@@ -259,7 +307,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_credentials=False,
     allow_methods=["*"],
-    allow_headers=["Content-Type", "Authorization", "ngrok-skip-browser-warning"]
+    allow_headers=["Content-Type", "Authorization", "ngrok-skip-browser-warning", "traceparent", "X-Request-ID"]
 )
 
 @app.get("/test")
@@ -269,14 +317,22 @@ def test_connection():
 @app.post("/analyze")
 async def analyze(image: UploadFile = File(...), prompt: str = Form("")):
     try:
-        content = await image.read()
-        print(f"📸 Image received: {len(content)} bytes")
-        pil = Image.open(io.BytesIO(content))
+        with metrics.timed("upload_read", "form"):
+            content = await image.read()
+        logger.debug("Image received", extra={"bytes": len(content)})
+        with tracing.span("preprocess", bytes=len(content)), metrics.timed("decode", "pil"):
+            # PNG / WebP / JPEG or the backend's raw format (WIRE_ENCODING)
+            pil = wire_encoding.decode(content).convert("RGB")
         if not prompt: prompt = "Describe the medical findings in this image."
-        result = _local_inference(pil, prompt) if (model and processor) else _gemini_inference(pil, prompt)
+        if model and processor:
+            with tracing.span("inference.local"):
+                result = _local_inference(pil, prompt)
+        else:
+            with tracing.span("inference.gemini_fallback"):
+                result = _gemini_inference(pil, prompt)
         return result
     except Exception as e:
-        print(f"❌ Analysis Error: {str(e)}")
+        logger.exception("Analysis error")
         return {"error": str(e), "image_findings": "Analysis failed on Kaggle engine."}
 
 @app.post("/symptom_analysis")
@@ -284,32 +340,35 @@ async def symptom_analysis(problem: str = Form(...)):
     models_to_try = ([WORKING_GEMINI_MODEL] if WORKING_GEMINI_MODEL else []) + GEMINI_MODELS
     for m in dict.fromkeys(models_to_try):
         try:
-            gm = genai.GenerativeModel(m)
             p = f"""Medical AI. Patient says: "{problem}"
 Return ONLY valid JSON with keys:
 - why: detailed medical explanation (2-3 paragraphs)
 - what_to_do: numbered list of actionable steps
 - red_flags: list of emergency warning signs"""
-            resp = gm.generate_content(p)
-            text = resp.text.strip().replace("```json","").replace("```","").strip()
-            return json.loads(text)
+            with metrics.timed("gemini", m):
+                text = llm.generate(m, p, priority="symptom")
+            result = json_extract.extract(text)
+            if result is None:
+                raise ValueError("no JSON object in reply")
+            return result
         except Exception as e:
-            print(f"Symptom {m} failed: {e}")
+            logger.warning(f"Symptom {m} failed: {e}")
     return {"why": "Unable to analyze.", "what_to_do": ["See a doctor"], "red_flags": ["Difficulty breathing", "Chest pain"]}
 
 def _chat_response(message: str) -> str:
     models_to_try = ([WORKING_GEMINI_MODEL] if WORKING_GEMINI_MODEL else []) + GEMINI_MODELS
     for m in dict.fromkeys(models_to_try):
         try:
-            print(f"[Chat] Trying {m}...")
-            gm = genai.GenerativeModel(m)
-            result = gm.generate_content(
-                f"You are MedGemma, a helpful medical AI assistant. Answer the following question clearly and helpfully: {message}"
-            ).text
-            print(f"[Chat] ✅ {m} responded successfully.")
+            logger.debug(f"Chat: trying {m}")
+            with metrics.timed("gemini", m):
+                result = llm.generate(
+                    m, f"You are MedGemma, a helpful medical AI assistant. Answer the following question clearly and helpfully: {message}",
+                    priority="chat",
+                )
+            logger.debug(f"Chat: {m} responded")
             return result
         except Exception as e:
-            print(f"[Chat] ❌ {m} failed: {e}")
+            logger.warning(f"Chat: {m} failed: {e}")
             continue
     return "I'm having trouble connecting to the AI. Please check the Kaggle Gemini API key."
 
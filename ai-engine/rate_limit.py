@@ -0,0 +1,203 @@
+"""
+Client-side Gemini quota: a requests-per-minute and a tokens-per-minute bucket per model,
+shared by every caller in the process (analysis, symptom lookup, chat).
+
+    rate_limit.acquire("gemini-2.0-flash", tokens=900, priority="analysis")
+
+A call that can't be paid for right away queues; queued calls are served by priority class
+(analysis, then symptom, then chat) and lower classes may not dip into the last
+RATE_LIMIT_RESERVES fraction of a bucket, so chat degrades first. A call that can't be
+granted before its class deadline raises RateLimited immediately, instead of spending quota
+on a request Gemini would answer with 429. When Gemini does answer 429 anyway (the quota is
+shared with other processes), penalize() empties the model's buckets so callers back off.
+
+Limits come from RATE_LIMITS="model=rpm/tpm,..." (unknown models use RATE_LIMIT_DEFAULT).
+RATE_LIMIT_ENABLED=auto limits the real Gemini provider only, so offline fakes stay unthrottled.
+Remaining budget is exported as medgemma_ratelimit_remaining on /metrics.
+The same file is shipped with the Kaggle engine.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+try:
+    from . import metrics
+except ImportError:  # flat layout next to kaggle_script.py
+    import metrics
+
+logger = logging.getLogger("MedGemma-RateLimit")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "auto").lower()  # auto | true | false
+
+def _pairs(value: str) -> Dict[str, str]:
+    return {k.strip(): v.strip() for k, v in (item.split("=", 1) for item in value.split(",") if "=" in item)}
+
+def _limits(value: str) -> Tuple[float, float]:
+    rpm, _, tpm = value.partition("/")
+    return float(rpm), float(tpm or "inf")
+
+# Free-tier defaults; override per key with RATE_LIMITS
+RATE_LIMITS = {model: _limits(v) for model, v in _pairs(os.getenv(
+    "RATE_LIMITS",
+    "gemini-flash-lite-latest=15/250000,gemini-2.0-flash-lite=30/1000000,gemini-2.0-flash=15/1000000,"
+    "gemini-1.5-flash=15/1000000")).items()}
+RATE_LIMIT_DEFAULT = _limits(os.getenv("RATE_LIMIT_DEFAULT", "15/1000000"))
+
+PRIORITIES = ("analysis", "symptom", "chat")  # highest first
+RATE_LIMIT_DEADLINES = {k: float(v) for k, v in _pairs(os.getenv(
+    "RATE_LIMIT_DEADLINES", "analysis=30,symptom=10,chat=3")).items()}  # max seconds queued
+RATE_LIMIT_RESERVES = {k: float(v) for k, v in _pairs(os.getenv(
+    "RATE_LIMIT_RESERVES", "analysis=0,symptom=0.1,chat=0.25")).items()}  # bucket fraction kept for higher classes
+
+# Token estimates: Gemini bills an image as a fixed 258 tokens; output is charged up front
+# and settled once the answer's length is known
+IMAGE_TOKENS = 258
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "512"))
+
+RATE_LIMIT_REQUESTS = metrics.register(metrics.Counter(
+    "medgemma_ratelimit_requests_total",
+    "Gemini calls through the local limiter by model, priority and outcome "
+    "(granted, rejected = would miss its deadline, upstream_429 = Gemini rejected it anyway).",
+    ("model", "priority", "outcome"),
+))
+
+class RateLimited(Exception):
+    status = 429
+
+def estimate_tokens(contents) -> int:
+    """ Rough prompt size: ~4 characters per token for text, IMAGE_TOKENS per image. """
+    parts = [contents] if isinstance(contents, str) else list(contents)
+    return sum(len(p) // 4 + 1 if isinstance(p, str) else IMAGE_TOKENS for p in parts)
+
+class TokenBucket:
+    """ Refills continuously at per_minute / 60 per second, holding at most one minute's worth. """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_s(self, amount: float, floor: float = 0.0) -> float:
+        """ Seconds until `amount` can be taken while leaving `floor` behind (0 if it can now). """
+        missing = amount + floor - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate else float("inf")
+
+class ModelLimiter:
+    def __init__(self, model: str, rpm: float, tpm: float):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cond = threading.Condition()
+        self.queue = []  # heap of (priority rank, arrival seq)
+        self.seq = itertools.count()
+
+    def _wait_s(self, tokens: float, reserve: float) -> float:
+        tokens = min(tokens, self.tokens.capacity)
+        return max(self.requests.wait_s(1, reserve * self.requests.capacity),
+                   self.tokens.wait_s(tokens, reserve * self.tokens.capacity))
+
+    def acquire(self, tokens: float, priority: str = "chat", deadline_s: float = None):
+        rank = PRIORITIES.index(priority) if priority in PRIORITIES else len(PRIORITIES)
+        reserve = RATE_LIMIT_RESERVES.get(priority, 0.0)
+        started = time.monotonic()
+        deadline = started + (RATE_LIMIT_DEADLINES.get(priority, 10.0) if deadline_s is None else deadline_s)
+        ticket = (rank, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.queue, ticket)
+            self.cond.notify_all()  # a higher class may now be first in line
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    first = self.queue[0] == ticket
+                    wait = self._wait_s(tokens, reserve) if first else None
+                    if wait == 0:
+                        self.requests.tokens -= 1
+                        self.tokens.tokens -= min(tokens, self.tokens.capacity)
+                        self._record(priority, "granted", now - started)
+                        return
+                    if first and now + wait > deadline or now >= deadline:
+                        self._record(priority, "rejected", now - started)
+                        reason = f"next slot in {wait:.1f}s" if first else "queued behind other calls"
+                        raise RateLimited(f"{self.model}: local {priority} budget exhausted ({reason})")
+                    self.cond.wait(min(wait, deadline - now) if first else deadline - now)
+            finally:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+
+    def settle(self, charged: float, used: float):
+        """ Returns (or takes) the difference between the up-front estimate and the real usage. """
+        with self.cond:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + charged - used)
+            self.cond.notify_all()
+
+    def penalize(self):
+        with self.cond:
+            self.requests.tokens = min(self.requests.tokens, 0)
+            self.tokens.tokens = min(self.tokens.tokens, 0)
+
+    def _record(self, priority: str, outcome: str, waited: float):
+        RATE_LIMIT_REQUESTS.inc(self.model, priority, outcome)
+        metrics.observe("ratelimit_wait", waited, self.model, outcome)
+        if outcome == "rejected":
+            logger.warning("Gemini call rejected by the local rate limiter", extra={"model": self.model, "priority": priority})
+
+    def remaining(self) -> Dict[str, float]:
+        with self.cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {"requests": round(self.requests.tokens, 2), "tokens": round(self.tokens.tokens, 1),
+                    "queued": len(self.queue)}
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def limiter(model: str) -> ModelLimiter:
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(model, *RATE_LIMITS.get(model, RATE_LIMIT_DEFAULT))
+        return _limiters[model]
+
+def enabled(provider_name: str) -> bool:
+    if RATE_LIMIT_ENABLED == "auto":
+        return provider_name == "gemini"
+    return RATE_LIMIT_ENABLED == "true"
+
+def acquire(model: str, tokens: float, priority: str = "chat", deadline_s: float = None):
+    """ Blocks until `model` has budget for one call of `tokens`; raises RateLimited past the deadline. """
+    limiter(model).acquire(tokens, priority, deadline_s)
+
+def penalize(model: str):
+    RATE_LIMIT_REQUESTS.inc(model, "-", "upstream_429")
+    limiter(model).penalize()
+
+def stats() -> dict:
+    return {model: lim.remaining() for model, lim in list(_limiters.items())}
+
+def _remaining_series():
+    series = {}
+    for model, remaining in stats().items():
+        series[(model, "requests")] = remaining["requests"]
+        series[(model, "tokens")] = remaining["tokens"]
+    return series
+
+REMAINING = metrics.register(metrics.Gauge(
+    "medgemma_ratelimit_remaining",
+    "Budget left in each model's local rate-limit buckets (requests and tokens per minute).",
+    ("model", "kind"),
+    _remaining_series,
+))
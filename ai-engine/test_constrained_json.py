@@ -0,0 +1,83 @@
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from constrained_json import REPORT_FIELDS, Choice, SchemaGrammar, String, StringList, TokenVocabulary
+
+# Every printable character plus a few merged tokens like a real vocabulary has
+TEXTS = [""] + [chr(i) for i in range(32, 127)] + ["\n", " the", " lungs", " clear", '."', '", "', '"}', '"]', ' "', "medical", 'a\\"', '"x']
+
+def decode(grammar, pick, limit=1000):
+    state = grammar.new_state()
+    tokens = []
+    while not state.done and len(tokens) < limit:
+        token = pick(state.allowed())
+        tokens.append(token)
+        state.advance(token)
+    return state, "".join(TEXTS[t] for t in tokens)
+
+class TestSchemaGrammar(unittest.TestCase):
+    def setUp(self):
+        self.vocab = TokenVocabulary(TEXTS, eos_token_id=0)
+
+    def test_random_walks_always_close_as_valid_reports(self):
+        grammar = SchemaGrammar(REPORT_FIELDS, self.vocab)
+        rng = random.Random(0)
+        for _ in range(100):
+            state, text = decode(grammar, lambda allowed: int(rng.choice(allowed)))
+            self.assertTrue(state.done)
+            report = json.loads(text)
+            self.assertEqual(list(report), [key for key, _ in REPORT_FIELDS])
+            self.assertIn(report["image_type"], ("medical", "non-medical"))
+            self.assertTrue(1 <= len(report["abnormalities"]) <= 4)
+            self.assertTrue(all(report.values()))
+            self.assertEqual(list(state.allowed()), [0])  # only EOS after the closing brace
+
+    def test_max_tokens_bounds_every_walk(self):
+        grammar = SchemaGrammar(REPORT_FIELDS, self.vocab)
+        rng = random.Random(1)
+        single_chars = [i for i, t in enumerate(TEXTS) if len(t) == 1 and t != '"']
+
+        def longest(allowed):  # keep writing content one character at a time, else any token
+            content = [t for t in allowed if t in single_chars]
+            return rng.choice(content) if content else int(rng.choice(allowed))
+        for pick in [lambda allowed: int(rng.choice(allowed))] * 20 + [longest] * 20:
+            state = grammar.new_state()
+            tokens = 0
+            while not state.done:
+                state.advance(pick(state.allowed()))
+                tokens += 1
+            self.assertLessEqual(tokens, grammar.max_tokens())
+
+    def test_string_budget_forces_the_close(self):
+        grammar = SchemaGrammar([("note", String(max_tokens=3)), ("tags", StringList(max_items=2, max_tokens=2))], self.vocab)
+        lungs = TEXTS.index(" lungs")
+        # Always prefer " lungs" (a content token); the grammar must still close every string
+        state, text = decode(grammar, lambda allowed: lungs if lungs in allowed else int(allowed[0]))
+        self.assertTrue(state.done)
+        self.assertEqual(json.loads(text), {"note": " lungs lungs lungs", "tags": [" lungs lungs", " lungs lungs"]})
+
+    def test_merged_closing_token_and_unsafe_tokens(self):
+        grammar = SchemaGrammar([("a", String()), ("b", Choice(("x", "y")))], self.vocab)
+        state = grammar.new_state()
+        for char in '{"a": "ok':
+            state.advance(TEXTS.index(char))
+        allowed = set(state.allowed().tolist())
+        self.assertIn(TEXTS.index('."'), allowed)       # closes the string with content
+        self.assertIn(TEXTS.index('", "'), allowed)     # closes it and starts the next key
+        self.assertNotIn(TEXTS.index('"x'), allowed)    # '"x' doesn't continue ', "b": '
+        self.assertNotIn(TEXTS.index('a\\"'), allowed)  # a backslash never enters a string
+        self.assertNotIn(TEXTS.index("\n"), allowed)
+
+    def test_out_of_grammar_token_disables_masking(self):
+        state = SchemaGrammar(REPORT_FIELDS, self.vocab).new_state(prompt_len=2)
+        state.sync([5, 6, TEXTS.index("x")])
+        self.assertTrue(state.failed)
+        self.assertFalse(state.done)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from text_dedup import SentenceDeduplicator, deduplicate_sentences
+
+def pairwise_dedup(text, max_sentences=8):
+    """ The original all-pairs set comparison, kept as the reference behaviour. """
+    kept = []
+    for s in (s.strip() for s in text.split(".") if s.strip()):
+        words = set(s.lower().split())
+        if not any(len(words & set(k.lower().split())) / len(words) > 0.7 for k in kept):
+            kept.append(s)
+    return ". ".join(kept[:max_sentences]) + "."
+
+def looping_report(sentences, seed):
+    rng = random.Random(seed)
+    subjects = ["the lungs", "the heart", "the left hilum", "the right costophrenic angle", "the mediastinum", "the spine"]
+    findings = ["are clear", "appear clear", "is within normal limits", "shows mild degenerative change",
+                "is not enlarged", "has no focal consolidation", "remains unremarkable"]
+    fillers = ["", "overall ", "again ", "notably ", "on this film "]
+    return ". ".join(rng.choice(fillers) + rng.choice(subjects) + " " + rng.choice(findings)
+                     for _ in range(sentences)) + "."
+
+class TestDeduplicateSentences(unittest.TestCase):
+    def test_matches_pairwise_reference(self):
+        for seed in range(30):
+            text = looping_report(random.Random(seed).randint(1, 120), seed)
+            self.assertEqual(deduplicate_sentences(text), pairwise_dedup(text))
+
+    def test_streamed_matches_whole_text(self):
+        for seed in range(10):
+            text = looping_report(200, seed)
+            dedup = SentenceDeduplicator(max_sentences=None)
+            for i in range(0, len(text), 5):
+                dedup.feed(text[i:i + 5])
+            self.assertEqual(dedup.finish(), pairwise_dedup(text, max_sentences=None))
+
+    def test_loop_and_edge_cases(self):
+        self.assertEqual(deduplicate_sentences("The lungs are clear. The lungs are clear. Heart normal."),
+                         "The lungs are clear. Heart normal.")
+        self.assertEqual(deduplicate_sentences(""), "")
+        self.assertIsNone(deduplicate_sentences(None))
+        dedup = SentenceDeduplicator(max_sentences=2)
+        dedup.feed("one two. three four. five six. seven")
+        self.assertTrue(dedup.full)
+        self.assertEqual(dedup.finish(), "one two. three four.")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Sentence-level de-duplication for generated reports.
+
+MedGemma tends to loop ("The lungs are clear. The lungs appear clear. ..."); a sentence whose
+words mostly overlap an earlier one (more than 70% of its distinct words appear in a kept
+sentence) is dropped and the report is capped at eight sentences.
+
+Each word is hashed to a small integer id once, so a sentence becomes a bitset (a Python int)
+and the overlap with a kept sentence is one AND plus a popcount. Kept sentences are found
+through an inverted index with prefix filtering: an overlap above the threshold is only
+possible if the kept sentence contains one of the new sentence's first few words (in a fixed
+order, rarest first), so most kept sentences are never compared. That keeps long reports
+near-linear, and SentenceDeduplicator applies the same filter incrementally to streamed text.
+Kept in its own module (rather than nested in kaggle_script._local_inference) so it can be
+benchmarked and tested without loading the engine.
+"""
+from collections import Counter
+from typing import Dict, List, Optional
+
+DUPLICATE_OVERLAP = 0.7
+MAX_SENTENCES = 8
+
+class SentenceDeduplicator:
+    """
+    Feed text (whole or in chunks); sentences end at ".". `sentences` holds the kept ones,
+    `full` turns True once `max_sentences` are kept - later text can't change the result.
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_OVERLAP, max_sentences: Optional[int] = MAX_SENTENCES,
+                 rank: Optional[Dict[str, int]] = None):
+        self.threshold = threshold
+        self.max_sentences = max_sentences
+        self.sentences: List[str] = []
+        self.ids: Dict[str, int] = {}          # word -> bit index
+        self.postings: Dict[int, List[int]] = {}  # word id -> kept sentence indices
+        self.bitsets: List[int] = []            # per kept sentence
+        self.rank = rank                        # word -> prefix order (lower = rarer); default: newest word first
+        self.pending = ""
+
+    @property
+    def full(self) -> bool:
+        return self.max_sentences is not None and len(self.sentences) >= self.max_sentences
+
+    def _order(self, word: str):
+        return self.rank.get(word, 0) if self.rank is not None else -self.ids[word]
+
+    def add(self, sentence: str) -> bool:
+        """ Considers one sentence; returns True if it was kept. """
+        sentence = sentence.strip()
+        words = set(sentence.lower().split())
+        if not words or self.full:
+            return False
+        bits = 0
+        for word in words:
+            bits |= 1 << self.ids.setdefault(word, len(self.ids))
+        # A duplicate shares `needed` words (overlap / |words| > threshold), so it shares at
+        # least one of any |words| - needed + 1 of them - the rarest make the fewest candidates
+        needed = int(self.threshold * len(words))
+        while needed / len(words) <= self.threshold:
+            needed += 1
+        prefix = sorted(words, key=self._order)[:len(words) - needed + 1]
+        seen = set()
+        for word in prefix:
+            for index in self.postings.get(self.ids[word], ()):
+                if index not in seen:
+                    seen.add(index)
+                    if (bits & self.bitsets[index]).bit_count() >= needed:
+                        return False
+        index = len(self.sentences)
+        self.sentences.append(sentence)
+        self.bitsets.append(bits)
+        for word in words:
+            self.postings.setdefault(self.ids[word], []).append(index)
+        return True
+
+    def feed(self, chunk: str) -> List[str]:
+        """ Adds the sentences completed by `chunk`; returns the newly kept ones. """
+        *complete, self.pending = (self.pending + chunk).split(".")
+        return [s.strip() for s in complete if not self.full and self.add(s)]
+
+    def finish(self) -> str:
+        if self.pending.strip():
+            self.add(self.pending)
+        self.pending = ""
+        return self.text()
+
+    def text(self) -> str:
+        return ". ".join(self.sentences) + "."
+
+def deduplicate_sentences(text):
+    if not text or not isinstance(text, str): return text
+    raw_sentences = [s for s in text.split(".") if s.strip()]
+    # Whole text known up front: rarest words first gives the shortest candidate lists
+    frequency = Counter(word for s in raw_sentences for word in set(s.lower().split()))
+    dedup = SentenceDeduplicator(rank=frequency)
+    for sentence in raw_sentences:
+        if dedup.full:
+            break
+        dedup.add(sentence)
+    return dedup.text()
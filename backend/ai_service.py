@@ -7,7 +7,6 @@ import numpy as np
 import pydicom
 from PIL import Image
 # from transformers import pipeline  # MOVED TO LAZY
-import google.generativeai as genai
 import os
 import json
 import requests
@@ -19,10 +18,11 @@ env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
 from . import ethical_ai_logic as ethical
+from . import metrics, tracing, structured_logging, llm, hedging, semantic_cache, singleflight, wire_encoding, json_extract, decode_budget
 
-# Configure Logging
+# Configure Logging (JSON lines via a background queue listener; see structured_logging)
 logger = logging.getLogger("MedGemma-Service")
-logging.basicConfig(level=logging.INFO)
+structured_logging.setup_logging()
 
 # --- CONFIGURATION ---
 MODEL_ID = "google/paligemma-3b-ft-docvqa-448"
@@ -43,45 +43,62 @@ processor = None
 # Original load_models removed to avoid duplication. See bottom of file.
 
 def configure_genai(api_key: str):
-    """ Configure Google Gemini API """
+    """ Configure Google Gemini API (or whichever provider LLM_PROVIDER selects) """
+    provider = llm.get_provider()
+    if provider.name == "fake":
+        logger.info("Using the simulated LLM provider (LLM_PROVIDER=fake).")
+        return
     if not api_key:
         logger.warning("No Gemini API Key provided. AI will run in mock mode.")
         return
-    genai.configure(api_key=api_key)
+    provider.configure(api_key)
     logger.info("Google Gemini API configured.")
 
 def _call_remote_engine(endpoint: str, data: dict = None, files: dict = None) -> Optional[dict]:
     """ Helper to call the remote Kaggle MedGemma engine. """
     remote_url = os.getenv("AI_SERVICE_URL")
     if not remote_url or "localhost" in remote_url or "127.0.0.1" in remote_url:
-        print(f"DEBUG: Skipping remote call (Local/Mock mode active). URL: {remote_url}")
+        logger.debug("Skipping remote call (local/mock mode)", extra={"endpoint": endpoint, "url": remote_url})
         return None
     
+    started = time.perf_counter()
+    outcome = "error"
     try:
         url = f"{remote_url.rstrip('/')}/{endpoint.lstrip('/')}"
-        print(f"📡 DEBUG: Sending {endpoint} to Kaggle AI: {url}")
-        
-        headers = {"ngrok-skip-browser-warning": "true"}
+        logger.debug("Sending to remote engine", extra={"endpoint": endpoint, "url": url})
         
-        if files:
-            resp = requests.post(url, data=data, files=files, headers=headers, timeout=60)
-        else:
-            resp = requests.post(url, data=data, headers=headers, timeout=30)
+        with tracing.span(f"remote.{endpoint}", url=url) as span:
+            headers = tracing.inject({"ngrok-skip-browser-warning": "true"})
+            if structured_logging.request_id_var.get():
+                headers["X-Request-ID"] = structured_logging.request_id_var.get()
+            
+            if files:
+                resp = requests.post(url, data=data, files=files, headers=headers, timeout=60)
+            else:
+                resp = requests.post(url, data=data, headers=headers, timeout=30)
+            if span: span.set("http.status_code", resp.status_code)
             
         if resp.status_code == 200:
-            print(f"DEBUG: Success from remote {endpoint}")
+            logger.debug("Remote engine success", extra={"endpoint": endpoint})
+            outcome = "ok"
             return resp.json()
-        print(f"DEBUG: Remote error {resp.status_code}: {resp.text[:100]}")
+        outcome = f"http_{resp.status_code}"
+        logger.warning("Remote engine error", extra={"endpoint": endpoint, "status_code": resp.status_code, "response": resp.text[:100]})
     except Exception as e:
-        print(f"DEBUG: Remote connection Exception: {e}")
+        outcome = "timeout" if isinstance(e, requests.Timeout) else "error"
+        logger.warning(f"Remote engine unreachable: {e}", extra={"endpoint": endpoint})
+    finally:
+        metrics.observe("remote", time.perf_counter() - started, f"kaggle:{endpoint}", outcome)
     return None
 
-def process_medical_image(file_bytes: bytes, filename: str) -> Image.Image:
-    """ Handles DICOM windowing, resizing, and normalization. """
+def decode_medical_image(file_bytes: bytes, filename: str) -> Image.Image:
+    """ Decodes an upload at native resolution, applying DICOM rescale + windowing. """
     try:
         if filename.lower().endswith('.dcm'):
-            dicom_data = pydicom.dcmread(io.BytesIO(file_bytes))
-            pixel_array = dicom_data.pixel_array.astype(float)
+            with metrics.timed("decode", "pydicom"):
+                dicom_data = pydicom.dcmread(io.BytesIO(file_bytes))
+                pixel_array = dicom_data.pixel_array.astype(float)
+            windowing_started = time.perf_counter()
             
             slope = getattr(dicom_data, 'RescaleSlope', 1)
             intercept = getattr(dicom_data, 'RescaleIntercept', 0)
@@ -100,14 +117,35 @@ def process_medical_image(file_bytes: bytes, filename: str) -> Image.Image:
             pixel_array = (pixel_array * 255).astype(np.uint8)
             image = Image.fromarray(pixel_array)
             if len(image.split()) == 1: image = image.convert("RGB")
-        else:
-            image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-        
-        return image.resize((448, 448), Image.Resampling.LANCZOS)
+            metrics.observe("windowing", time.perf_counter() - windowing_started, "numpy")
+            return image
+        with metrics.timed("decode", "pil"):
+            return Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    except Exception as e:
+        logger.error(f"Image decoding failed: {e}")
+        raise ValueError("Invalid image format.")
+
+@tracing.traced("preprocess")
+def process_medical_image(file_bytes: bytes, filename: str) -> Image.Image:
+    """ Handles DICOM windowing, resizing, and normalization. """
+    image = decode_medical_image(file_bytes, filename)
+    try:
+        with metrics.timed("resize", "pil"):
+            return image.resize((448, 448), Image.Resampling.LANCZOS)
     except Exception as e:
         logger.error(f"Image processing failed: {e}")
         raise ValueError("Invalid image format.")
 
+def _labels_are_medical(results: List[dict]) -> bool:
+    label = results[0]['label'].lower()
+    if "radiograph" in label: return True
+    
+    for res in results[:3]:
+        if any(allow in res['label'].lower() for allow in ALLOWED_LABELS) and res['score'] > 0.05:
+            return True
+    return False
+
+@tracing.traced("gate")
 def classify_is_medical(image: Image.Image) -> bool:
     """ Returns True if image is likely medical/radiology. """
     if not classifier:
@@ -115,20 +153,28 @@ def classify_is_medical(image: Image.Image) -> bool:
         return True  # Allow image to proceed to Gemini analysis
 
     try:
-        results = classifier(image)
-        top_result = results[0]
-        label = top_result['label'].lower()
-        
-        if "radiograph" in label: return True
-        
-        for res in results[:3]:
-            if any(allow in res['label'].lower() for allow in ALLOWED_LABELS) and res['score'] > 0.05:
-                return True
-        return False
+        with metrics.timed("gate", CLASSIFIER_ID) as stage:
+            is_medical = _labels_are_medical(classifier(image))
+            stage.outcome = "accepted" if is_medical else "rejected"
+        return is_medical
     except Exception as e:
         logger.error(f"Classification error: {e}")
         return False
 
+def classify_is_medical_batch(images: List[Image.Image]) -> List[bool]:
+    """ Batched gating: one classifier forward pass for the whole list. """
+    if not classifier:
+        logger.warning("Classifier absent. Defaulting to permissive mode (allowing images through).")
+        return [True] * len(images)
+
+    try:
+        with metrics.timed("gate", f"{CLASSIFIER_ID}:batch"):
+            return [_labels_are_medical(results) for results in classifier(images, batch_size=len(images))]
+    except Exception as e:
+        logger.error(f"Batch classification error: {e}")
+        return [False] * len(images)
+
+@tracing.traced("fallback.mock")
 def analyze_image_mock(image: Image.Image, prompt: str) -> dict:
     """ 
     Simulates the strict medical analysis if full weights aren't loaded.
@@ -166,28 +212,36 @@ def analyze_image_mock(image: Image.Image, prompt: str) -> dict:
         "suggested_review": ["Clinical Correlation Required"] if has_abnormality else ["Routine Follow-up"]
     }
 
+@tracing.traced("inference")
 def analyze_with_gemini(image: Image.Image, prompt: str) -> dict:
     """
-    Analyze image using Google Gemini 1.5 Flash.
-    Falls back to mock analysis if API fails.
+    Analyze image with the remote Kaggle engine, hedged with Google Gemini 1.5 Flash
+    (see hedging). Falls back to mock analysis if both fail.
+    Concurrent calls for the same image and prompt share one analysis (see singleflight).
     """
+    return singleflight.do("analyze", singleflight.image_key(image, prompt), lambda: _analyze(image, prompt))
+
+def _analyze(image: Image.Image, prompt: str) -> dict:
     if os.getenv("FORCE_LOCAL_MODEL") == "true":
         return analyze_with_local_model(image, prompt)
 
-    # --- TRY REMOTE KAGGLE ENGINE FIRST ---
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    files = {'image': ('image.png', img_byte_arr.getvalue(), 'image/png')}
-    remote_res = _call_remote_engine("analyze", data={'prompt': prompt}, files=files)
-    if remote_res:
-        logger.info("Successfully used Remote Kaggle Engine for analysis.")
-        return remote_res
+    # Encoded once per image (WIRE_ENCODING); the Gemini side reuses the same bytes
+    with metrics.timed("wire_encode", wire_encoding.WIRE_ENCODING):
+        encoded = wire_encoding.cached_encode(image)
+    files = {'image': (encoded.filename, encoded.data, encoded.media_type)}
+    result = hedging.hedged_call(
+        "analyze",
+        lambda: _call_remote_engine("analyze", data={'prompt': prompt}, files=files),
+        lambda: _gemini_analysis(image, prompt),
+    )
+    if result is None:
+        logger.info("Falling back to Mock Analysis")
+        return analyze_image_mock(image, prompt)
+    return result
 
-    # --- FALLBACK TO GEMINI ---
-    try:
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        full_prompt = f"""
+def _gemini_analysis(image: Image.Image, prompt: str) -> dict:
+    """ Gemini 1.5 Flash analysis; raises if the API call fails. """
+    full_prompt = f"""
 You are an expert medical radiologist AI. Analyze the provided medical image carefully and produce a detailed clinical report.
 
 Clinical Context: {prompt}
@@ -205,36 +259,23 @@ Return ONLY a valid JSON object (no markdown, no code blocks) with these exact k
 
 IMPORTANT: Even if the image is unclear, provide your best clinical interpretation. Always include detailed image_findings.
 """
-        
-        response = gemini_model.generate_content([full_prompt, image])
-        text = response.text.strip()
-        # Clean any markdown
-        text = text.replace('```json', '').replace('```', '').strip()
-        
-        # Try to parse JSON
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Extract anything that looks like a JSON object
-            import re
-            match = re.search(r'\{.*\}', text, re.DOTALL)
-            if match:
-                return json.loads(match.group())
-            # If still failing, build result from raw text
-            return {
-                "image_type": "medical",
-                "image_findings": text[:500] if text else "Analysis complete. Please review image manually.",
-                "abnormality_location": "See findings",
-                "confidence": "moderate",
-                "what_is_not_seen": "Could not parse full response",
-                "limitations": "AI response was in non-standard format",
-                "suggested_review": ["Review with radiologist", "Repeat analysis if needed"]
-            }
-        
-    except Exception as e:
-        logger.error(f"Gemini Analysis Failed: {e}")
-        logger.info("Falling back to Mock Analysis")
-        return analyze_image_mock(image, prompt)
+    
+    with tracing.span("gemini", model="gemini-1.5-flash"), metrics.timed("gemini", "gemini-1.5-flash"):
+        text = llm.generate("gemini-1.5-flash", [full_prompt, wire_encoding.gemini_part(image)], priority="analysis").strip()
+    # One pass: skips fences / prose, repairs truncation, fills missing report keys
+    result = json_extract.extract(text, json_extract.ANALYSIS_SCHEMA)
+    if result is not None:
+        return result
+    # No JSON at all: build result from raw text
+    return {
+        "image_type": "medical",
+        "image_findings": text[:500] if text else "Analysis complete. Please review image manually.",
+        "abnormality_location": "See findings",
+        "confidence": "moderate",
+        "what_is_not_seen": "Could not parse full response",
+        "limitations": "AI response was in non-standard format",
+        "suggested_review": ["Review with radiologist", "Repeat analysis if needed"]
+    }
 
 # --- LOCAL MODEL SUPPORT ---
 
@@ -263,25 +304,44 @@ def load_local_model():
         except Exception as e:
             logger.error(f"Failed to load local model: {e}")
 
+@tracing.traced("symptom_lookup")
 def medical_knowledge_lookup(symptom: str) -> dict:
     """ 
     Specialized knowledge lookup for symptoms/problems.
     Provides "Why it happens" and "What to do".
     """
-    # Try remote engine first
-    remote_res = _call_remote_engine("symptom_analysis", data={'problem': symptom})
-    if remote_res:
-        logger.info("Successfully used Remote Kaggle Engine for symptom analysis.")
-        return remote_res
-
-    try:
-        # Priority model: gemini-flash-lite-latest (confirmed working)
-        model_id = 'gemini-flash-lite-latest'
-        logger.info(f"Knowledge lookup for: {symptom} using {model_id}")
-        
-        gemini_model = genai.GenerativeModel(model_id)
-        
-        prompt = f"""
+    cache = semantic_cache.get_cache("symptom_analysis")
+    cached = cache.get(symptom) if cache else None
+    if cached is not None:
+        return cached
+    # Concurrent identical questions share one lookup
+    return singleflight.do("symptom_analysis", semantic_cache.normalize(symptom), lambda: _symptom_lookup(symptom, cache))
+
+def _symptom_lookup(symptom: str, cache: Optional[semantic_cache.SemanticCache]) -> dict:
+    result = hedging.hedged_call(
+        "symptom_analysis",
+        lambda: _call_remote_engine("symptom_analysis", data={'problem': symptom}),
+        lambda: _gemini_symptom_lookup(symptom),
+    )
+    if result is None:
+        logger.error("Knowledge Lookup Failed")
+        return {
+            "why": "Unable to retrieve medical etiology at this moment.",
+            "what_to_do": "Rest and monitor your symptoms. Consult a professional if the condition persists.",
+            "red_flags": ["Severe pain", "Difficulty breathing", "Sudden confusion"],
+            "next_steps": ["Please try your request again in a few moments", "Consult your primary care physician"]
+        }
+    if cache:
+        cache.put(symptom, result)
+    return result
+
+def _gemini_symptom_lookup(symptom: str) -> dict:
+    """ Gemini knowledge lookup; raises if the API call fails or returns no JSON. """
+    # Priority model: gemini-flash-lite-latest (confirmed working)
+    model_id = 'gemini-flash-lite-latest'
+    logger.info("Knowledge lookup", extra={"model": model_id, "symptom": symptom})
+    
+    prompt = f"""
         You are a medical knowledge expert. A user has reported the following problem: "{symptom}".
         
         Please provide a structured response in VALID JSON format with the following keys:
@@ -296,20 +356,52 @@ def medical_knowledge_lookup(symptom: str) -> dict:
         - Focus on explaining the physiology and safe home-care or professional guidance.
         - Be empathetic but clinical.
         """
-        
-        response = gemini_model.generate_content(prompt)
-        text = response.text.replace('```json', '').replace('```', '').strip()
-        data = json.loads(text)
-        return data
-    except Exception as e:
-        logger.error(f"Knowledge Lookup Failed: {e}")
-        return {
-            "why": "Unable to retrieve medical etiology at this moment.",
-            "what_to_do": "Rest and monitor your symptoms. Consult a professional if the condition persists.",
-            "red_flags": ["Severe pain", "Difficulty breathing", "Sudden confusion"],
-            "next_steps": ["Please try your request again in a few moments", "Consult your primary care physician"]
-        }
-
+    
+    with tracing.span("gemini", model=model_id), metrics.timed("gemini", model_id):
+        text = llm.generate(model_id, prompt, priority="symptom")
+    result = json_extract.extract(text, json_extract.SYMPTOM_SCHEMA)
+    if result is None:
+        raise ValueError("Knowledge lookup returned no JSON object")
+    return result
+
+def _generate(inputs, step: str, **generate_kwargs) -> str:
+    """
+    model.generate + decode of the new tokens for one protocol step (decode_budget.STEPS): the
+    step's learned max_new_tokens, stopping as soon as its answer is complete. Timed as
+    local_prefill (until the first token exists, observed via a no-op stopping criterion) and
+    local_decode (the remaining tokens); the step's decode time and tokens go to decode_budget.
+    """
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    first_token = []
+
+    class _FirstToken(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            if not first_token:
+                first_token.append(time.perf_counter())
+            return False
+
+    input_len = inputs["input_ids"].shape[-1]
+    monitor = decode_budget.OutputMonitor(step)
+    max_new_tokens = decode_budget.max_new_tokens(step)
+    stopping = StoppingCriteriaList([_FirstToken(), decode_budget.StopWhenComplete(processor, input_len, monitor)])
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with tracing.span("local.generate", input_tokens=input_len, step=step, max_new_tokens=max_new_tokens), torch.inference_mode():
+            generation = model.generate(**inputs, max_new_tokens=max_new_tokens, stopping_criteria=stopping, **generate_kwargs)
+        outcome = "ok"
+    finally:
+        ended = time.perf_counter()
+        prefill_done = first_token[0] if first_token else ended
+        metrics.observe("local_prefill", prefill_done - started, "medgemma-local", outcome)
+        metrics.observe("local_decode", ended - prefill_done, "medgemma-local", outcome)
+    generated = generation[0][input_len:]
+    decode_budget.record(step, len(generated), max_new_tokens, monitor.reason, ended - prefill_done, "medgemma-local")
+    return monitor.finish(processor.decode(generated, skip_special_tokens=True))
+
+@tracing.traced("inference.local")
 def analyze_with_local_model(image: Image.Image, prompt: str) -> dict:
     """ Run inference using the locally loaded MedGemma model and Ethical AI Protocol. """
     global model, processor
@@ -322,11 +414,7 @@ def analyze_with_local_model(image: Image.Image, prompt: str) -> dict:
         
         # STEP 1: GATEKEEPER
         gatekeeper_inputs = processor(text=ethical.INTENT_CLASSIFICATION_PROMPT + f"\nUser Request: {prompt}", images=image, return_tensors="pt").to(model.device)
-        gatekeeper_input_len = gatekeeper_inputs["input_ids"].shape[-1]
-        
-        with torch.inference_mode():
-            gatekeeper_gen = model.generate(**gatekeeper_inputs, max_new_tokens=20, do_sample=False)
-            category_output = processor.decode(gatekeeper_gen[0][gatekeeper_input_len:], skip_special_tokens=True).strip()
+        category_output = _generate(gatekeeper_inputs, "gatekeeper", do_sample=False)
         
         # Extract category
         category = "A"
@@ -339,11 +427,7 @@ def analyze_with_local_model(image: Image.Image, prompt: str) -> dict:
         if category != "A":
             refusal_prompt = ethical.REFUSAL_PROMPTS.get(category, ethical.REFUSAL_PROMPTS["B"])
             refusal_inputs = processor(text=refusal_prompt, images=image, return_tensors="pt").to(model.device)
-            refusal_input_len = refusal_inputs["input_ids"].shape[-1]
-            
-            with torch.inference_mode():
-                refusal_gen = model.generate(**refusal_inputs, max_new_tokens=200, do_sample=False)
-                refusal_text = processor.decode(refusal_gen[0][refusal_input_len:], skip_special_tokens=True).strip()
+            refusal_text = _generate(refusal_inputs, "refusal", do_sample=False)
             
             return {
                 "image_type": "medical",
@@ -358,19 +442,11 @@ def analyze_with_local_model(image: Image.Image, prompt: str) -> dict:
         # STEP 3: CLINICAL SUPPORT
         full_prompt = ethical.CLINICAL_SUPPORT_PROMPT + f"\nClinical Note: {prompt}"
         inputs = processor(text=full_prompt, images=image, return_tensors="pt").to(model.device)
-        input_len = inputs["input_ids"].shape[-1]
-        
-        with torch.inference_mode():
-            generation = model.generate(**inputs, max_new_tokens=512, do_sample=False)
-            output_text = processor.decode(generation[0][input_len:], skip_special_tokens=True)
+        output_text = _generate(inputs, "clinical", do_sample=False)
         
         # STEP 4: OUTPUT VALIDATION
         validation_inputs = processor(text=ethical.OUTPUT_VALIDATION_PROMPT + f"\nModel Response:\n{output_text}", images=image, return_tensors="pt").to(model.device)
-        val_input_len = validation_inputs["input_ids"].shape[-1]
-        
-        with torch.inference_mode():
-            val_gen = model.generate(**validation_inputs, max_new_tokens=512, do_sample=False)
-            validated_text = processor.decode(val_gen[0][val_input_len:], skip_special_tokens=True).strip()
+        validated_text = _generate(validation_inputs, "validation", do_sample=False)
 
         return {
             "image_type": "medical",
@@ -385,8 +461,22 @@ def analyze_with_local_model(image: Image.Image, prompt: str) -> dict:
         logger.error(f"Local Inference Failed: {e}")
         return analyze_image_mock(image, prompt)
 
+CHAT_BUSY_REPLY = "AI Assistant: Currently processing a high volume of requests. Please try again in 10-15 seconds."
+CHAT_ERROR_REPLY = "Sorry, I encountered an error processing your message."
+
 def chat_with_ai(message: str, image: Optional[Image.Image] = None) -> str:
-    """ Simple chat interface for MedGemma. Fallback to Gemini if local model absent. """
+    """ Simple chat interface for MedGemma. Text-only questions are answered from the response cache when possible. """
+    cache = semantic_cache.get_cache("chat") if image is None else None
+    cached = cache.get(message) if cache else None
+    if cached is not None:
+        return cached
+    reply = _chat_uncached(message, image)
+    if cache and reply not in (CHAT_BUSY_REPLY, CHAT_ERROR_REPLY):
+        cache.put(message, reply)
+    return reply
+
+def _chat_uncached(message: str, image: Optional[Image.Image] = None) -> str:
+    """ Remote engine first; fallback to Gemini if the local model is absent. """
     global model, processor
     
     # Try remote engine first for chat
@@ -410,10 +500,9 @@ def chat_with_ai(message: str, image: Optional[Image.Image] = None) -> str:
             for m_name in model_names:
                 try:
                     logger.info(f"Local model absent. Attempting fallback with {m_name}...")
-                    gemini_model = genai.GenerativeModel(m_name)
                     chat_context = f"You are a medical AI assistant. Answer the following question safely and accurately: {message}"
-                    response = gemini_model.generate_content(chat_context)
-                    return response.text
+                    with tracing.span("gemini", model=m_name), metrics.timed("gemini", m_name):
+                        return llm.generate(m_name, chat_context, priority="chat")
                 except Exception as inner_e:
                     logger.warning(f"Fallback to {m_name} failed: {inner_e}")
                     last_err = inner_e
@@ -423,23 +512,17 @@ def chat_with_ai(message: str, image: Optional[Image.Image] = None) -> str:
             
         except Exception as e:
             logger.error(f"Complete Gemini fallback failure: {e}")
-            return f"AI Assistant: Currently processing a high volume of requests. Please try again in 10-15 seconds."
+            return CHAT_BUSY_REPLY
 
     try:
         # Context-aware chat prompt
         chat_prompt = f"User: {message}\nAssistant:" if not image else f"Based on the image, {message}"
         
         inputs = processor(text=chat_prompt, images=image, return_tensors="pt").to(model.device)
-        input_len = inputs["input_ids"].shape[-1]
-        
-        with torch.inference_mode():
-            generation = model.generate(**inputs, max_new_tokens=256, do_sample=True, temperature=0.7)
-            response = processor.decode(generation[0][input_len:], skip_special_tokens=True).strip()
-            
-        return response
+        return _generate(inputs, "chat", do_sample=True, temperature=0.7)
     except Exception as e:
         logger.error(f"Chat failed: {e}")
-        return "Sorry, I encountered an error processing your message."
+        return CHAT_ERROR_REPLY
 
 # Update load_models to call load_local_model
 def load_models():
@@ -465,7 +548,7 @@ def get_ai_engine_status():
         
     try:
         url = f"{remote_url.rstrip('/')}/health"
-        print(f"📡 DEBUG: Pinging AI Health at {url}")
+        logger.debug("Pinging remote engine health", extra={"url": url})
         resp = requests.get(url, headers={"ngrok-skip-browser-warning": "true"}, timeout=5)
         if resp.status_code == 200:
             return {"status": "online", "message": "Remote engine active", "remote_info": resp.json()}
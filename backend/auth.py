@@ -1,10 +1,18 @@
 
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import os
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 from . import database, models
 
@@ -13,15 +21,61 @@ SECRET_KEY = "medgemma_super_secret_key_change_me"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# --- PASSWORD HASHING ---
+# Pinning min == max == default makes verify_and_update flag hashes made with any other cost,
+# so changing BCRYPT_ROUNDS transparently rehashes users on their next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop. 0 workers = hash inline.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_PER_IP = int(os.getenv("PASSWORD_HASH_PER_IP", "4"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt") if PASSWORD_HASH_WORKERS else None
+# Admission counters are only touched from the event loop, so they need no lock
+_pending_hashes = 0
+_pending_by_ip = defaultdict(int)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hash_job(fn, *args, client_ip: Optional[str] = None):
+    """ Runs a bcrypt job on the hashing pool, shedding load when the queue or one client is saturated. """
+    global _pending_hashes
+    if _pending_hashes >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Authentication is busy, please retry shortly.", headers={"Retry-After": "1"})
+    if client_ip and _pending_by_ip[client_ip] >= PASSWORD_HASH_PER_IP:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many concurrent login attempts.", headers={"Retry-After": "1"})
+
+    _pending_hashes += 1
+    if client_ip: _pending_by_ip[client_ip] += 1
+    try:
+        if _hash_executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _pending_hashes -= 1
+        if client_ip:
+            _pending_by_ip[client_ip] -= 1
+            if not _pending_by_ip[client_ip]: del _pending_by_ip[client_ip]
+
+async def verify_password_async(plain_password, hashed_password, client_ip: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    """ Returns (is_valid, new_hash); new_hash is set when the stored hash uses an outdated cost. """
+    return await _run_hash_job(pwd_context.verify_and_update, plain_password, hashed_password, client_ip=client_ip)
+
+async def get_password_hash_async(password, client_ip: Optional[str] = None) -> str:
+    return await _run_hash_job(pwd_context.hash, password, client_ip=client_ip)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -32,21 +86,112 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# --- TOKEN / USER CACHE ---
+# Verified claims and user rows are cached for a few seconds so hot tokens skip the JWT
+# signature check and the users query. Entries are dropped when the user row changes.
+# The caches are per process: with several workers, a logout or a user change made through
+# another worker takes effect here once the cached entry expires (within AUTH_CACHE_TTL).
+# Revocations are stored in revoked_tokens and checked whenever a token's claims are verified.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))  # seconds; 0 disables the cache
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+_cache_lock = threading.Lock()  # get_current_user runs on the threadpool
+_token_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # token hash -> (expires_at, username)
+_user_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()   # username -> (expires_at, column values)
+_revoked_tokens = {}  # token hash -> JWT exp (epoch seconds), pruned once expired
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _cache_get(cache: OrderedDict, key: str):
+    with _cache_lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry[1]
+
+def _cache_put(cache: OrderedDict, key: str, value, expires_at: float):
+    with _cache_lock:
+        cache[key] = (expires_at, value)
+        cache.move_to_end(key)
+        while len(cache) > AUTH_CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+def invalidate_user(username: str):
+    """ Drops a user's cached row so the next request re-reads role / is_active from the database. """
+    with _cache_lock:
+        _user_cache.pop(username, None)
+
+def revoke_token(token: str, db: Optional[Session] = None):
+    """
+    Adds a token to the revocation list (checked in O(1) on every request) and, given a session,
+    persists it so the other workers and restarts refuse it too. Expired entries are pruned.
+    """
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    except JWTError:
+        return
+    now = time.time()
+    token_hash = _token_hash(token)
+    with _cache_lock:
+        for expired in [h for h, e in _revoked_tokens.items() if e < now]:
+            del _revoked_tokens[expired]
+        _revoked_tokens[token_hash] = exp
+        _token_cache.pop(token_hash, None)
+    if db is not None:
+        db.query(models.RevokedToken).filter(models.RevokedToken.expires_at < datetime.utcfromtimestamp(now)).delete()
+        db.merge(models.RevokedToken(token_hash=token_hash, expires_at=datetime.utcfromtimestamp(exp)))
+        db.commit()
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # Covers deactivation, role changes and renames (the old username's entry is dropped too).
+    # ORM flushes only: bulk query.update() / raw SQL skip this and apply within AUTH_CACHE_TTL.
+    for username in [target.username] + list(inspect(target).attrs.username.history.deleted or []):
+        invalidate_user(username)
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
+    token_hash = _token_hash(token)
+    if token_hash in _revoked_tokens:
         raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+
+    username = _cache_get(_token_cache, token_hash) if AUTH_CACHE_TTL else None
+    if username is None:
+        if db.get(models.RevokedToken, token_hash) is not None:  # logged out through another worker
+            raise credentials_exception
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
+            raise credentials_exception
+        if AUTH_CACHE_TTL:
+            # Never outlive the token itself
+            _cache_put(_token_cache, token_hash, username, min(time.time() + AUTH_CACHE_TTL, payload.get("exp", 0)))
+
+    cached = _cache_get(_user_cache, username) if AUTH_CACHE_TTL else None
+    if cached is not None:
+        # A fresh transient instance per request: cached rows are never shared or attached to a session
+        user = models.User(**cached)
+    else:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if user is None:
+            raise credentials_exception
+        if AUTH_CACHE_TTL:
+            values = {c.name: getattr(user, c.name) for c in models.User.__table__.columns}
+            _cache_put(_user_cache, username, values, time.time() + AUTH_CACHE_TTL)
+
+    if user.is_active is False:
         raise credentials_exception
     return user
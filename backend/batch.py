@@ -0,0 +1,336 @@
+"""
+Batch analysis pipeline used by POST /analyze/batch and by the offline CLI.
+
+Studies are streamed in (one ZIP member or upload at a time), preprocessed in parallel on a
+process pool, gated with one classifier call per chunk and analysed with bounded concurrency.
+Preprocessing of the next chunk overlaps with analysis of the current one, and at most two
+chunks are held in memory.
+
+Offline usage (no HTTP server):
+    python -m backend.batch /data/archive --output results.jsonl --workers 8
+    python -m backend.batch /data/archive --output results/ --format parquet   # needs pyarrow
+
+Progress is checkpointed to a manifest next to the output; re-running the same command skips
+studies that were already processed, so an interrupted overnight run can simply be restarted.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from . import ai_service
+
+logger = logging.getLogger("MedGemma-Batch")
+
+SUPPORTED_EXTENSIONS = (".dcm", ".png", ".jpg", ".jpeg")
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(os.cpu_count() or 1)))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "16"))
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "4"))
+DEFAULT_PROMPT = "Describe the medical findings in this image."
+# Upload limits for /analyze/batch, in uncompressed bytes, checked before anything is decompressed
+BATCH_MAX_STUDY_BYTES = int(os.getenv("BATCH_MAX_STUDY_BYTES", str(256 * 1024 * 1024)))
+BATCH_MAX_STUDIES = int(os.getenv("BATCH_MAX_STUDIES", "10000"))
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(4 * 1024 ** 3)))
+
+class BatchTooLarge(ValueError):
+    """ An upload over one of the BATCH_MAX_* limits. """
+
+def is_study(name: str) -> bool:
+    base = os.path.basename(name)
+    return base.lower().endswith(SUPPORTED_EXTENSIONS) and not base.startswith(".") and "__MACOSX" not in name
+
+def _zip_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [info for info in archive.infolist() if not info.is_dir() and is_study(info.filename)]
+
+def iter_zip_studies(fileobj: IO[bytes]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yields (member name, bytes) one member at a time; the archive is never extracted to disk.
+    A member never yields more than the size in the ZIP directory (zipfile stops reading there).
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in _zip_members(archive):
+            with archive.open(info) as member:
+                yield info.filename, member.read()
+
+def check_upload_limits(sources: Iterable[Tuple[str, IO[bytes]]]):
+    """
+    Raises BatchTooLarge if the (name, file) uploads hold too many studies or too many bytes once
+    decompressed. Only ZIP directories are read, so a ZIP bomb is refused before it inflates.
+    """
+    studies = total = 0
+    for name, fileobj in sources:
+        if name.lower().endswith(".zip"):
+            fileobj.seek(0)
+            with zipfile.ZipFile(fileobj) as archive:
+                sizes = [(info.filename, info.file_size) for info in _zip_members(archive)]
+            fileobj.seek(0)
+        elif is_study(name):
+            sizes = [(name, fileobj.seek(0, os.SEEK_END))]
+            fileobj.seek(0)
+        else:
+            continue
+        for member, size in sizes:
+            if size > BATCH_MAX_STUDY_BYTES:
+                raise BatchTooLarge(f"{member} is {size} bytes uncompressed; the limit per study is {BATCH_MAX_STUDY_BYTES}")
+            studies, total = studies + 1, total + size
+        if studies > BATCH_MAX_STUDIES:
+            raise BatchTooLarge(f"Upload holds more than {BATCH_MAX_STUDIES} studies")
+        if total > BATCH_MAX_TOTAL_BYTES:
+            raise BatchTooLarge(f"Upload is more than {BATCH_MAX_TOTAL_BYTES} bytes uncompressed")
+
+def _preprocess(name: str, data: bytes):
+    """ Runs in a worker process: returns (image, None) or (None, error). """
+    try:
+        return ai_service.process_medical_image(data, name), None
+    except ValueError as e:
+        return None, str(e)
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _process_pool
+
+def shutdown():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+def analyze_items(items: Iterable[Tuple[str, bytes]], prompt: str = DEFAULT_PROMPT, pool=None,
+                  batch_size: int = BATCH_SIZE, analysis_concurrency: int = BATCH_ANALYSIS_CONCURRENCY) -> Iterator[dict]:
+    """
+    Yields one record per study, in input order:
+    {"filename", "data", "status": "ok" | "rejected" | "error", "result" | "error"}
+    """
+    pool = pool or get_process_pool()
+    chunks = _chunks(items, batch_size)
+
+    def submit(chunk):
+        return (chunk, [pool.submit(_preprocess, name, data) for name, data in chunk]) if chunk else None
+
+    with ThreadPoolExecutor(max_workers=analysis_concurrency, thread_name_prefix="batch-analysis") as analysis_pool:
+        current = submit(next(chunks, None))
+        while current:
+            chunk, futures = current
+            # Start decoding the next chunk while this one is gated and analysed
+            current = submit(next(chunks, None))
+
+            processed = [f.result() for f in futures]
+            decoded = [i for i, (image, _) in enumerate(processed) if image is not None]
+            gates = ai_service.classify_is_medical_batch([processed[i][0] for i in decoded]) if decoded else []
+            medical = [i for i, is_medical in zip(decoded, gates) if is_medical]
+            analyses = dict(zip(medical, analysis_pool.map(
+                lambda i: ai_service.analyze_with_gemini(processed[i][0], prompt), medical)))
+
+            for i, (name, data) in enumerate(chunk):
+                record = {"filename": name, "data": data}
+                error = processed[i][1]
+                if error:
+                    record.update(status="error", error=error)
+                elif i in analyses:
+                    record.update(status="ok", result=analyses[i])
+                else:
+                    record.update(status="rejected", result={
+                        "image_type": "non-medical",
+                        "error": "Image rejected. Please upload a valid medical radiology image."
+                    })
+                yield record
+
+class Throughput:
+    """ Running per-status counters for a batch run, reported as studies/minute. """
+    def __init__(self):
+        self.counts = Counter()
+        self.started = time.perf_counter()
+
+    def add(self, status: str):
+        self.counts[status] += 1
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.counts.values())
+        return {
+            "studies": total,
+            **{status: self.counts.get(status, 0) for status in ("ok", "rejected", "error")},
+            "elapsed_s": round(elapsed, 3),
+            "studies_per_minute": round(total / elapsed * 60, 1) if elapsed > 0 else None,
+        }
+
+# --- OFFLINE CLI ---
+
+def iter_directory_studies(root: str, skip=frozenset()) -> Iterator[Tuple[str, bytes]]:
+    """
+    Walks `root` in a stable order, yielding (relative path, bytes). ZIP archives are expanded
+    as `archive.zip!member`. Paths in `skip` (already in the manifest) are not read at all.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            if filename.lower().endswith(".zip"):
+                with open(path, "rb") as f:
+                    for member, data in iter_zip_studies(f):
+                        if f"{rel}!{member}" not in skip:
+                            yield f"{rel}!{member}", data
+            elif is_study(filename) and rel not in skip:
+                with open(path, "rb") as f:
+                    yield rel, f.read()
+
+def load_manifest(path: str) -> set:
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError):
+                    continue  # torn last line from an interrupted run
+    return done
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, row: dict):
+        self.file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class ParquetWriter:
+    """
+    Parquet files can't be appended to and can't be read until closed (the footer comes last),
+    so every checkpoint closes its own part file in the output directory. Parts are written
+    under a temporary name and renamed once complete, so a crash never leaves a broken part.
+    """
+    COLUMNS = ("path", "sha256", "status", "result_json", "error")
+    _PART = re.compile(r"part-(\d+)\.parquet")
+
+    def __init__(self, directory: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.schema = pa.schema([(name, pa.string()) for name in self.COLUMNS])
+        self.rows = []
+
+    def write(self, row: dict):
+        self.rows.append({
+            "path": row["path"], "sha256": row.get("sha256"), "status": row["status"],
+            "result_json": json.dumps(row["result"]) if "result" in row else None, "error": row.get("error"),
+        })
+
+    def flush(self):
+        if not self.rows:
+            return
+        parts = [int(m.group(1)) for m in map(self._PART.fullmatch, os.listdir(self.directory)) if m]
+        path = os.path.join(self.directory, f"part-{max(parts, default=-1) + 1:05d}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema), path + ".tmp")
+        with open(path + ".tmp", "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+def run_directory(root: str, output: str, fmt: str = "jsonl", manifest: Optional[str] = None,
+                  workers: int = BATCH_WORKERS, batch_size: int = BATCH_SIZE,
+                  concurrency: int = BATCH_ANALYSIS_CONCURRENCY, prompt: str = DEFAULT_PROMPT,
+                  checkpoint_every: int = 50) -> dict:
+    """
+    Processes every study under `root` that isn't in the manifest yet. At each checkpoint the
+    results are made durable first (JSONL fsynced, the Parquet part file closed) and only then
+    recorded in the manifest, so a crash can at worst repeat the studies since the last checkpoint.
+    """
+    manifest = manifest or (output.rstrip("/\\") + ".manifest.jsonl")
+    done = load_manifest(manifest)
+    if done:
+        logger.info(f"Resuming: {len(done)} studies already in {manifest}")
+
+    writer = ParquetWriter(output) if fmt == "parquet" else JsonlWriter(output)
+    stats = Throughput()
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(manifest, "a", encoding="utf-8") as manifest_file:
+        def checkpoint():
+            writer.flush()
+            for entry in pending:
+                manifest_file.write(json.dumps(entry) + "\n")
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+            pending.clear()
+
+        try:
+            items = iter_directory_studies(root, skip=done)
+            for record in analyze_items(items, prompt, pool=pool, batch_size=batch_size, analysis_concurrency=concurrency):
+                row = {"path": record["filename"], "sha256": hashlib.sha256(record["data"]).hexdigest(), "status": record["status"]}
+                for key in ("result", "error"):
+                    if key in record: row[key] = record[key]
+                writer.write(row)
+                pending.append({"path": row["path"], "status": row["status"]})
+                stats.add(row["status"])
+                if len(pending) >= checkpoint_every:
+                    checkpoint()
+                    logger.info(f"Checkpoint: {stats.summary()}")
+        finally:
+            checkpoint()
+            writer.close()
+    return stats.summary()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline bulk analysis of a directory of studies.")
+    parser.add_argument("root", help="Directory tree of DICOM/PNG/JPEG studies (ZIP archives are expanded)")
+    parser.add_argument("--output", required=True, help="JSONL file, or a directory for --format parquet")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--manifest", help="Progress manifest (default: <output>.manifest.jsonl)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Preprocessing processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_ANALYSIS_CONCURRENCY, help="Concurrent analysis calls")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--checkpoint-every", type=int, default=50)
+    parser.add_argument("--load-models", action="store_true", help="Load the gating classifier (and local model if FORCE_LOCAL_MODEL)")
+    args = parser.parse_args(argv)
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires pyarrow (pip install pyarrow)")
+
+    logging.basicConfig(level=logging.INFO)
+    ai_service.configure_genai(os.getenv("GEMINI_API_KEY"))
+    if args.load_models:
+        ai_service.load_models()
+
+    summary = run_directory(args.root, args.output, args.format, args.manifest, args.workers,
+                            args.batch_size, args.concurrency, args.prompt, args.checkpoint_every)
+    print(json.dumps(summary))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
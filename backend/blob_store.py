@@ -0,0 +1,259 @@
+"""
+Content-addressed storage for uploaded studies.
+
+Blobs are keyed by the SHA-256 of their bytes and sharded as `ab/cd/<digest>`, so identical
+uploads are stored once and a repeated study costs no extra storage or write I/O.
+The local-disk backend is the default; S3BlobStore works with any boto3-compatible client
+(AWS, MinIO, ...) and FakeS3Client stands in for one in development and tests.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional
+
+logger = logging.getLogger("MedGemma-BlobStore")
+
+CHUNK_SIZE = 64 * 1024
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def shard_key(digest: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+def sniff_media_type(head: bytes) -> str:
+    """ Media type from the first 132 bytes of a blob. """
+    if head.startswith(b"\x89PNG"): return "image/png"
+    if head.startswith(b"\xff\xd8"): return "image/jpeg"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP": return "image/webp"
+    if head[128:132] == b"DICM": return "application/dicom"
+    return "application/octet-stream"
+
+class BlobStore(ABC):
+    """ Interface shared by the storage backends. Ranges are inclusive byte offsets, like HTTP Range. """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """ Stores `data` unless an identical blob exists; returns its SHA-256 digest. """
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, digest: str) -> int:
+        ...
+
+    @abstractmethod
+    def iter_range(self, digest: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        ...
+
+    @abstractmethod
+    def uri(self, digest: str) -> str:
+        """ Location recorded on the case (Case.image_path). """
+
+    def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return b"".join(self.iter_range(digest, start, end))
+
+    # Derivatives (previews etc.) live next to their source blob, under `<digest>.d/<name>`
+
+    @abstractmethod
+    def put_derivative(self, digest: str, name: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def read_derivative(self, digest: str, name: str) -> Optional[bytes]:
+        """ Returns the derivative's bytes, or None if it hasn't been generated. """
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, *shard_key(digest).split("/"))
+
+    def put(self, data: bytes) -> str:
+        digest = sha256_hex(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            self._write_atomic(path, data)
+        return digest
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file in the same directory, then rename: readers never see a partial blob,
+        # and concurrent writers of the same content simply replace each other with identical bytes.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def size(self, digest: str) -> int:
+        return os.path.getsize(self._path(digest))
+
+    def iter_range(self, digest: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        path = self._path(digest)
+        end = os.path.getsize(path) - 1 if end is None else end
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def uri(self, digest: str) -> str:
+        return os.path.join(self.root, *shard_key(digest).split("/")).replace(os.sep, "/")
+
+    def put_derivative(self, digest: str, name: str, data: bytes):
+        self._write_atomic(os.path.join(self._path(digest) + ".d", name), data)
+
+    def read_derivative(self, digest: str, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self._path(digest) + ".d", name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+def _is_not_found(error: Exception) -> bool:
+    code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+class S3BlobStore(BlobStore):
+    """ S3-compatible backend. `client` needs head_object / put_object / get_object (boto3 semantics). """
+
+    def __init__(self, client, bucket: str, prefix: str = "blobs"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}/{shard_key(digest)}" if self.prefix else shard_key(digest)
+
+    def put(self, data: bytes) -> str:
+        digest = sha256_hex(data)
+        if not self.exists(digest):
+            # Single PUTs are atomic on S3: the object is either fully visible or absent
+            self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data)
+        return digest
+
+    def _head(self, digest: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(digest))
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+    def exists(self, digest: str) -> bool:
+        return self._head(digest) is not None
+
+    def size(self, digest: str) -> int:
+        head = self._head(digest)
+        if head is None:
+            raise FileNotFoundError(digest)
+        return head["ContentLength"]
+
+    def iter_range(self, digest: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(digest), Range=byte_range)["Body"]
+        try:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    def uri(self, digest: str) -> str:
+        return f"s3://{self.bucket}/{self._key(digest)}"
+
+    def put_derivative(self, digest: str, name: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=f"{self._key(digest)}.d/{name}", Body=data)
+
+    def read_derivative(self, digest: str, name: str) -> Optional[bytes]:
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=f"{self._key(digest)}.d/{name}")["Body"]
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+class FakeS3Error(Exception):
+    """ Mimics botocore's ClientError shape (`.response["Error"]["Code"]`). """
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+class FakeS3Client:
+    """ In-memory stand-in for the subset of the S3 API that S3BlobStore uses. """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):
+        with self._lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def head_object(self, Bucket: str, Key: str):
+        data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise FakeS3Error("404")
+        return {"ContentLength": len(data)}
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None):
+        data = self.objects.get((Bucket, Key))
+        if data is None:
+            raise FakeS3Error("NoSuchKey")
+        if Range:
+            start, _, end = Range.replace("bytes=", "").partition("-")
+            data = data[int(start): int(end) + 1 if end else None]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+# --- CONFIGURED STORE ---
+
+_store: Optional[BlobStore] = None
+
+def get_blob_store() -> BlobStore:
+    """
+    Returns the process-wide store selected by BLOB_STORE:
+      local (default) - BLOB_STORE_PATH, default ./uploads
+      s3              - S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL (needs boto3)
+      s3-fake         - in-memory FakeS3Client
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv("BLOB_STORE", "local")
+        if backend == "s3":
+            import boto3
+            client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL") or None)
+            _store = S3BlobStore(client, os.environ["S3_BUCKET"], os.getenv("S3_PREFIX", "blobs"))
+        elif backend == "s3-fake":
+            _store = S3BlobStore(FakeS3Client(), "medgemma-dev", os.getenv("S3_PREFIX", "blobs"))
+        else:
+            _store = LocalBlobStore(os.getenv("BLOB_STORE_PATH", "uploads"))
+        logger.info(f"Blob store: {backend}")
+    return _store
@@ -0,0 +1,234 @@
+"""
+Per-step generation budgets and early stopping for local MedGemma decoding.
+
+    monitor = decode_budget.OutputMonitor("clinical")
+    max_new_tokens = decode_budget.max_new_tokens("clinical")
+    ... model.generate(..., max_new_tokens=max_new_tokens,
+                       stopping_criteria=[decode_budget.StopWhenComplete(tokenizer, input_len, monitor)])
+    text = monitor.finish(decoded)    # the answer, cut where it ended
+    decode_budget.record("clinical", generated, max_new_tokens, monitor.reason, decode_seconds)
+
+Each protocol step (STEPS) has a fixed token cap and knows what a finished answer looks like:
+stop strings (the model starting a new turn or echoing a prompt label), a numbered-section
+structure (a heading it already wrote, number and text, means the answer is over and the model
+is starting it again), or a JSON object (done when it closes, via json_extract). Generation stops
+on the first of those and the output is cut there.
+
+Budgets adapt: once DECODE_BUDGET_MIN_SAMPLES outputs of a step are known, max_new_tokens is
+their DECODE_BUDGET_QUANTILE times DECODE_BUDGET_HEADROOM (never above the step's cap). An
+output that runs into a learned budget counts double, so the budget grows back quickly.
+Decode time, tokens used and tokens saved against the cap are logged per step and exported on
+/metrics. The same file is shipped with the Kaggle engine.
+"""
+import logging
+import math
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, NamedTuple, Optional, Tuple
+
+try:
+    from . import json_extract, metrics
+except ImportError:  # flat layout next to kaggle_script.py
+    import json_extract
+    import metrics
+
+logger = logging.getLogger("MedGemma-DecodeBudget")
+
+DECODE_BUDGET_ADAPTIVE = os.getenv("DECODE_BUDGET_ADAPTIVE", "true").lower() != "false"
+DECODE_BUDGET_QUANTILE = float(os.getenv("DECODE_BUDGET_QUANTILE", "0.95"))
+DECODE_BUDGET_HEADROOM = float(os.getenv("DECODE_BUDGET_HEADROOM", "1.25"))
+DECODE_BUDGET_MIN_SAMPLES = int(os.getenv("DECODE_BUDGET_MIN_SAMPLES", "20"))
+DECODE_BUDGET_WINDOW = int(os.getenv("DECODE_BUDGET_WINDOW", "200"))
+DECODE_BUDGET_FLOOR = int(os.getenv("DECODE_BUDGET_FLOOR", "16"))
+
+class Step(NamedTuple):
+    max_new_tokens: int
+    stop_strings: Tuple[str, ...] = ()
+    sections: bool = False  # the answer is made of numbered "N. Heading:" sections
+    json: bool = False   # the answer is one JSON object
+    adaptive: bool = True  # False: always max_new_tokens (e.g. a grammar that bounds the length)
+
+# Labels from the protocol prompts: a model that writes one has started a new turn
+PROMPT_ECHOES = ("\nUser:", "\nUser Request:", "\nClinical Note:", "\nModel Response:")
+
+STEPS: Dict[str, Step] = {
+    "gatekeeper": Step(20, ("\n",)),          # category letter and a short reason, one line
+    "refusal": Step(200, PROMPT_ECHOES),
+    "clinical": Step(512, PROMPT_ECHOES, sections=True),
+    "validation": Step(512, PROMPT_ECHOES),       # a rewrite need not keep the section layout
+    "chat": Step(256, PROMPT_ECHOES),
+    "report": Step(300, json=True),           # the Kaggle engine's JSON report
+    # "report_constrained" (the same report under constrained_json) is added by the engine with
+    # its grammar's max_tokens() as a fixed cap
+}
+
+DECODE_TOKENS = metrics.register(metrics.Counter(
+    "medgemma_decode_tokens_total",
+    "Local generation tokens by protocol step: generated, or saved against the step's fixed cap.",
+    ("step", "kind"),
+))
+
+# "1. Image Observations:" / "**2. Clinical Context Summary:**" / "### 3. Correlation Analysis"
+_HEADING = re.compile(r"^[ \t#*]*(\d{1,2})[.)][ \t]+([^\n]{1,60}?)[ \t*]*$")
+
+class OutputMonitor:
+    """
+    Watches one step's output as it grows. `feed(chunk)` appends newly decoded text and returns
+    True once the answer is complete; `cut` is where it ends in `text` and `reason` why (None
+    while still running). Each chunk is scanned once, so a whole generation costs O(length).
+    """
+
+    def __init__(self, step: str):
+        self.step = step
+        self.spec = STEPS[step]
+        self.text = ""
+        self.cut: Optional[int] = None
+        self.reason: Optional[str] = None
+        self._content = -1       # index of the first non-whitespace character
+        self._lines_done = 0     # text before this index has been checked for headings
+        self._headings = set()   # (number, text) of the section headings seen so far
+        self._extractor = json_extract.IncrementalExtractor() if self.spec.json else None
+
+    def _stop(self, cut: int, reason: str) -> bool:
+        self.cut, self.reason = cut, reason
+        return True
+
+    def feed(self, chunk: str) -> bool:
+        if self.cut is not None:
+            return True
+        previous = len(self.text)
+        self.text += chunk
+        if self._content < 0 and self.text.strip():
+            self._content = len(self.text) - len(self.text.lstrip())
+        if self._content >= 0:  # a stop string only counts after some output
+            for stop in self.spec.stop_strings:
+                found = self.text.find(stop, max(self._content + 1, previous - len(stop) + 1))
+                if found >= 0:
+                    return self._stop(found, "stop_string")
+        if self.spec.sections and self._section_done():
+            return True
+        if self._extractor is not None and self._extractor.feed(chunk):
+            return self._stop(self._extractor.end, "json_closed")
+        return False
+
+    def _section_done(self) -> bool:
+        """
+        Checks the newly completed lines for a heading the answer already has. Other numbered
+        lines (a "1. Cardiology review:" list inside a section) are never an end by themselves.
+        """
+        end = self.text.rfind("\n") + 1
+        position = self._lines_done
+        for line in self.text[position:end].splitlines(keepends=True):
+            heading = _HEADING.match(line.rstrip("\n"))
+            if heading and heading.group(2).rstrip("*").endswith(":"):
+                key = (int(heading.group(1)), " ".join(heading.group(2).rstrip("*:").lower().split()))
+                if key in self._headings:
+                    self._lines_done = end
+                    return self._stop(position, "section_repeat")
+                self._headings.add(key)
+            position += len(line)
+        self._lines_done = max(self._lines_done, end)
+        return False
+
+    def finish(self, text: str) -> str:
+        """
+        The final answer from the fully decoded `text`: cut where the end was detected, stripped.
+        Text the monitor hasn't seen yet is fed first; if the streamed text differs from `text`
+        (detokenization at a chunk boundary), `text` is scanned again from the start.
+        """
+        if not text.startswith(self.text[:self.cut] if self.cut is not None else self.text):
+            rescan = OutputMonitor(self.step)
+            rescan.feed(text)
+            self.text, self.cut, self.reason = rescan.text, rescan.cut, rescan.reason
+        elif self.cut is None:
+            self.feed(text[len(self.text):])
+        return (text[:self.cut] if self.cut is not None else text).strip()
+
+class StopWhenComplete:
+    """
+    transformers StoppingCriteria (duck-typed): detokenizes only the new tokens and feeds them
+    to the monitor. Text is decoded over a short window that starts a few tokens back, so
+    SentencePiece word-boundary spaces come out right, and held back while it ends in an
+    incomplete multibyte character. One sequence per generate call.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, monitor: OutputMonitor):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.monitor = monitor
+        self.ids = []
+        self.prefix = 0   # window start in ids
+        self.read = 0     # ids[:read] have been emitted
+
+    def _decode(self, ids) -> str:
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new = input_ids[0][self.prompt_len + len(self.ids):]
+        self.ids.extend(new.tolist() if hasattr(new, "tolist") else new)
+        emitted = self._decode(self.ids[self.prefix:self.read])
+        window = self._decode(self.ids[self.prefix:])
+        if len(window) <= len(emitted) or window.endswith("\ufffd"):
+            return self.monitor.cut is not None
+        chunk = window[len(emitted):]
+        self.prefix, self.read = self.read, len(self.ids)
+        return self.monitor.feed(chunk)
+
+class _StepLengths:
+    def __init__(self):
+        self.lengths = deque(maxlen=DECODE_BUDGET_WINDOW)
+        self.calls = 0
+        self.generated = 0
+        self.saved = 0
+        self.reasons: Dict[str, int] = {}
+
+_lock = threading.Lock()
+_steps: Dict[str, _StepLengths] = {}
+
+def _quantile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def max_new_tokens(step: str) -> int:
+    """ The step's cap until enough outputs are known, then the learned budget. """
+    cap = STEPS[step].max_new_tokens
+    with _lock:
+        lengths = list(_steps[step].lengths) if step in _steps else []
+    if not (DECODE_BUDGET_ADAPTIVE and STEPS[step].adaptive) or len(lengths) < DECODE_BUDGET_MIN_SAMPLES:
+        return cap
+    learned = math.ceil(_quantile(lengths, DECODE_BUDGET_QUANTILE) * DECODE_BUDGET_HEADROOM)
+    return max(min(DECODE_BUDGET_FLOOR, cap), min(cap, learned))
+
+def record(step: str, generated: int, budget: int, reason: Optional[str], seconds: float, backend: str = "local"):
+    """
+    Accounts one generation: `generated` tokens under `budget`, ended for `reason` (a monitor
+    reason, None = EOS or the budget).
+    """
+    cap = STEPS[step].max_new_tokens
+    if reason is None:
+        reason = "budget" if generated >= budget else "eos"
+    # An answer cut by a learned budget was longer than it; count it double so the budget recovers
+    observed = min(cap, generated * 2) if reason == "budget" and budget < cap else generated
+    with _lock:
+        stats = _steps.setdefault(step, _StepLengths())
+        stats.lengths.append(observed)
+        stats.calls += 1
+        stats.generated += generated
+        stats.saved += cap - generated
+        stats.reasons[reason] = stats.reasons.get(reason, 0) + 1
+    DECODE_TOKENS.inc(step, "generated", amount=generated)
+    DECODE_TOKENS.inc(step, "saved", amount=cap - generated)
+    metrics.observe(f"decode_{step}", seconds, backend)
+    logger.info("Decode step finished", extra={
+        "step": step, "tokens": generated, "budget": budget, "cap": cap, "saved": cap - generated,
+        "reason": reason, "decode_ms": round(seconds * 1000, 1)})
+
+def stats() -> Dict[str, dict]:
+    """ Per step: calls, current budget, mean tokens, tokens saved and why outputs ended. """
+    with _lock:
+        steps = {name: (s.calls, s.generated, s.saved, dict(s.reasons)) for name, s in _steps.items()}
+    return {name: {"calls": calls, "max_new_tokens": max_new_tokens(name),
+                   "mean_tokens": round(generated / calls, 1), "tokens_saved": saved, "ended_by": reasons}
+            for name, (calls, generated, saved, reasons) in steps.items()}
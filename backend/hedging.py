@@ -0,0 +1,180 @@
+"""
+Hedged requests: primary (Kaggle engine) with a speculative secondary (Gemini).
+
+Without hedging a slow primary costs its full timeout before the secondary even starts, so
+the tail latency is the sum of both. With hedging, if the primary hasn't answered by the
+HEDGE_PERCENTILE of its own recent latencies, the secondary is fired in parallel and the
+first valid answer wins. A primary that fails outright falls through to the secondary
+immediately, as before.
+
+Hedges are capped per endpoint by a budget (at most HEDGE_BUDGET of recent calls may fire a
+speculative secondary, overridable per endpoint with HEDGE_BUDGETS="analyze=0.1,...") so the
+average cost stays close to 1x. Primaries and secondaries run on separate pools, so a hedge
+never queues behind the stuck primaries it is meant to route around, and the primary's latency
+is measured from when a worker starts it, so pool queueing doesn't inflate the deadline. The loser is cancelled if it hasn't started; a loser already
+in flight (an HTTP request) can't be aborted, so its result is discarded and counted as
+wasted cost in medgemma_hedge_calls_total on /metrics.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from . import metrics
+
+logger = logging.getLogger("MedGemma-Hedging")
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() != "false"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_DEFAULT_DEADLINE_MS = float(os.getenv("HEDGE_DEFAULT_DEADLINE_MS", "5000"))  # until enough samples exist
+HEDGE_MIN_DEADLINE_MS = float(os.getenv("HEDGE_MIN_DEADLINE_MS", "50"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_BUDGETS = {k.strip(): float(v) for k, v in (
+    item.split("=", 1) for item in os.getenv("HEDGE_BUDGETS", "").split(",") if "=" in item)}
+# One primary worker per request thread (Starlette's threadpool defaults to 40), so primaries
+# never queue behind each other; secondaries get their own, smaller pool
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "40"))
+HEDGE_SECONDARY_WORKERS = int(os.getenv("HEDGE_SECONDARY_WORKERS", "8"))
+
+HEDGE_CALLS = metrics.register(metrics.Counter(
+    "medgemma_hedge_calls_total",
+    "Hedged-call accounting per endpoint: calls, fallbacks (primary failed), hedges fired, "
+    "wins by each side and wasted (hedge fired but primary won).",
+    ("endpoint", "event"),
+))
+
+_primary_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge-primary")
+_secondary_pool = ThreadPoolExecutor(max_workers=HEDGE_SECONDARY_WORKERS, thread_name_prefix="hedge-secondary")
+
+class EndpointState:
+    """ Recent primary latencies (for the deadline) and recent hedge decisions (for the budget). """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.decisions = deque(maxlen=HEDGE_WINDOW)  # True = hedged
+        self.lock = threading.Lock()
+
+    def record_latency(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def deadline_s(self) -> float:
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_DEADLINE_MS / 1000
+            ordered = sorted(self.latencies)
+        index = min(int(HEDGE_PERCENTILE * len(ordered)), len(ordered) - 1)
+        return max(ordered[index], HEDGE_MIN_DEADLINE_MS / 1000)
+
+    def try_hedge(self) -> bool:
+        """ Records a decision for this call; hedges only while under budget. """
+        with self.lock:
+            hedged = sum(self.decisions)
+            allowed = hedged + 1 <= self.budget * (len(self.decisions) + 1)
+            self.decisions.append(allowed)
+        return allowed
+
+    def record_no_hedge(self):
+        with self.lock:
+            self.decisions.append(False)
+
+_endpoints: Dict[str, EndpointState] = {}
+_endpoints_lock = threading.Lock()
+
+def _state(endpoint: str) -> EndpointState:
+    with _endpoints_lock:
+        if endpoint not in _endpoints:
+            _endpoints[endpoint] = EndpointState(HEDGE_BUDGETS.get(endpoint, HEDGE_BUDGET))
+        return _endpoints[endpoint]
+
+def _submit(pool: ThreadPoolExecutor, fn: Callable, started: Optional[list] = None):
+    """ Runs fn on `pool` in the caller's context (request id / trace); appends the start time to `started`. """
+    def run():
+        if started is not None:
+            started.append(time.perf_counter())
+        return _call_quietly(fn)
+    return pool.submit(contextvars.copy_context().run, run)
+
+def hedged_call(endpoint: str, primary: Callable[[], Optional[dict]], secondary: Callable[[], Optional[dict]],
+                is_valid: Callable[[Optional[dict]], bool] = lambda r: r is not None):
+    """
+    Returns the first valid result of primary / secondary (None if neither produced one).
+    Exceptions from either side count as invalid results.
+    """
+    count = lambda event: HEDGE_CALLS.inc(endpoint, event)
+    count("calls")
+    if not HEDGE_ENABLED:
+        result = _call_quietly(primary)
+        if is_valid(result):
+            count("primary_wins")
+            return result
+        count("fallbacks")
+        return _call_quietly(secondary)
+
+    state = _state(endpoint)
+    started = []
+    first = _submit(_primary_pool, primary, started)
+
+    def record(future):
+        # The deadline tracks how long a *good* primary answer takes once running; fast failures
+        # would drag it down, queue time would push it up
+        if not future.cancelled() and started and is_valid(future.result()):
+            state.record_latency(time.perf_counter() - started[0])
+    first.add_done_callback(record)
+
+    # Measured from submission: a primary still queued counts toward the deadline, so saturation hedges sooner
+    done, _ = wait([first], timeout=state.deadline_s())
+    if done:
+        state.record_no_hedge()
+    elif not state.try_hedge():
+        wait([first])
+    if first.done():
+        if is_valid(first.result()):
+            count("primary_wins")
+            return first.result()
+        count("fallbacks")
+        return _call_quietly(secondary)
+
+    count("hedges")
+    second = _submit(_secondary_pool, secondary)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if is_valid(future.result()):
+                winner = "primary" if future is first else "secondary"
+                count(f"{winner}_wins")
+                if winner == "primary":
+                    count("wasted")
+                for loser in pending:
+                    loser.cancel()
+                logger.debug("Hedged call resolved", extra={"endpoint": endpoint, "winner": winner})
+                return future.result()
+    return None
+
+def _call_quietly(fn: Callable):
+    try:
+        return fn()
+    except Exception as e:
+        logger.warning(f"Hedged call side failed: {e}")
+        return None
+
+def stats() -> dict:
+    """ Per-endpoint accounting; extra_cost is secondary calls fired speculatively per call. """
+    out = {}
+    for endpoint, state in list(_endpoints.items()):
+        calls = HEDGE_CALLS.value(endpoint, "calls") or 1
+        out[endpoint] = {
+            **{event: int(HEDGE_CALLS.value(endpoint, event)) for event in
+               ("calls", "fallbacks", "hedges", "primary_wins", "secondary_wins", "wasted")},
+            "deadline_ms": round(state.deadline_s() * 1000, 1),
+            "extra_cost": round(HEDGE_CALLS.value(endpoint, "hedges") / calls, 3),
+        }
+    return out
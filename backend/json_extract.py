@@ -0,0 +1,158 @@
+"""
+One JSON extractor for every model output (Gemini, the Kaggle engine, local MedGemma).
+
+    report = json_extract.extract(text, json_extract.ANALYSIS_SCHEMA)
+
+A single left-to-right scan with a brace / bracket / quote state machine finds the first JSON
+object, skipping markdown fences and prose around it (structural characters are located with
+one regex, so plain text is skipped at C speed). A complete object is handed to json.loads
+once. A truncated one - the usual failure when generation hits max_new_tokens - is repaired:
+the open string is closed, then any open containers; if that still doesn't parse, it is cut
+back to the last complete member. The result is then conformed to a schema of expected keys
+with defaults.
+
+IncrementalExtractor does the same over streamed chunks, scanning each character once, so it
+is cheap enough to run on every chunk (e.g. to stop generation as soon as the object closes).
+The same file is shipped with the Kaggle engine.
+"""
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Expected keys and their defaults. A key that is missing or null gets the default; a scalar
+# where the default is a list is wrapped in a list.
+ANALYSIS_SCHEMA = {
+    "image_type": "medical",
+    "image_findings": "Analysis complete. Please review image manually.",
+    "abnormality_location": "See findings",
+    "confidence": "moderate",
+    "what_is_not_seen": "Not reported.",
+    "limitations": "Automated screening result; confirm with radiologist.",
+    "suggested_review": ["Review with radiologist"],
+}
+SYMPTOM_SCHEMA = {
+    "why": "Unable to retrieve medical etiology at this moment.",
+    "what_to_do": ["Rest and monitor your symptoms"],
+    "red_flags": ["Severe pain", "Difficulty breathing", "Sudden confusion"],
+    "next_steps": ["Consult your primary care physician"],
+}
+
+_STRUCTURAL = re.compile(r'[{}\[\]",\\]')
+_CLOSERS = {"{": "}", "[": "]"}
+
+class IncrementalExtractor:
+    """
+    Feed text as it arrives; `result()` is the first JSON object so far (repaired if it is still
+    open), `complete` turns True when that object's closing brace has been seen.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0                 # next unscanned index in buffer
+        self.start = -1              # index of the object's "{"
+        self.end = -1                # index after its closing "}"
+        self.stack: List[str] = []   # open "{" / "["
+        self.in_string = False
+        self.skip = -1               # index of a character escaped by a backslash
+        self.checkpoint: Optional[Tuple[int, str]] = None  # (cut index, closers) after the last complete member
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    def feed(self, chunk: str) -> bool:
+        """ Scans the new text; returns `complete`. """
+        self.buffer += chunk
+        if self.complete:
+            return True
+        for match in _STRUCTURAL.finditer(self.buffer, self.pos):
+            i, char = match.start(), match.group()
+            if i == self.skip:
+                continue
+            if self.in_string:
+                if char == "\\":
+                    self.skip = i + 1
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if self.start < 0:
+                if char == "{":
+                    self.start = i
+                    self.stack.append("{")
+                    self.checkpoint = (i + 1, "}")
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char in _CLOSERS:
+                self.stack.append(char)
+                self.checkpoint = (i + 1, self._closers())
+            elif char in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    self.pos = self.end
+                    return True
+            elif char == ",":
+                self.checkpoint = (i, self._closers())
+        self.pos = len(self.buffer)
+        return False
+
+    def _closers(self) -> str:
+        return "".join(_CLOSERS[c] for c in reversed(self.stack))
+
+    def _candidates(self):
+        if self.start < 0:
+            return
+        if self.complete:
+            yield self.buffer[self.start:self.end]
+            return
+        if self.in_string:
+            # a reply cut inside an escape (a trailing backslash, "\\u00") keeps the value before it
+            escape = self.skip - 1
+            dangling = escape >= self.start and (self.skip == len(self.buffer) or (
+                self.buffer[self.skip] == "u" and len(self.buffer) - self.skip < 5))
+            text = self.buffer[self.start:escape if dangling else None] + '"'
+        else:
+            text = self.buffer[self.start:].rstrip().rstrip(",")
+        yield text + self._closers()
+        if self.checkpoint:
+            cut, closers = self.checkpoint
+            yield self.buffer[self.start:cut].rstrip().rstrip(",") + closers
+
+    def result(self) -> Optional[dict]:
+        for candidate in self._candidates():
+            try:
+                value = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                return value
+        return None
+
+def conform(obj: dict, schema: Dict[str, object]) -> dict:
+    """ Fills missing / null keys from the schema defaults (copied); extra keys are kept. """
+    for key, default in schema.items():
+        value = obj.get(key)
+        if value is None or value == "":
+            obj[key] = list(default) if isinstance(default, list) else default
+        elif isinstance(default, list) and not isinstance(value, list):
+            obj[key] = [value]
+    return obj
+
+def extract(text: str, schema: Optional[Dict[str, object]] = None) -> Optional[dict]:
+    """
+    First JSON object in `text` (repaired if truncated), conformed to `schema` if given.
+    None when no object can be recovered. If the first object is complete but not valid JSON,
+    the scan moves on to the next one.
+    """
+    while text:
+        extractor = IncrementalExtractor()
+        extractor.feed(text)
+        result = extractor.result()
+        if result is not None:
+            return conform(result, schema) if schema else result
+        if not extractor.complete:
+            return None
+        text = text[extractor.start + 1:]
+    return None
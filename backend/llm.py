@@ -0,0 +1,286 @@
+"""
+Pluggable LLM provider used by every Gemini call in the backend and the Kaggle engine.
+
+    text = llm.generate("gemini-flash-lite-latest", [prompt, image], priority="analysis")
+
+LLM_PROVIDER selects the implementation:
+  gemini (default) - google.generativeai
+  fake             - FakeLLMProvider: in-process, no network; simulates latency distributions,
+                     429 / 404 errors, truncated JSON and streaming (FAKE_LLM_* settings below)
+
+generate() and stream() go through the shared per-model rate limiter (see rate_limit) before
+calling the provider; call those rather than the provider's own methods. Benchmarks and tests can also inject a provider directly with set_provider().
+The same file is shipped with the Kaggle engine.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    from . import rate_limit
+except ImportError:  # flat layout next to kaggle_script.py
+    import rate_limit
+
+class LLMError(Exception):
+    """ Provider failure with an HTTP-like status (429 rate limited, 404 unknown model, 500 other). """
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in (429, 500, 503)
+
+class LLMProvider:
+    name = "base"
+
+    def configure(self, api_key: Optional[str]):
+        pass
+
+    def generate(self, model: str, contents) -> str:
+        """ `contents` is a prompt string or a list of prompt parts (strings / PIL images). """
+        raise NotImplementedError
+
+    def stream(self, model: str, contents) -> Iterator[str]:
+        """ Yields text chunks as they are produced; defaults to one chunk. """
+        yield self.generate(model, contents)
+
+def _status_from_error(error: Exception) -> int:
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    text = str(error)
+    for status in (429, 404, 403, 400, 503):
+        if str(status) in text:
+            return status
+    return 500
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+        self.genai = genai
+
+    def configure(self, api_key: Optional[str]):
+        if api_key:
+            self.genai.configure(api_key=api_key)
+
+    def generate(self, model: str, contents) -> str:
+        try:
+            return self.genai.GenerativeModel(model).generate_content(contents).text
+        except Exception as e:
+            raise LLMError(f"{model}: {e}", _status_from_error(e)) from e
+
+    def stream(self, model: str, contents) -> Iterator[str]:
+        try:
+            for chunk in self.genai.GenerativeModel(model).generate_content(contents, stream=True):
+                yield chunk.text
+        except Exception as e:
+            raise LLMError(f"{model}: {e}", _status_from_error(e)) from e
+
+# --- FAKE ---
+
+FAKE_ANALYSIS = {
+    "image_type": "medical",
+    "image_findings": "No focal consolidation or acute abnormality identified. The cardiac silhouette is within normal limits. No pleural effusion.",
+    "abnormality_location": "none",
+    "confidence": "high",
+    "what_is_not_seen": "No pleural effusion, no pneumothorax.",
+    "limitations": "Simulated response (FakeLLMProvider).",
+    "suggested_review": ["Routine Follow-up"],
+}
+FAKE_SYMPTOM = {
+    "why": "Simulated explanation (FakeLLMProvider).",
+    "what_to_do": ["Rest", "Stay hydrated"],
+    "red_flags": ["Chest pain", "Difficulty breathing"],
+    "next_steps": ["Consult your primary care physician"],
+}
+
+def _env_list(name: str):
+    return {m.strip() for m in os.getenv(name, "").split(",") if m.strip()}
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Deterministic (seeded) stand-in for Gemini.
+
+    latency        lognormal with the given median and sigma (sigma=0 -> fixed), per call
+    rate_429/404   probability a call fails with that status (after error_latency_ms)
+    unavailable    models that always 404 (like gemini-1.5-* on the current API version)
+    rate_limited   models that always 429
+    partial_json   probability a JSON answer is truncated mid-object
+    stream_chunks  chunks per streamed answer; the latency is spread across them
+    """
+    name = "fake"
+
+    def __init__(self, median_ms: float = 300, sigma: float = 0.4, rate_429: float = 0.0, rate_404: float = 0.0,
+                 partial_json: float = 0.0, unavailable=(), rate_limited=(), error_latency_ms: float = 40,
+                 stream_chunks: int = 8, seed: Optional[int] = 0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.rate_429 = rate_429
+        self.rate_404 = rate_404
+        self.partial_json = partial_json
+        self.unavailable = set(unavailable)
+        self.rate_limited = set(rate_limited)
+        self.error_latency_ms = error_latency_ms
+        self.stream_chunks = stream_chunks
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()       # (model, outcome) -> count
+        self.simulated_s = 0.0       # total simulated provider time, i.e. what the calls "cost"
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMProvider":
+        seed = os.getenv("FAKE_LLM_SEED", "0")
+        return cls(
+            median_ms=float(os.getenv("FAKE_LLM_MEDIAN_MS", "300")),
+            sigma=float(os.getenv("FAKE_LLM_SIGMA", "0.4")),
+            rate_429=float(os.getenv("FAKE_LLM_RATE_429", "0")),
+            rate_404=float(os.getenv("FAKE_LLM_RATE_404", "0")),
+            partial_json=float(os.getenv("FAKE_LLM_PARTIAL_JSON", "0")),
+            unavailable=_env_list("FAKE_LLM_UNAVAILABLE_MODELS"),
+            rate_limited=_env_list("FAKE_LLM_RATE_LIMITED_MODELS"),
+            seed=int(seed) if seed else None,
+        )
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _latency_s(self) -> float:
+        with self._lock:
+            z = self._rng.gauss(0, 1)
+        return self.median_ms * math.exp(self.sigma * z) / 1000
+
+    def _sleep(self, seconds: float):
+        with self._lock:
+            self.simulated_s += seconds
+        time.sleep(seconds)
+
+    def _record(self, model: str, outcome: str):
+        with self._lock:
+            self.calls[(model, outcome)] += 1
+
+    def _fail_if_needed(self, model: str):
+        status = None
+        if model in self.unavailable:
+            status = 404
+        elif model in self.rate_limited:
+            status = 429
+        else:
+            roll = self._random()
+            if roll < self.rate_429:
+                status = 429
+            elif roll < self.rate_429 + self.rate_404:
+                status = 404
+        if status:
+            self._sleep(self.error_latency_ms / 1000)
+            self._record(model, str(status))
+            raise LLMError(f"{model}: simulated {status}", status)
+
+    def _answer(self, contents) -> str:
+        parts = [contents] if isinstance(contents, str) else list(contents)
+        prompt = " ".join(p for p in parts if isinstance(p, str))
+        if "JSON" not in prompt:
+            return "OK" if prompt.strip() == "Say OK" else "Simulated assistant reply (FakeLLMProvider)."
+        answer = json.dumps(FAKE_SYMPTOM if '"why"' in prompt or "why:" in prompt else FAKE_ANALYSIS)
+        if self.partial_json and self._random() < self.partial_json:
+            answer = answer[: len(answer) // 2 + int(self._random() * len(answer) // 3)]
+        return answer
+
+    def generate(self, model: str, contents) -> str:
+        self._fail_if_needed(model)
+        self._sleep(self._latency_s())
+        self._record(model, "ok")
+        return self._answer(contents)
+
+    def stream(self, model: str, contents) -> Iterator[str]:
+        self._fail_if_needed(model)
+        answer = self._answer(contents)
+        total = self._latency_s()
+        size = max(1, math.ceil(len(answer) / self.stream_chunks))
+        for i in range(0, len(answer), size):
+            self._sleep(total / self.stream_chunks)
+            yield answer[i:i + size]
+        self._record(model, "ok")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": {f"{m}:{o}": n for (m, o), n in sorted(self.calls.items())},
+                    "simulated_s": round(self.simulated_s, 3)}
+
+# --- CONFIGURED PROVIDER ---
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+def get_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = FakeLLMProvider.from_env() if os.getenv("LLM_PROVIDER", "gemini") == "fake" else GeminiProvider()
+    return _provider
+
+def set_provider(provider: Optional[LLMProvider]) -> Optional[LLMProvider]:
+    """ Swaps the process-wide provider (None -> re-read LLM_PROVIDER); returns the previous one. """
+    global _provider
+    with _provider_lock:
+        previous, _provider = _provider, provider
+    return previous
+
+@contextmanager
+def _limited(model: str, contents, priority: str):
+    """
+    Acquires the call's estimated tokens (prompt + RATE_LIMIT_OUTPUT_TOKENS) from the model's
+    limiter, or raises LLMError(429) without calling the provider. The caller appends the text it
+    receives to the yielded list; on exit the charge is settled to the prompt plus that text, so
+    a failed call gets its output estimate back. An upstream 429 also penalizes the model.
+    """
+    charged = rate_limit.estimate_tokens(contents) + rate_limit.RATE_LIMIT_OUTPUT_TOKENS
+    try:
+        rate_limit.acquire(model, charged, priority)
+    except rate_limit.RateLimited as e:
+        raise LLMError(str(e), 429) from e
+    received = []
+    upstream_429 = False
+    try:
+        yield received
+    except LLMError as e:
+        upstream_429 = e.status == 429
+        raise
+    finally:
+        used = charged - rate_limit.RATE_LIMIT_OUTPUT_TOKENS + sum(len(chunk) for chunk in received) // 4
+        rate_limit.limiter(model).settle(charged, used)
+        if upstream_429:
+            rate_limit.penalize(model)
+
+def generate(model: str, contents, priority: str = "chat") -> str:
+    """
+    provider.generate behind the local rate limiter. Raises LLMError(429) without calling the
+    provider when the model's budget can't serve this priority class in time.
+    """
+    provider = get_provider()
+    if not rate_limit.enabled(provider.name):
+        return provider.generate(model, contents)
+    with _limited(model, contents, priority) as received:
+        received.append(provider.generate(model, contents))
+    return received[0]
+
+def stream(model: str, contents, priority: str = "chat") -> Iterator[str]:
+    """ provider.stream behind the same limiter; settled when the stream ends or is abandoned. """
+    provider = get_provider()
+    if not rate_limit.enabled(provider.name):
+        yield from provider.stream(model, contents)
+        return
+    with _limited(model, contents, priority) as received:
+        for chunk in provider.stream(model, contents):
+            received.append(chunk)
+            yield chunk
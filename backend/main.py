@@ -1,29 +1,43 @@
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File, Form, Query, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import Text, cast, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
+import csv
+import io
 import json
 import logging
+import zipfile
+import zlib
 import os
 import asyncio
 
-from . import models, database, auth, ai_service
+from . import models, database, auth, ai_service, migrations, blob_store, previews, batch, metrics, tracing, structured_logging, hedging, semantic_cache, singleflight, rate_limit, decode_budget
 
 # Initialize DB
 from dotenv import load_dotenv
 load_dotenv() # Load .env variables
 from contextlib import asynccontextmanager
 
+logger = logging.getLogger("MedGemma-API")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize DB
-    models.Base.metadata.create_all(bind=database.engine)
+    # Initialize DB (creates tables and applies pending schema migrations)
+    migrations.upgrade(database.engine)
     # Initialize AI in background or on startup
     ai_service.configure_genai(os.getenv("GEMINI_API_KEY"))
     # ai_service.load_models() # We'll call this but maybe just let it be lazy if needed
     yield
+    batch.shutdown()
+    semantic_cache.save_all()
+    tracing.flush()
 
 app = FastAPI(title="MedGemma Collaboration Platform", lifespan=lifespan)
 
@@ -33,7 +47,14 @@ async def health_check():
 
 @app.get("/ai_health")
 async def ai_health_check():
-    return ai_service.get_ai_engine_status()
+    return {**ai_service.get_ai_engine_status(), "hedging": hedging.stats(), "cache": semantic_cache.stats(),
+            "coalescing": singleflight.stats(), "rate_limits": rate_limit.stats(),
+            "decode_budgets": decode_budget.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """ Prometheus scrape endpoint (per-stage latency histograms). """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # CORS
 app.add_middleware(
@@ -44,6 +65,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_id(request: Request, call_next):
+    """ Correlates log lines per request; honours an incoming X-Request-ID and echoes it back. """
+    rid = structured_logging.new_request_id(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = rid
+    return response
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """ Root span per request; continues the caller's trace if it sent a W3C `traceparent`. """
+    with tracing.start_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"),
+                             **{"http.method": request.method, "http.target": request.url.path}) as span:
+        response = await call_next(request)
+        if span:
+            span.set("http.status_code", response.status_code)
+            response.headers["traceparent"] = span.traceparent
+        return response
+
 # --- WEBSOCKET MANAGER ---
 class ConnectionManager:
     def __init__(self):
@@ -65,27 +105,40 @@ manager = ConnectionManager()
 # --- AUTH ROUTES ---
 
 @app.post("/token")
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.username == form_data.username))).scalars().first()
+    client_ip = request.client.host if request.client else None
+    is_valid, new_hash = (False, None)
+    if user:
+        is_valid, new_hash = await auth.verify_password_async(form_data.password, user.hashed_password, client_ip=client_ip)
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it while we have the plaintext
+        user.hashed_password = new_hash
+        await db.commit()
     access_token = auth.create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer", "role": user.role}
 
+@app.post("/logout")
+async def logout(token: str = Depends(auth.oauth2_scheme), current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    await run_in_threadpool(auth.revoke_token, token, db)
+    return {"msg": "Logged out"}
+
 @app.post("/register")
-async def register_user(username: str = Form(...), password: str = Form(...), role: str = Form("uploader"), db: Session = Depends(database.get_db)):
+async def register_user(request: Request, username: str = Form(...), password: str = Form(...), role: str = Form("uploader"), db: AsyncSession = Depends(database.get_async_db)):
     # Check if user exists
-    if db.query(models.User).filter(models.User.username == username).first():
+    if (await db.execute(select(models.User.id).where(models.User.username == username))).first():
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password, client_ip=request.client.host if request.client else None)
     new_user = models.User(username=username, hashed_password=hashed_password, role=role)
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return {"msg": "User created successfully"}
 
 # --- AI & CASE ROUTES ---
@@ -95,10 +148,11 @@ async def analyze_case(
     image: UploadFile = File(...),
     prompt: str = Form(...),
     # token: str = Depends(auth.oauth2_scheme), # Auth temporarily disabled for demo simplicity
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     # 1. Image Processing
-    contents = await image.read()
+    with metrics.timed("upload_read", "form"):
+        contents = await image.read()
     try:
         pil_image = ai_service.process_medical_image(contents, image.filename)
     except ValueError:
@@ -111,35 +165,114 @@ async def analyze_case(
             "error": "Image rejected. Please upload a valid medical radiology image."
         }
 
-    # 3. AI Analysis
-    # 3. AI Analysis
-    result = ai_service.analyze_with_gemini(pil_image, prompt)
+    # 3. AI Analysis (off the event loop, so identical concurrent uploads can share one call)
+    result = await run_in_threadpool(ai_service.analyze_with_gemini, pil_image, prompt)
     
-    # 4. Create Case in DB
+    # 4. Persist the upload (content-addressed: a repeated study is stored once) and create the Case
     # user = auth.get_current_user(token, db)
-    # Save image to disk (mock path for now)
-    image_path = f"uploads/{image.filename}" 
-    # Ensure directory exists in real app
-    
+    store = blob_store.get_blob_store()
+    digest = await run_in_threadpool(store.put, contents)
+    previews.schedule(store, digest, contents, image.filename)
+
     new_case = models.Case(
         patient_id_hash="demo_hash", 
-        image_path=image_path, 
-        ai_result_json=json.dumps(result),
+        image_path=store.uri(digest),
+        image_sha256=digest,
         status="pending_review"
     )
+    new_case.set_ai_result(result)
     db.add(new_case)
-    db.commit()
-    db.refresh(new_case)
+    with tracing.span("db.commit"), metrics.timed("db_commit", database.engine.dialect.name):
+        await db.commit()
 
     # 5. Notify Reviewers via WebSocket
-    await manager.broadcast(json.dumps({
-        "type": "new_case", 
-        "case_id": new_case.id, 
-        "summary": result['image_findings'][:50] + "..."
-    }))
+    with metrics.timed("broadcast", "websocket"):
+        await manager.broadcast(json.dumps({
+            "type": "new_case", 
+            "case_id": new_case.id, 
+            "summary": result['image_findings'][:50] + "..."
+        }))
 
     return result
 
+def _iter_batch_sources(sources):
+    """ Expands ZIP archives member by member; plain uploads pass through. Closes each source when done. """
+    for name, fileobj in sources:
+        try:
+            if name.lower().endswith(".zip"):
+                yield from batch.iter_zip_studies(fileobj)
+            elif batch.is_study(name):
+                fileobj.seek(0)
+                yield name, fileobj.read()
+        finally:
+            fileobj.close()
+
+def _run_batch(sources, prompt: str):
+    """
+    Runs the batch pipeline, persisting each accepted study as a Case. Yields result records then a summary.
+    Cases are committed every BATCH_SIZE studies; if the client disconnects, the uncommitted ones are
+    rolled back but their blobs stay in the store (blobs are content-addressed and may already be
+    shared with another case, so they are never deleted here).
+    """
+    store = blob_store.get_blob_store()
+    stats = batch.Throughput()
+    db = database.SessionLocal()
+    try:
+        for record in batch.analyze_items(_iter_batch_sources(sources), prompt):
+            out = {"type": "result", "filename": record["filename"], "status": record["status"]}
+            if record["status"] == "ok":
+                digest = store.put(record["data"])
+                previews.schedule(store, digest, record["data"], record["filename"])
+                new_case = models.Case(patient_id_hash="demo_hash", image_path=store.uri(digest),
+                                       image_sha256=digest, status="pending_review")
+                new_case.set_ai_result(record["result"])
+                db.add(new_case)
+                db.flush()
+                out["case_id"] = new_case.id
+            if "result" in record: out["result"] = record["result"]
+            if "error" in record: out["error"] = record["error"]
+            stats.add(record["status"])
+            if sum(stats.counts.values()) % batch.BATCH_SIZE == 0:
+                db.commit()
+            yield out
+        db.commit()
+        summary = stats.summary()
+        logger.info(f"Batch finished: {summary}")
+        yield {"type": "summary", **summary}
+    finally:
+        db.close()
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    prompt: str = Form(batch.DEFAULT_PROMPT),
+    stream: bool = Form(True),
+):
+    """
+    Analyses many studies in one request: DICOM/PNG/JPEG uploads and/or ZIP archives of them.
+    Streams one NDJSON line per study plus a final throughput summary (or returns them together with stream=false).
+    """
+    # FastAPI closes form uploads as soon as the handler returns, before a streamed body is sent,
+    # so take ownership of the spooled files and close them ourselves once they are consumed.
+    sources = []
+    for upload in files:
+        sources.append((upload.filename or "", upload.file))
+        upload.file = io.BytesIO()
+    try:
+        await run_in_threadpool(batch.check_upload_limits, sources)
+    except (batch.BatchTooLarge, zipfile.BadZipFile) as e:
+        for _, fileobj in sources:
+            fileobj.close()
+        if isinstance(e, zipfile.BadZipFile):
+            raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {e}")
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    records = _run_batch(sources, prompt)
+    if stream:
+        return StreamingResponse((json.dumps(r) + "\n" for r in records), media_type="application/x-ndjson")
+    results = await run_in_threadpool(list, records)
+    return {"results": results[:-1], "summary": results[-1]}
+
 @app.post("/symptom_analysis")
 async def analyze_symptom(
     problem: str = Form(...)
@@ -148,23 +281,220 @@ async def analyze_symptom(
     Direct endpoint for "Why/How" medical knowledge.
     """
     try:
-        knowledge = ai_service.medical_knowledge_lookup(problem)
+        knowledge = await run_in_threadpool(ai_service.medical_knowledge_lookup, problem)
         return knowledge
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/cases")
-async def get_cases(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
-    cases = db.query(models.Case).all()
-    # Parse JSON for frontend
+async def get_cases(
+    status: Optional[str] = None,
+    confidence: Optional[str] = None,
+    abnormal: Optional[bool] = None,
+    image_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Lists cases, optionally narrowed by the promoted triage fields,
+    e.g. /cases?confidence=moderate&abnormal=true&since=<today> for the reviewer triage queue.
+    """
+    query = _filter_cases(select(models.Case), status, since, until, confidence, abnormal, image_type)
     results = []
-    for c in cases:
-        c_dict = c.__dict__
-        if '_sa_instance_state' in c_dict: del c_dict['_sa_instance_state']
-        c_dict['ai_result'] = json.loads(c.ai_result_json) if c.ai_result_json else {}
+    for c in (await db.execute(query.order_by(models.Case.created_at.desc()))).scalars():
+        c_dict = {col.name: getattr(c, col.name) for col in models.Case.__table__.columns if col.name != "ai_result_zlib"}
+        c_dict['ai_result'] = c.get_ai_result()
         results.append(c_dict)
     return results
 
+# --- IMAGE DOWNLOAD (range requests for reviewers) ---
+
+RANGE_IGNORED = "ignore"
+
+def _parse_range(header: str, size: int):
+    """
+    Parses a single `bytes=` range into inclusive (start, end); None if unsatisfiable (416).
+    Other units, malformed headers and multi-range requests give RANGE_IGNORED: RFC 9110 lets
+    a server ignore Range, so those get the full body with 200.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return RANGE_IGNORED
+    start, dash, end = spec.strip().partition("-")
+    if not dash or not (start or end) or not all(part.isdigit() for part in (start, end) if part):
+        return RANGE_IGNORED
+    if not start:  # suffix range: last N bytes
+        length = int(end)
+        return (max(size - length, 0), size - 1) if length > 0 and size > 0 else None
+    start = int(start)
+    if end and int(end) < start:
+        return RANGE_IGNORED
+    if start >= size:
+        return None
+    return start, min(int(end), size - 1) if end else size - 1
+
+@app.get("/cases/{case_id}/image")
+async def get_case_image(
+    case_id: int,
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """ Streams the original upload; honours `Range` so viewers can fetch large DICOMs incrementally. """
+    digest = (await db.execute(select(models.Case.image_sha256).where(models.Case.id == case_id))).scalar()
+    store = blob_store.get_blob_store()
+    if not digest or not await run_in_threadpool(store.exists, digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    size = await run_in_threadpool(store.size, digest)
+    media_type = blob_store.sniff_media_type(await run_in_threadpool(store.read, digest, 0, min(131, size - 1)))
+    headers = {"Accept-Ranges": "bytes", "ETag": f'"{digest}"', "Cache-Control": "private, max-age=31536000, immutable"}
+
+    range_header = request.headers.get("range")
+    byte_range = _parse_range(range_header, size) if range_header else RANGE_IGNORED
+    if byte_range == RANGE_IGNORED:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(store.iter_range(digest), media_type=media_type, headers=headers)
+    if byte_range is None:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(store.iter_range(digest, start, end), status_code=206, media_type=media_type, headers=headers)
+
+@app.get("/cases/{case_id}/preview/{level}")
+async def get_case_preview(
+    case_id: int,
+    level: str,
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """ Serves a precomputed preview level (64, 256, 448 or native) with a strong ETag. """
+    if level not in previews.PREVIEW_LEVELS:
+        raise HTTPException(status_code=404, detail=f"Unknown preview level. Use one of: {', '.join(previews.PREVIEW_LEVELS)}")
+    digest = (await db.execute(select(models.Case.image_sha256).where(models.Case.id == case_id))).scalar()
+    if not digest:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    name = previews.derivative_name(level)
+    # Previews are derived from immutable content, so the ETag never needs revalidating against the body
+    etag = f'"{digest}-{name}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    store = blob_store.get_blob_store()
+    data = await run_in_threadpool(store.read_derivative, digest, name)
+    if data is None:
+        reason = await run_in_threadpool(previews.failure, store, digest)
+        if reason is not None:
+            raise HTTPException(status_code=415, detail=f"No preview available for this image: {reason}")
+        # Legacy case or ingest still running: queue it instead of decoding on the request path
+        if await run_in_threadpool(store.exists, digest):
+            previews.schedule(store, digest)
+        raise HTTPException(status_code=404, detail="Preview not ready", headers={"Retry-After": "2"})
+    return Response(content=data, media_type=previews.media_type(), headers=headers)
+
+# --- ANALYTICS EXPORT ---
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "patient_id_hash", "image_path", "status", "created_at")
+
+def _filter_cases(query, status: Optional[str] = None, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  confidence: Optional[str] = None, abnormal: Optional[bool] = None, image_type: Optional[str] = None):
+    """ Applies the optional case filters shared by the listing and export routes (works on Query and select()). """
+    if confidence:
+        query = query.filter(models.Case.confidence == confidence)
+    if abnormal is not None:
+        query = query.filter(models.Case.is_abnormal == abnormal)
+    if image_type:
+        query = query.filter(models.Case.image_type == image_type)
+    if status:
+        query = query.filter(models.Case.status == status)
+    if since:
+        query = query.filter(models.Case.created_at >= since)
+    if until:
+        query = query.filter(models.Case.created_at < until)
+    return query
+
+def _iter_case_rows(**filters):
+    """
+    Streams raw case rows from a server-side cursor.
+    Uses its own session because the request-scoped one is closed before the body is sent.
+    """
+    db = database.SessionLocal()
+    try:
+        columns = [getattr(models.Case, name) for name in EXPORT_COLUMNS] + [
+            # Read the stored JSON as text so it can be passed through without a decode/encode round-trip
+            cast(models.Case.ai_result_json, Text).label("ai_result_json"),
+            models.Case.ai_result_zlib,
+        ]
+        query = _filter_cases(db.query(*columns), **filters).order_by(models.Case.id)
+        for row in query.yield_per(EXPORT_BATCH_SIZE):
+            yield row
+    finally:
+        db.close()
+
+def _raw_ai_result(row) -> str:
+    if row.ai_result_zlib:
+        return zlib.decompress(row.ai_result_zlib).decode("utf-8")
+    return row.ai_result_json or ""
+
+def _ndjson_export(rows):
+    buffer = []
+    for row in rows:
+        record = json.dumps({
+            "id": row.id,
+            "patient_id_hash": row.patient_id_hash,
+            "image_path": row.image_path,
+            "status": row.status,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        })
+        # Stored results are already JSON text: splice them in instead of parsing + re-serializing.
+        buffer.append(f'{record[:-1]}, "ai_result": {_raw_ai_result(row) or "{}"}}}\n')
+        if len(buffer) >= EXPORT_BATCH_SIZE:
+            yield "".join(buffer)
+            buffer.clear()
+    if buffer:
+        yield "".join(buffer)
+
+def _csv_export(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS + ("ai_result_json",))
+    for i, row in enumerate(rows, 1):
+        created_at = row.created_at.isoformat() if row.created_at else ""
+        writer.writerow((row.id, row.patient_id_hash, row.image_path, row.status, created_at, _raw_ai_result(row)))
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+@app.get("/cases/export")
+async def export_cases(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+    confidence: Optional[str] = None,
+    abnormal: Optional[bool] = None,
+    image_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Streams every matching case as NDJSON (default) or CSV with constant memory.
+    """
+    rows = _iter_case_rows(status=status, since=since, until=until,
+                           confidence=confidence, abnormal=abnormal, image_type=image_type)
+    if fmt == "csv":
+        return StreamingResponse(_csv_export(rows), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=cases.csv"})
+    return StreamingResponse(_ndjson_export(rows), media_type="application/x-ndjson")
+
 # --- WEBSOCKET ENDPOINT ---
 
 @app.websocket("/ws/chat")
@@ -0,0 +1,148 @@
+"""
+Per-stage latency histograms, exposed in Prometheus text format on /metrics.
+
+Deliberately dependency-free (the same file is shipped with the Kaggle engine): an observation
+is one bisect plus an increment under a lock, so timing the hot path costs well under a
+microsecond. Every stage is recorded in a single histogram family labelled by stage, backend
+and outcome, e.g.
+
+    medgemma_stage_seconds_bucket{stage="gemini",backend="gemini",outcome="ok",le="2.5"} 41
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() != "false"
+
+# Seconds; spans sub-millisecond resizes through multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+
+class Histogram:
+    """ Cumulative-bucket histogram keyed by a fixed tuple of label names. """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labelvalues, series in sorted(snapshot.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {series[-1]}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+class Counter:
+    """ Monotonic counter keyed by a fixed tuple of label names. """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = dict(self._values)
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labelvalues, value in sorted(snapshot.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues))
+            yield f"{self.name}{{{labels}}} {value}"
+
+class Gauge:
+    """ Point-in-time values read from a callback at scrape time: fn() -> {labelvalues tuple: value}. """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], fn: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labelvalues, value in sorted(self.fn().items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues))
+            yield f"{self.name}{{{labels}}} {value}"
+
+_REGISTRY: List = []
+
+def register(family):
+    """ Adds a Histogram / Counter / Gauge to the /metrics output; returns it for assignment. """
+    _REGISTRY.append(family)
+    return family
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+STAGE_SECONDS = register(Histogram(
+    "medgemma_stage_seconds",
+    "Latency of each request stage (upload_read, decode, windowing, resize, gate, remote, gemini, "
+    "local_prefill, local_decode, db_commit, broadcast).",
+    ("stage", "backend", "outcome"),
+))
+
+def observe(stage: str, seconds: float, backend: str = "local", outcome: str = "ok"):
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage, backend, outcome)
+
+class _Stage:
+    __slots__ = ("backend", "outcome")
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.outcome = "ok"
+
+@contextmanager
+def timed(stage: str, backend: str = "local"):
+    """
+    Times the block into STAGE_SECONDS. The yielded object's `backend` / `outcome` can be
+    changed inside the block; an exception records outcome="error" and propagates.
+    """
+    labels = _Stage(backend)
+    started = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels.outcome = "error"
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, labels.backend, labels.outcome)
+
+def render() -> str:
+    return "\n".join(line for family in _REGISTRY for line in family.collect()) + "\n"
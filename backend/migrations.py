@@ -0,0 +1,131 @@
+"""
+Minimal schema migration runner.
+
+`create_all` only creates missing tables, so changes to existing tables (new indexes,
+new columns) are applied here as numbered revisions recorded in `schema_migrations`.
+
+Usage:
+    python -m backend.migrations            # upgrade to the latest revision
+    python -m backend.migrations --status   # show the applied revision
+"""
+import argparse
+import logging
+import json
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, select, text
+
+from . import database, models
+
+logger = logging.getLogger("MedGemma-Migrations")
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("revision", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = []  # (revision, description, upgrade_fn), kept sorted by revision
+
+def migration(revision: int, description: str):
+    """ Registers an upgrade step. Steps must be idempotent: fresh databases already have the latest schema from create_all. """
+    def register(fn):
+        MIGRATIONS.append((revision, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+def _create_indexes(conn, table, *names):
+    """ Creates the named indexes declared on the model (revisions must not touch later revisions' columns). """
+    for index in table.indexes:
+        if index.name in names:
+            index.create(bind=conn, checkfirst=True)
+
+def _add_columns(conn, table, *names):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"))
+
+# --- REVISIONS ---
+
+@migration(1, "Composite indexes for work queues, per-case reviews/messages and time-ordered feeds")
+def _add_query_indexes(conn):
+    _create_indexes(conn, models.Case.__table__, "ix_cases_status_created_at", "ix_cases_created_at")
+    _create_indexes(conn, models.Review.__table__, "ix_reviews_case_id_created_at", "ix_reviews_doctor_id_created_at")
+    _create_indexes(conn, models.ChatMessage.__table__, "ix_chat_messages_case_id_timestamp", "ix_chat_messages_timestamp")
+
+@migration(2, "Native JSON ai_result_json with promoted, indexed triage fields")
+def _promote_ai_result_fields(conn, batch_size: int = 1000):
+    cases = models.Case.__table__
+    _add_columns(conn, cases, "ai_result_zlib", "image_type", "confidence", "abnormality_location", "is_abnormal")
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE cases ALTER COLUMN ai_result_json TYPE JSONB USING ai_result_json::jsonb"))
+
+    # SQLite keeps JSON as text, so legacy rows read back natively; only the hot fields need backfilling.
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, ai_result_json FROM cases WHERE id > :last_id AND image_type IS NULL "
+            "AND ai_result_json IS NOT NULL ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": batch_size}).fetchall()
+        if not rows:
+            break
+        updates = []
+        for case_id, stored in rows:
+            result = json.loads(stored) if isinstance(stored, str) else stored
+            if isinstance(result, dict):
+                updates.append(dict(models.promoted_fields(result), case_id=case_id))
+        if updates:
+            conn.execute(cases.update().where(cases.c.id == bindparam("case_id")).values(
+                {name: bindparam(name) for name in updates[0] if name != "case_id"}
+            ), updates)
+        last_id = rows[-1][0]
+
+    _create_indexes(conn, cases, "ix_cases_triage", "ix_cases_image_type_created_at", "ix_cases_abnormality_location")
+
+@migration(3, "Content address of the uploaded image")
+def _add_image_sha256(conn):
+    _add_columns(conn, models.Case.__table__, "image_sha256")
+    _create_indexes(conn, models.Case.__table__, "ix_cases_image_sha256")
+
+# --- RUNNER ---
+
+def current_revision(engine=None) -> int:
+    engine = engine or database.engine
+    if not inspect(engine).has_table("schema_migrations"):
+        return 0
+    with engine.connect() as conn:
+        revisions = conn.execute(select(schema_migrations.c.revision)).scalars().all()
+    return max(revisions, default=0)
+
+def upgrade(engine=None) -> int:
+    """ Creates missing tables, then applies every pending revision in its own transaction. """
+    engine = engine or database.engine
+    models.Base.metadata.create_all(bind=engine)
+    _meta.create_all(bind=engine)
+
+    applied = current_revision(engine)
+    for revision, description, fn in MIGRATIONS:
+        if revision <= applied:
+            continue
+        logger.info(f"Applying migration {revision}: {description}")
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(revision=revision, description=description))
+        applied = revision
+    return applied
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply MedGemma database migrations.")
+    parser.add_argument("--status", action="store_true", help="Print the applied revision and exit")
+    args = parser.parse_args()
+    if args.status:
+        print(f"Current revision: {current_revision()} (latest: {MIGRATIONS[-1][0]})")
+    else:
+        print(f"Database at revision {upgrade()}")
@@ -1,9 +1,43 @@
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Index, JSON, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from typing import Optional
+import json
+import os
+import zlib
 from .database import Base
 
+# Native JSON: JSON1 text on SQLite, JSONB on PostgreSQL
+JSONType = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+# Reports larger than this (serialized bytes) are stored zlib-compressed; 0 disables compression
+AI_RESULT_COMPRESS_BYTES = int(os.getenv("AI_RESULT_COMPRESS_BYTES", "0"))
+
+# abnormality_location values that mean "nothing found"
+NORMAL_LOCATIONS = {"none", "normal", "no focal abnormality"}
+
+def _is_abnormal(result: dict) -> Optional[bool]:
+    """ Derives the triage flag from a report; None when the report doesn't say. """
+    location = str(result.get("abnormality_location") or "").strip().lower()
+    if location:
+        if location.startswith(("n/a", "see findings")):
+            return None
+        return not (location in NORMAL_LOCATIONS or location.startswith("no "))
+    if isinstance(result.get("abnormalities"), list):
+        return bool(result["abnormalities"])
+    return None
+
+def promoted_fields(result: dict) -> dict:
+    """ Column values for the hot report fields that triage queries filter on. """
+    fields = {}
+    for field in ("image_type", "confidence", "abnormality_location"):
+        value = result.get(field)
+        fields[field] = str(value) if value is not None else None
+    fields["is_abnormal"] = _is_abnormal(result)
+    return fields
+
 class User(Base):
     __tablename__ = "users"
 
@@ -13,20 +47,65 @@ class User(Base):
     role = Column(String) # "uploader", "reviewer", "admin"
     is_active = Column(Boolean, default=True)
 
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    token_hash = Column(String(64), primary_key=True) # sha256 of the logged-out JWT
+    expires_at = Column(DateTime, index=True) # the token's own exp; rows are pruned after it
+
 class Case(Base):
     __tablename__ = "cases"
 
     id = Column(Integer, primary_key=True, index=True)
     patient_id_hash = Column(String, index=True)
-    image_path = Column(String)
+    image_path = Column(String) # Blob store location of the original upload
+    image_sha256 = Column(String(64)) # Content address of the upload (see blob_store)
     status = Column(String, default="pending_ai") # pending_ai, pending_review, completed
-    ai_result_json = Column(Text) # Storing JSON as text for simplicity in SQLite
+    ai_result_json = Column(JSONType) # Full report, or just the hot fields when ai_result_zlib is set
+    ai_result_zlib = Column(LargeBinary, nullable=True) # Compressed full report for large results
     created_at = Column(DateTime, default=datetime.utcnow)
-    
+
+    # Hot report fields promoted at write time so triage filters run in the database
+    image_type = Column(String)
+    confidence = Column(String) # high, moderate, low
+    abnormality_location = Column(String)
+    is_abnormal = Column(Boolean)
+
     # Relationships
     reviews = relationship("Review", back_populates="case")
     chat_messages = relationship("ChatMessage", back_populates="case")
 
+    __table_args__ = (
+        # Reviewer work queues: WHERE status = ? ORDER BY created_at
+        Index("ix_cases_status_created_at", "status", "created_at"),
+        # Time-ordered feeds and export windows
+        Index("ix_cases_created_at", "created_at"),
+        # Triage: "moderate-confidence abnormal cases from today"
+        Index("ix_cases_triage", "confidence", "is_abnormal", "created_at"),
+        Index("ix_cases_image_type_created_at", "image_type", "created_at"),
+        Index("ix_cases_abnormality_location", "abnormality_location"),
+        Index("ix_cases_image_sha256", "image_sha256"),
+    )
+
+    def set_ai_result(self, result: dict):
+        """ Stores a report and promotes its hot fields; large reports are compressed when enabled. """
+        hot = promoted_fields(result)
+        for name, value in hot.items():
+            setattr(self, name, value)
+
+        serialized = json.dumps(result)
+        if AI_RESULT_COMPRESS_BYTES and len(serialized) > AI_RESULT_COMPRESS_BYTES:
+            self.ai_result_zlib = zlib.compress(serialized.encode("utf-8"))
+            self.ai_result_json = hot
+        else:
+            self.ai_result_zlib = None
+            self.ai_result_json = result
+
+    def get_ai_result(self) -> dict:
+        if self.ai_result_zlib:
+            return json.loads(zlib.decompress(self.ai_result_zlib))
+        return self.ai_result_json or {}
+
 class Review(Base):
     __tablename__ = "reviews"
 
@@ -40,6 +119,11 @@ class Review(Base):
     case = relationship("Case", back_populates="reviews")
     doctor = relationship("User")
 
+    __table_args__ = (
+        Index("ix_reviews_case_id_created_at", "case_id", "created_at"),
+        Index("ix_reviews_doctor_id_created_at", "doctor_id", "created_at"),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
@@ -51,3 +135,8 @@ class ChatMessage(Base):
 
     case = relationship("Case", back_populates="chat_messages")
     sender = relationship("User")
+
+    __table_args__ = (
+        Index("ix_chat_messages_case_id_timestamp", "case_id", "timestamp"),
+        Index("ix_chat_messages_timestamp", "timestamp"),
+    )
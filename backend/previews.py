@@ -0,0 +1,101 @@
+"""
+Preview pyramids for reviewer thumbnails.
+
+Each upload is decoded once at ingest (on a background worker) and stored as a set of
+downscaled WebP/JPEG derivatives next to its blob, so the review UI never re-decodes
+DICOM on page load. Derivatives are content-addressed through their source blob and
+therefore immutable, which is what makes strong ETags + long cache lifetimes safe.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image
+
+from . import ai_service
+from .blob_store import BlobStore, sniff_media_type
+
+logger = logging.getLogger("MedGemma-Previews")
+
+# Longest edge per level; None keeps the native resolution (re-encoded for the browser)
+PREVIEW_LEVELS = {"64": 64, "256": 256, "448": 448, "native": None}
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "webp").lower()  # webp | jpeg
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))
+
+_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+_executor = ThreadPoolExecutor(max_workers=PREVIEW_WORKERS, thread_name_prefix="previews")
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+def media_type() -> str:
+    return _FORMATS[PREVIEW_FORMAT][1]
+
+def derivative_name(level: str) -> str:
+    return f"preview-{level}.{PREVIEW_FORMAT}"
+
+# Written instead of the pyramid when the upload can't be decoded. Blobs are immutable, so the
+# failure is permanent and is never retried.
+FAILED_MARKER = "preview-failed"
+
+def failure(store: BlobStore, digest: str) -> Optional[str]:
+    """ Why no preview can be made for the blob, or None if it hasn't failed. """
+    marker = store.read_derivative(digest, FAILED_MARKER)
+    return marker.decode("utf-8", "replace") if marker is not None else None
+
+def _encode(image: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format=_FORMATS[PREVIEW_FORMAT][0], quality=PREVIEW_QUALITY)
+    return buf.getvalue()
+
+def build_pyramid(image: Image.Image) -> Dict[str, bytes]:
+    """ Encodes every level, downscaling from the previous (larger) level rather than from native each time. """
+    pyramid = {"native": _encode(image)}
+    current = image
+    for level, edge in sorted(((l, e) for l, e in PREVIEW_LEVELS.items() if e), key=lambda item: -item[1]):
+        current = current.copy()
+        current.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        pyramid[level] = _encode(current)
+    return pyramid
+
+def generate(store: BlobStore, digest: str, file_bytes: Optional[bytes] = None, filename: Optional[str] = None):
+    """
+    Decodes the upload once and stores all levels; the 64px level is written last and marks completion.
+    An upload that can't be decoded or encoded gets FAILED_MARKER instead.
+    """
+    if store.read_derivative(digest, derivative_name("64")) is not None or failure(store, digest) is not None:
+        return
+    if file_bytes is None:
+        file_bytes = store.read(digest)
+    if not filename:
+        filename = "study.dcm" if sniff_media_type(file_bytes[:132]) == "application/dicom" else "study"
+
+    try:
+        pyramid = build_pyramid(ai_service.decode_medical_image(file_bytes, filename))
+    except (ValueError, OSError) as e:
+        store.put_derivative(digest, FAILED_MARKER, str(e).encode("utf-8"))
+        logger.warning(f"No preview possible for {digest[:12]}: {e}")
+        return
+    for level in sorted(pyramid, key=lambda l: PREVIEW_LEVELS[l] or float("inf"), reverse=True):
+        store.put_derivative(digest, derivative_name(level), pyramid[level])
+    logger.info(f"Preview pyramid stored for {digest[:12]} ({', '.join(pyramid)})")
+
+def _run(store, digest, file_bytes, filename):
+    try:
+        generate(store, digest, file_bytes, filename)
+    except Exception as e:
+        logger.error(f"Preview generation failed for {digest[:12]}: {e}")
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(digest)
+
+def schedule(store: BlobStore, digest: str, file_bytes: Optional[bytes] = None, filename: Optional[str] = None):
+    """ Queues pyramid generation on the background worker; duplicate requests for the same blob are dropped. """
+    with _in_flight_lock:
+        if digest in _in_flight:
+            return
+        _in_flight.add(digest)
+    _executor.submit(_run, store, digest, file_bytes, filename)
@@ -0,0 +1,288 @@
+"""
+Two-level response cache for the text-only LLM paths (symptom lookup and chat).
+
+Level 1 is exact: the normalized question text ("Why do I get headaches?" -> "why do i get headaches").
+Level 2 is semantic: a local hashed bag-of-features embedding (content words, word bigrams and
+character trigrams; phrasing words like "do" / "get" dropped) searched with a NumPy dot
+product against every cached entry. A hit needs cosine >= SEMANTIC_CACHE_THRESHOLD and the same
+question signature: what is asked (causes, effects, when, how often, ...), the modal ("can" /
+"should") and, for cause / effect questions, which words are the cause and which the effect.
+So "headache causes" reuses the answer for "why do I get headaches", but "what does high blood
+pressure cause" never gets the answer for "what causes high blood pressure".
+
+Entries expire after SEMANTIC_CACHE_TTL seconds and the least recently used entry is evicted
+past SEMANTIC_CACHE_MAX_ENTRIES. With SEMANTIC_CACHE_DIR set, each cache is written to
+<dir>/<name>.json on shutdown and reloaded on startup (embeddings are recomputed, they are
+deterministic). Hit rate and LLM calls saved are on /metrics and /ai_health.
+"""
+import copy
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+
+logger = logging.getLogger("MedGemma-Cache")
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() != "false"
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))  # 0 or >1 disables level 2
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", "")  # empty: in-memory only
+
+CACHE_REQUESTS = metrics.register(metrics.Counter(
+    "medgemma_cache_requests_total",
+    "Response cache lookups by cache and result (exact / semantic hits save an LLM call; miss).",
+    ("cache", "result"),
+))
+
+# Words that change how a question is phrased, not what it is about. Question, modal and
+# cause / effect words are dropped here too, but they make up the signature (_signature)
+_FILLER = frozenset("""
+a an the and or of to in on at for with is are was be been am do does did i im me my we you your it its this
+that these those there what whats why how when where which who can could should would will may might must get gets
+getting got have has had having feel feeling really very so some any about from by cause causes caused causing
+reason reasons effect effects happen happens happening tell explain please help know
+""".split())
+
+_QUESTION_WORDS = ("why", "what", "whats", "how", "when", "where", "which", "who")
+_HOW_MODIFIERS = frozenset("often much many long soon far".split())
+_MODALS = {"can": "can", "could": "can", "may": "can", "might": "can", "should": "should", "must": "should"}
+_AUXILIARIES = frozenset("do does did can could will would may might should must".split())
+_CAUSE_VERBS = frozenset("cause causes caused causing".split())
+_CAUSE_NOUNS = frozenset("reason reasons".split())
+_EFFECT_NOUNS = frozenset("effect effects".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+def normalize(text: str) -> str:
+    """ Exact-level key: lowercase words, punctuation and extra whitespace dropped. """
+    return " ".join(_WORD.findall(text.lower()))
+
+def _stem(word: str) -> str:
+    # Just enough to fold plurals ("headaches" / "headache"); the trigrams absorb the rest
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def _content(words: List[str]) -> List[str]:
+    return [_stem(w) for w in words if w not in _FILLER]
+
+def _signature(text: str) -> Tuple:
+    """
+    (asks, modal, roles) for a question. `asks` is "cause", "effect", "relation" (does A cause
+    B), "meaning", "how often" / "how much" / ... or the question word; roles tag the content
+    words of a cause / effect question as ("cause", word) or ("effect", word).
+    """
+    words = normalize(text).split()
+    asks, roles = None, []
+    verb = next((i for i, w in enumerate(words) if w in _CAUSE_VERBS | _CAUSE_NOUNS), None)
+    if verb is not None:
+        before, after = _content(words[:verb]), _content(words[verb + 1:])
+        auxiliary = next((i for i, w in enumerate(words[:verb]) if w in _AUXILIARIES), None)
+        if words[verb] in _CAUSE_NOUNS:                     # "reasons for headaches"
+            cause, effect = [], before + after
+        elif words[verb + 1:verb + 2] == ["by"]:            # "is a headache caused by stress"
+            cause, effect = after, before
+        elif auxiliary is not None and _content(words[auxiliary + 1:verb]):
+            cause, effect = before, after                   # "what does diabetes cause"
+        elif not before or not after:                       # "what causes X" / "headache causes"
+            cause, effect = [], before + after
+        else:                                               # "stress causes headaches"
+            cause, effect = before, after
+        asks = "relation" if cause and effect else "effect" if cause else "cause"
+        roles = [("cause", w) for w in cause] + [("effect", w) for w in effect]
+    elif any(w in _EFFECT_NOUNS for w in words):            # "side effects of ibuprofen"
+        asks, roles = "effect", [("cause", w) for w in _content(words)]
+    elif "why" in words:
+        asks, roles = "cause", [("effect", w) for w in _content(words)]
+    elif any(w in ("mean", "means", "meaning") for w in words):
+        asks = "meaning"
+    else:
+        for i, w in enumerate(words):
+            if w in _QUESTION_WORDS:
+                following = words[i + 1] if i + 1 < len(words) else ""
+                asks = f"how {following}" if w == "how" and following in _HOW_MODIFIERS else w.rstrip("s")
+                break
+    # A modal matters for advice ("can I" vs "should I"), not for what causes what
+    modal = None if asks in ("cause", "effect", "relation") else next((_MODALS[w] for w in words if w in _MODALS), None)
+    return asks, modal, frozenset(roles)
+
+def _features(text: str) -> Dict[str, float]:
+    words = _content(normalize(text).split())
+    features: Dict[str, float] = {}
+    for i, word in enumerate(words):
+        features[f"w:{word}"] = features.get(f"w:{word}", 0.0) + 1.0
+        if i:
+            key = f"b:{words[i - 1]} {word}"
+            features[key] = features.get(key, 0.0) + 0.5
+        padded = f"^{word}$"
+        for j in range(len(padded) - 2):
+            key = f"c:{padded[j:j + 3]}"
+            features[key] = features.get(key, 0.0) + 0.25
+    return features
+
+def embed(text: str, dim: int = SEMANTIC_CACHE_DIM) -> np.ndarray:
+    """ Unit-length hashed feature vector (crc32 is stable across processes, unlike hash()). """
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in _features(text).items():
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if (h >> 31) & 1 else -weight
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+class SemanticCache:
+    """ Thread-safe exact + semantic cache with TTL and LRU eviction. Values are JSON-serializable. """
+
+    def __init__(self, name: str, ttl: float = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, dim: int = SEMANTIC_CACHE_DIM,
+                 directory: str = SEMANTIC_CACHE_DIR):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dim = dim
+        self.path = os.path.join(directory, f"{name}.json") if directory else None
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()  # normalized text -> {text, value, expires_at, slot}
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)  # row per slot; freed rows are zeroed
+        self.slot_keys: List[Optional[str]] = [None] * max_entries
+        self.slot_signatures: List[Optional[Tuple]] = [None] * max_entries
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def _drop(self, key: str):
+        entry = self.entries.pop(key)
+        self.vectors[entry["slot"]] = 0
+        self.slot_keys[entry["slot"]] = None
+        self.slot_signatures[entry["slot"]] = None
+        self.free_slots.append(entry["slot"])
+
+    def _count(self, result: str):
+        CACHE_REQUESTS.inc(self.name, result)
+
+    def get(self, text: str):
+        """ Cached value for `text` or a semantically equivalent question; None on a miss. """
+        key = normalize(text)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["expires_at"] < now:
+                self._drop(key)
+                entry = None
+            result = "exact"
+            if entry is None and 0 < self.threshold <= 1 and self.entries:
+                scores = self.vectors @ embed(text, self.dim)
+                signature = _signature(text)
+                close = np.flatnonzero(scores >= self.threshold)
+                # The closest entry that asks the same thing; a different question signature never hits
+                match = next((self.slot_keys[slot] for slot in close[np.argsort(-scores[close])]
+                              if self.slot_signatures[slot] == signature), None)
+                if match is not None:
+                    entry = self.entries[match]
+                    if entry["expires_at"] < now:
+                        self._drop(match)
+                        entry = None
+                    else:
+                        key, result = match, "semantic"
+            if entry is None:
+                self._count("miss")
+                return None
+            self.entries.move_to_end(key)
+            value = entry["value"]
+        self._count(result)
+        logger.debug("Cache hit", extra={"cache": self.name, "result": result})
+        return copy.deepcopy(value)  # callers may mutate the response
+
+    def put(self, text: str, value, expires_at: Optional[float] = None):
+        key = normalize(text)
+        if not key:
+            return
+        vector = embed(text, self.dim)
+        signature = _signature(text)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            while not self.free_slots:
+                self._drop(next(iter(self.entries)))  # least recently used
+            slot = self.free_slots.pop()
+            self.vectors[slot] = vector
+            self.slot_keys[slot] = key
+            self.slot_signatures[slot] = signature
+            self.entries[key] = {"text": text, "value": copy.deepcopy(value), "slot": slot,
+                                 "expires_at": expires_at or time.time() + self.ttl}
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._drop(key)
+
+    def save(self):
+        """ Atomically writes the live entries (LRU order) to SEMANTIC_CACHE_DIR/<name>.json. """
+        if not self.path:
+            return
+        now = time.time()
+        with self.lock:
+            records = [{"text": e["text"], "value": e["value"], "expires_at": e["expires_at"]}
+                       for e in self.entries.values() if e["expires_at"] >= now]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=f".{self.name}.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        os.replace(tmp, self.path)
+        logger.info("Saved response cache", extra={"cache": self.name, "entries": len(records)})
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load response cache {self.path}: {e}")
+            return
+        now = time.time()
+        for record in records:
+            if record["expires_at"] >= now:
+                self.put(record["text"], record["value"], record["expires_at"])
+        logger.info("Loaded response cache", extra={"cache": self.name, "entries": len(self.entries)})
+
+    def stats(self) -> dict:
+        exact, semantic, miss = (int(CACHE_REQUESTS.value(self.name, r)) for r in ("exact", "semantic", "miss"))
+        lookups = exact + semantic + miss
+        return {"entries": len(self.entries), "exact_hits": exact, "semantic_hits": semantic, "misses": miss,
+                "hit_rate": round((exact + semantic) / lookups, 3) if lookups else 0.0,
+                "llm_calls_saved": exact + semantic}
+
+_caches: Dict[str, SemanticCache] = {}
+_caches_lock = threading.Lock()
+
+def get_cache(name: str) -> Optional[SemanticCache]:
+    """ Process-wide cache by name; None when SEMANTIC_CACHE_ENABLED=false. """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = SemanticCache(name)
+        return _caches[name]
+
+def save_all():
+    for cache in list(_caches.values()):
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning(f"Could not save response cache {cache.name}: {e}")
+
+def stats() -> dict:
+    return {name: cache.stats() for name, cache in list(_caches.items())}
@@ -0,0 +1,72 @@
+"""
+Request coalescing: concurrent calls with the same key share one execution.
+
+    result = singleflight.do("analyze", key, lambda: expensive(...))
+
+The first caller for a key (the leader) runs the function; callers arriving while it is in
+flight (followers) wait on the same future and get a copy of its result, or its exception.
+Nothing is remembered once the call finishes - that is the response cache's job - so this
+only removes duplicate upstream work during spikes and client retries.
+"""
+import copy
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Tuple
+
+from PIL import Image
+
+from . import metrics
+
+logger = logging.getLogger("MedGemma-SingleFlight")
+
+COALESCED_CALLS = metrics.register(metrics.Counter(
+    "medgemma_singleflight_calls_total",
+    "AI calls by key space and role: leader (did the work) or follower (shared an in-flight result).",
+    ("space", "role"),
+))
+
+_lock = threading.Lock()
+_inflight: Dict[Tuple[str, str], Future] = {}
+_spaces = set()
+
+def image_key(image: Image.Image, *parts: str) -> str:
+    """ Key for an image-based call: digest of the decoded pixels plus the other inputs. """
+    digest = hashlib.sha256(image.tobytes())
+    digest.update(f"{image.mode}{image.size}".encode())
+    for part in parts:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+def do(space: str, key: str, fn: Callable):
+    """ Runs fn() once per (space, key) among concurrent callers. """
+    with _lock:
+        future = _inflight.get((space, key))
+        leader = future is None
+        if leader:
+            future = _inflight[(space, key)] = Future()
+        _spaces.add(space)
+    COALESCED_CALLS.inc(space, "leader" if leader else "follower")
+    if not leader:
+        logger.debug("Coalesced with an in-flight call", extra={"space": space})
+        return copy.deepcopy(future.result())  # followers may mutate their results too
+
+    try:
+        result = fn()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(copy.deepcopy(result))  # a snapshot, in case the leader's caller mutates its copy
+        return result
+    finally:
+        with _lock:
+            del _inflight[(space, key)]
+
+def stats() -> dict:
+    """ Per key space: leaders (upstream calls made) and followers (upstream calls saved). """
+    return {space: {"leaders": int(COALESCED_CALLS.value(space, "leader")),
+                    "followers": int(COALESCED_CALLS.value(space, "follower")),
+                    "in_flight": sum(s == space for s, _ in list(_inflight))}
+            for space in sorted(_spaces)}
@@ -0,0 +1,139 @@
+"""
+Structured, non-blocking logging.
+
+setup_logging() routes every record through a QueueHandler; a QueueListener thread does the
+JSON formatting and the stdout write, so a log call on the request path costs a queue put.
+Records carry the request id (X-Request-ID, forwarded to the Kaggle engine) and the current
+trace id. Clinical text must be passed as `extra` fields, never interpolated into the message:
+fields named in LOG_REDACT_FIELDS are replaced by their length unless LOG_REDACT=false.
+High-volume DEBUG lines are sampled at LOG_DEBUG_SAMPLE_RATE (override per call with
+extra={"sample_rate": ...}).
+
+    logger.debug("Remote engine response", extra={"endpoint": "analyze", "raw_output": text})
+    -> {"ts": ..., "level": "DEBUG", "msg": "Remote engine response", "request_id": "...",
+        "endpoint": "analyze", "raw_output": "[redacted: 812 chars]"}
+
+The same file is shipped with the Kaggle engine.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+try:
+    from . import tracing
+except ImportError:  # flat layout next to kaggle_script.py
+    import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json | text
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() != "false"
+LOG_REDACT_FIELDS = frozenset(f.strip() for f in os.getenv(
+    "LOG_REDACT_FIELDS", "prompt,message,problem,symptom,raw_output,image_findings,response,text").split(",") if f.strip())
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("medgemma_request_id", default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """ Uses the caller's id when it looks sane, otherwise generates one; sets it for the current context. """
+    request_id = incoming if incoming and len(incoming) <= 64 and incoming.isprintable() else uuid.uuid4().hex
+    request_id_var.set(request_id)
+    return request_id
+
+def redact(value) -> str:
+    return f"[redacted: {len(str(value))} chars]"
+
+class ContextFilter(logging.Filter):
+    """ Runs on the calling thread: samples DEBUG records, stamps request/trace ids, redacts clinical fields. """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG:
+            rate = getattr(record, "sample_rate", LOG_DEBUG_SAMPLE_RATE)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        record.request_id = request_id_var.get()
+        span = tracing.current_span()
+        record.trace_id = span.trace_id if span else None
+        if LOG_REDACT:
+            for field in LOG_REDACT_FIELDS.intersection(vars(record)):
+                value = getattr(record, field)
+                if value is not None:
+                    setattr(record, field, redact(value))
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS and v is not None)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep extras intact for the JSON formatter; only render what can't cross threads safely
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener: Optional[QueueListener] = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """ Installs the queue handler on the root logger. Idempotent. """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+def shutdown():
+    """ Flushes queued records and stops the listener thread. """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _restart_after_fork():
+    # Forked workers (batch preprocessing pool) inherit the queue but not the listener thread
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
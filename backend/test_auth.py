@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend import auth, models
+from backend.database import Base
+
+class TestTokenInvalidation(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.db = sessionmaker(bind=engine)()
+        self.user = models.User(username="dr_a", hashed_password="-", role="reviewer", is_active=True)
+        self.db.add(self.user)
+        self.db.commit()
+        self.token = auth.create_access_token({"sub": "dr_a"}, expires_delta=timedelta(minutes=5))
+        self.clear_process_state()
+
+    def tearDown(self):
+        self.db.close()
+        self.clear_process_state()
+
+    def clear_process_state(self):
+        """ What another worker (or a restart) starts from. """
+        with auth._cache_lock:
+            auth._token_cache.clear()
+            auth._user_cache.clear()
+            auth._revoked_tokens.clear()
+
+    def assertRejected(self):
+        with self.assertRaises(HTTPException) as raised:
+            auth.get_current_user(self.token, self.db)
+        self.assertEqual(raised.exception.status_code, 401)
+
+    def test_logout_is_persisted(self):
+        self.assertEqual(auth.get_current_user(self.token, self.db).username, "dr_a")
+        auth.revoke_token(self.token, self.db)
+        self.assertRejected()
+        self.clear_process_state()
+        self.assertRejected()
+        self.assertIsNotNone(self.db.get(models.RevokedToken, auth._token_hash(self.token)))
+
+    def test_deactivation_applies_to_cached_user(self):
+        self.assertTrue(auth.get_current_user(self.token, self.db).is_active)
+        self.user.is_active = False
+        self.db.commit()
+        self.assertRejected()
+
+    def test_rename_drops_the_old_username(self):
+        auth.get_current_user(self.token, self.db)
+        self.user.username = "dr_b"
+        self.db.commit()
+        self.assertRejected()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import batch
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Runs the CLI pipeline with a stub analysis that kills the process (no cleanup) after `crash_after` studies
+RUN = textwrap.dedent("""
+    import os, sys
+    from backend import batch
+
+    def analyze_items(items, prompt, pool=None, **kwargs):
+        for count, (name, data) in enumerate(items):
+            if count == crash_after:
+                os._exit(3)
+            yield {"filename": name, "data": data, "status": "ok", "result": {"study": name}}
+
+    root, output, fmt, crash_after = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+    batch.analyze_items = analyze_items
+    batch.run_directory(root, output, fmt, workers=1, checkpoint_every=3)
+""")
+
+class TestResumeAfterCrash(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "studies")
+        os.makedirs(self.root)
+        self.studies = [f"study-{i:02d}.png" for i in range(10)]
+        for name in self.studies:
+            with open(os.path.join(self.root, name), "wb") as f:
+                f.write(name.encode())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_cli(self, output, fmt, crash_after):
+        return subprocess.run([sys.executable, "-c", RUN, self.root, output, fmt, str(crash_after)],
+                              cwd=ROOT, capture_output=True, text=True, timeout=120)
+
+    def assert_resumes(self, output, fmt, read_paths):
+        crashed = self.run_cli(output, fmt, crash_after=7)
+        self.assertEqual(crashed.returncode, 3, crashed.stderr)
+        # Two checkpoints (6 studies) made it into the manifest before the kill
+        self.assertEqual(len(batch.load_manifest(output + ".manifest.jsonl")), 6)
+        finished = self.run_cli(output, fmt, crash_after=-1)
+        self.assertEqual(finished.returncode, 0, finished.stderr)
+        self.assertEqual(batch.load_manifest(output + ".manifest.jsonl"), set(self.studies))
+        self.assertTrue(set(self.studies) <= set(read_paths()))
+
+    def test_jsonl_resume(self):
+        output = os.path.join(self.tmp.name, "results.jsonl")
+
+        def read_paths():
+            with open(output, encoding="utf-8") as f:
+                return [json.loads(line)["path"] for line in f]
+        self.assert_resumes(output, "jsonl", read_paths)
+
+    @unittest.skipIf(pq is None, "pyarrow not installed")
+    def test_parquet_resume(self):
+        output = os.path.join(self.tmp.name, "results")
+        self.assert_resumes(output, "parquet", lambda: pq.read_table(output).column("path").to_pylist())
+        self.assertFalse([f for f in os.listdir(output) if not f.endswith(".parquet")])
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+class TestUploadLimits(unittest.TestCase):
+    def setUp(self):
+        self.limits = batch.BATCH_MAX_STUDY_BYTES, batch.BATCH_MAX_STUDIES, batch.BATCH_MAX_TOTAL_BYTES
+        batch.BATCH_MAX_STUDY_BYTES, batch.BATCH_MAX_STUDIES, batch.BATCH_MAX_TOTAL_BYTES = 1000, 3, 2500
+
+    def tearDown(self):
+        batch.BATCH_MAX_STUDY_BYTES, batch.BATCH_MAX_STUDIES, batch.BATCH_MAX_TOTAL_BYTES = self.limits
+
+    def test_within_limits(self):
+        archive = make_zip([("a.png", b"x" * 1000), ("notes.txt", b"x" * 10 ** 6)])  # non-studies don't count
+        batch.check_upload_limits([("a.zip", archive), ("b.dcm", io.BytesIO(b"x" * 1000))])
+        self.assertEqual(archive.tell(), 0)
+
+    def test_zip_bomb_member_is_refused(self):
+        bomb = make_zip([("bomb.dcm", bytes(10 ** 7))])
+        self.assertLess(len(bomb.getvalue()), 20000)
+        with self.assertRaisesRegex(batch.BatchTooLarge, "bomb.dcm"):
+            batch.check_upload_limits([("bomb.zip", bomb)])
+
+    def test_member_count_and_total_size(self):
+        with self.assertRaisesRegex(batch.BatchTooLarge, "more than 3 studies"):
+            batch.check_upload_limits([("many.zip", make_zip([(f"{i}.png", b"x") for i in range(4)]))])
+        with self.assertRaisesRegex(batch.BatchTooLarge, "bytes uncompressed"):
+            batch.check_upload_limits([("a.zip", make_zip([("a.png", b"x" * 900), ("b.png", b"x" * 900)])),
+                                       ("c.png", io.BytesIO(b"x" * 900))])
+
+    def test_endpoint_answers_413(self):
+        from fastapi.testclient import TestClient
+        from backend import main
+        bomb = make_zip([("bomb.dcm", bytes(10 ** 7))]).getvalue()
+        response = TestClient(main.app).post("/analyze/batch", files={"files": ("bomb.zip", bomb, "application/zip")})
+        self.assertEqual(response.status_code, 413)
+
+if __name__ == "__main__":
+    unittest.main()
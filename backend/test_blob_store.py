@@ -0,0 +1,85 @@
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.blob_store import BlobStore, FakeS3Client, LocalBlobStore, S3BlobStore, sha256_hex
+from backend.main import RANGE_IGNORED, _parse_range
+
+class BlobStoreContract:
+    """ Behaviour every backend must share. Subclasses provide make_store(). """
+
+    def setUp(self):
+        self.store = self.make_store()
+        self.data = bytes(range(256)) * 1000
+
+    def test_put_is_content_addressed(self):
+        digest = self.store.put(self.data)
+        self.assertEqual(digest, sha256_hex(self.data))
+        self.assertTrue(self.store.exists(digest))
+        self.assertEqual(self.store.size(digest), len(self.data))
+
+    def test_identical_uploads_are_deduplicated(self):
+        first = self.store.put(self.data)
+        second = self.store.put(bytes(self.data))
+        self.assertEqual(first, second)
+        self.assertEqual(self.blob_count(), 1)
+
+    def test_range_reads(self):
+        digest = self.store.put(self.data)
+        self.assertEqual(self.store.read(digest), self.data)
+        self.assertEqual(self.store.read(digest, 10, 19), self.data[10:20])
+        self.assertEqual(b"".join(self.store.iter_range(digest, 1000, None, chunk_size=7)), self.data[1000:])
+
+    def test_missing_blob(self):
+        self.assertFalse(self.store.exists("0" * 64))
+
+class TestLocalBlobStore(BlobStoreContract, unittest.TestCase):
+    def make_store(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        return LocalBlobStore(self.tmp.name)
+
+    def blob_count(self):
+        return sum(len([f for f in files if not f.startswith(".tmp-")]) for _, _, files in os.walk(self.tmp.name))
+
+    def test_sharded_layout(self):
+        digest = self.store.put(b"x-ray")
+        self.assertTrue(self.store.uri(digest).endswith(f"{digest[:2]}/{digest[2:4]}/{digest}"))
+
+class TestS3BlobStore(BlobStoreContract, unittest.TestCase):
+    def make_store(self):
+        self.client = FakeS3Client()
+        return S3BlobStore(self.client, "bucket", "blobs")
+
+    def blob_count(self):
+        return len(self.client.objects)
+
+class TestBlobStoreInterface(unittest.TestCase):
+    def test_incomplete_backend_fails_on_creation(self):
+        class NoDerivatives(BlobStore):
+            put = exists = size = iter_range = uri = LocalBlobStore.put
+
+        with self.assertRaisesRegex(TypeError, "put_derivative"):
+            NoDerivatives()
+
+class TestParseRange(unittest.TestCase):
+    def test_satisfiable_ranges(self):
+        self.assertEqual(_parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(_parse_range("Bytes=900-", 1000), (900, 999))
+        self.assertEqual(_parse_range("bytes=500-5000", 1000), (500, 999))
+        self.assertEqual(_parse_range("bytes=-100", 1000), (900, 999))
+
+    def test_unsatisfiable_ranges_give_416(self):
+        self.assertIsNone(_parse_range("bytes=1000-", 1000))
+        self.assertIsNone(_parse_range("bytes=-0", 1000))
+
+    def test_unusable_headers_are_ignored(self):
+        for header in ("items=0-5", "bytes", "bytes=abc", "bytes=5", "bytes=-", "bytes=9-2", "bytes=0-1,5-9"):
+            self.assertEqual(_parse_range(header, 1000), RANGE_IGNORED, header)
+
+if __name__ == '__main__':
+    unittest.main()
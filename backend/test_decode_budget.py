@@ -0,0 +1,124 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import decode_budget
+from backend.decode_budget import OutputMonitor, StopWhenComplete
+
+CLINICAL = """1. Image Observations:
+Clear lungs.
+
+2. Clinical Context Summary:
+Cough for two weeks.
+
+3. Correlation Analysis:
+No correlate.
+
+4. Uncertainties & Limitations:
+Single view.
+
+**5. Suggested Clinical Review Considerations:**
+1. Compare with prior films.
+2. Consider lateral view.
+
+1. Image Observations:
+Clear lungs.
+"""
+
+def stream(monitor, text, step=7):
+    for start in range(0, len(text), step):
+        if monitor.feed(text[start:start + step]):
+            break
+    return monitor.finish(text)
+
+class PieceTokenizer:
+    """
+    SentencePiece-like: "▁" marks a word start, the leading space of a decode is dropped, and
+    token 1 alone is half of "é" (decodes to U+FFFD until token 2 follows).
+    """
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def decode(self, ids, skip_special_tokens=True):
+        text = "".join(self.pieces[i] for i in ids).replace("\x01\x02", "é").replace("\x01", "\ufffd").replace("\x02", "")
+        text = text.replace("▁", " ")
+        return text[1:] if text.startswith(" ") else text
+
+class TestOutputMonitor(unittest.TestCase):
+    def test_repeated_section_ends_the_answer(self):
+        monitor = OutputMonitor("clinical")
+        answer = stream(monitor, CLINICAL)
+        self.assertEqual(monitor.reason, "section_repeat")
+        self.assertTrue(answer.endswith("2. Consider lateral view."))  # numbered list items are not headings
+
+    def test_numbered_list_inside_a_section_is_kept(self):
+        text = CLINICAL.replace("1. Compare with prior films.", "1. Cardiology review:\nEcho if symptomatic.\n3. Pulmonary review:\nSpirometry.")
+        monitor = OutputMonitor("clinical")
+        answer = stream(monitor, text)
+        self.assertEqual(monitor.reason, "section_repeat")
+        self.assertTrue(answer.endswith("Spirometry.\n2. Consider lateral view."))
+
+    def test_validation_has_no_section_structure(self):
+        monitor = OutputMonitor("validation")
+        self.assertEqual(stream(monitor, CLINICAL), CLINICAL.strip())
+        self.assertIsNone(monitor.reason)
+
+    def test_stop_strings_need_output_first(self):
+        monitor = OutputMonitor("gatekeeper")
+        self.assertEqual(stream(monitor, "\nA. Safe Clinical Support Request\nReason: routine", step=3),
+                         "A. Safe Clinical Support Request")
+        self.assertEqual(monitor.reason, "stop_string")
+        monitor = OutputMonitor("chat")
+        self.assertEqual(stream(monitor, "Rest and fluids.\nUser: and then?"), "Rest and fluids.")
+
+    def test_json_close(self):
+        monitor = OutputMonitor("report")
+        self.assertEqual(stream(monitor, '```json\n{"image_findings": "a {b}"}\n```\n{"again": 1}'),
+                         '```json\n{"image_findings": "a {b}"}')
+        self.assertEqual(monitor.reason, "json_closed")
+
+    def test_no_end_detected(self):
+        monitor = OutputMonitor("refusal")
+        self.assertEqual(stream(monitor, "Please seek help. "), "Please seek help.")
+        self.assertIsNone(monitor.reason)
+
+class TestStopWhenComplete(unittest.TestCase):
+    def test_streamed_text_matches_full_decode(self):
+        pieces = ["<pad>", "\x01", "\x02", "▁Caf", "▁lungs", "▁are", "▁clear", ".", "\n", "User", ":", "▁hi"]
+        tokenizer = PieceTokenizer(pieces)
+        ids = [3, 1, 2, 4, 5, 6, 7, 3, 1, 2, 7, 8, 9, 10, 11, 4]
+        prompt = [0, 0]
+        monitor = OutputMonitor("chat")
+        criterion = StopWhenComplete(tokenizer, len(prompt), monitor)
+        stopped_at = None
+        for n in range(1, len(ids) + 1):
+            if criterion([prompt + ids[:n]], None):
+                stopped_at = n
+                break
+        self.assertEqual(stopped_at, 14)  # as soon as "\nUser:" is complete
+        full = tokenizer.decode(ids[:stopped_at])
+        self.assertTrue(full.startswith(monitor.text))
+        self.assertEqual(monitor.finish(full), "Café lungs are clear. Café.")
+
+class TestBudgets(unittest.TestCase):
+    def setUp(self):
+        decode_budget._steps.clear()
+
+    def test_budget_is_learned_then_recovers(self):
+        self.assertEqual(decode_budget.max_new_tokens("clinical"), 512)
+        for _ in range(decode_budget.DECODE_BUDGET_MIN_SAMPLES):
+            decode_budget.record("clinical", 200, 512, "section_repeat", 0.1)
+        self.assertEqual(decode_budget.max_new_tokens("clinical"), 250)  # 200 * 1.25 headroom
+        for _ in range(5):
+            budget = decode_budget.max_new_tokens("clinical")
+            decode_budget.record("clinical", budget, budget, None, 0.1)  # ran into the learned budget
+        self.assertEqual(decode_budget.max_new_tokens("clinical"), 512)
+        stats = decode_budget.stats()["clinical"]
+        self.assertEqual(stats["ended_by"], {"section_repeat": 20, "budget": 5})
+        self.assertGreater(stats["tokens_saved"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from backend import auth, database, main, models
+
+PLAIN = {"image_type": "medical", "confidence": "high", "abnormality_location": "None",
+         "image_findings": 'Clear lungs, "no" effusion – résumé \\ done.'}
+LARGE = {"image_type": "medical", "confidence": "moderate", "abnormality_location": "Left hilum",
+         "image_findings": "Hilar prominence. " * 40}
+
+class TestCaseExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = database.make_engine(f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}")
+        database.Base.metadata.create_all(bind=self.engine)
+        sessions = sessionmaker(bind=self.engine)
+
+        with mock.patch.object(models, "AI_RESULT_COMPRESS_BYTES", 200), sessions() as db:
+            for result in (PLAIN, LARGE, None, PLAIN, LARGE):
+                case = models.Case(patient_id_hash="demo_hash", image_path="uploads/x", status="pending_review")
+                if result is not None:
+                    case.set_ai_result(result)
+                db.add(case)
+            db.commit()
+            self.expected = {case.id: case.get_ai_result() for case in db.query(models.Case)}
+            self.assertTrue(any(case.ai_result_zlib for case in db.query(models.Case)))
+
+        self.patches = [mock.patch.object(database, "SessionLocal", sessions), mock.patch.object(main, "EXPORT_BATCH_SIZE", 2)]
+        for patch in self.patches:
+            patch.start()
+        main.app.dependency_overrides[auth.get_current_user] = lambda: models.User(username="admin", role="admin")
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        main.app.dependency_overrides.clear()
+        for patch in self.patches:
+            patch.stop()
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_ndjson_lines_parse_and_match_stored_results(self):
+        response = self.client.get("/cases/export")
+        self.assertEqual(response.status_code, 200)
+        lines = response.text.splitlines()
+        self.assertEqual(len(lines), len(self.expected))
+        for line in lines:
+            record = json.loads(line)
+            self.assertEqual(record["ai_result"], self.expected[record["id"]])
+            self.assertEqual(record["status"], "pending_review")
+
+    def test_csv_rows_match_stored_results(self):
+        response = self.client.get("/cases/export", params={"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(len(rows), len(self.expected))
+        for row in rows:
+            stored = row["ai_result_json"]
+            self.assertEqual(json.loads(stored) if stored else {}, self.expected[int(row["id"])])
+
+    def test_filters_apply_to_the_export(self):
+        lines = self.client.get("/cases/export", params={"confidence": "moderate"}).text.splitlines()
+        self.assertEqual([json.loads(line)["ai_result"] for line in lines], [LARGE, LARGE])
+
+if __name__ == "__main__":
+    unittest.main()
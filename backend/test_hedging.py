@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import hedging
+
+class TestHedgingUnderSaturation(unittest.TestCase):
+    def setUp(self):
+        self.pools = hedging._primary_pool, hedging._secondary_pool, hedging.HEDGE_DEFAULT_DEADLINE_MS
+        hedging._primary_pool = ThreadPoolExecutor(max_workers=1)
+        hedging._secondary_pool = ThreadPoolExecutor(max_workers=1)
+        self.release = threading.Event()
+        hedging._primary_pool.submit(self.release.wait, 5)  # a stuck primary holds the only worker
+
+    def tearDown(self):
+        self.release.set()
+        hedging._primary_pool.shutdown(wait=True)
+        hedging._secondary_pool.shutdown(wait=True)
+        hedging._primary_pool, hedging._secondary_pool, hedging.HEDGE_DEFAULT_DEADLINE_MS = self.pools
+
+    def test_hedge_does_not_queue_behind_stuck_primaries(self):
+        hedging.HEDGE_DEFAULT_DEADLINE_MS = 50
+        hedging._endpoints["test_saturated"] = hedging.EndpointState(budget=1.0)
+        started = time.perf_counter()
+        result = hedging.hedged_call("test_saturated", lambda: {"from": "primary"}, lambda: {"from": "secondary"})
+        self.assertEqual(result, {"from": "secondary"})
+        self.assertLess(time.perf_counter() - started, 1)
+
+    def test_latency_excludes_queue_wait(self):
+        state = hedging._endpoints["test_queued"] = hedging.EndpointState(budget=0.0)  # never hedge
+        threading.Timer(0.3, self.release.set).start()
+        started = time.perf_counter()
+        result = hedging.hedged_call("test_queued", lambda: {"from": "primary"}, lambda: None)
+        self.assertEqual(result, {"from": "primary"})
+        self.assertGreater(time.perf_counter() - started, 0.25)
+        for _ in range(100):  # the latency is recorded by a done-callback on the worker thread
+            if state.latencies:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(state.latencies), 1)
+        self.assertLess(state.latencies[0], 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
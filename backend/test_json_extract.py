@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.json_extract import ANALYSIS_SCHEMA, IncrementalExtractor, extract
+
+REPORT = {"image_type": "medical", "image_findings": 'Clear lungs. A "small" nodule {left}.',
+          "suggested_review": ["CT follow-up", "Compare priors"]}
+
+class TestExtract(unittest.TestCase):
+    def test_fenced_and_surrounded_by_prose(self):
+        text = f"Here is the report:\n```json\n{json.dumps(REPORT)}\n```\nLet me know!"
+        self.assertEqual(extract(text), REPORT)
+
+    def test_truncated_string_is_closed(self):
+        text = json.dumps(REPORT)[:60]
+        self.assertEqual(extract(text)["image_findings"], json.loads(text + '"}')["image_findings"])
+
+    def test_dangling_key_is_cut_back(self):
+        self.assertEqual(extract('{"confidence": "high", "image_find'), {"confidence": "high"})
+        self.assertEqual(extract('{"confidence": "high", "image_findings":'), {"confidence": "high"})
+        self.assertEqual(extract('{"suggested_review": ["CT", "MR'), {"suggested_review": ["CT", "MR"]})
+
+    def test_truncated_escape_is_trimmed(self):
+        self.assertEqual(extract('{"a": "ok", "b": "line\\'), {"a": "ok", "b": "line"})
+        self.assertEqual(extract('{"a": "ok", "b": "caf\\u00'), {"a": "ok", "b": "caf"})
+        self.assertEqual(extract('{"a": "say \\"hi\\'), {"a": 'say "hi'})
+
+    def test_invalid_object_is_skipped(self):
+        self.assertEqual(extract("{not json} {\"ok\": true}"), {"ok": True})
+        self.assertIsNone(extract("no object here"))
+
+    def test_schema_defaults_and_list_coercion(self):
+        result = extract('{"image_findings": "Clear.", "suggested_review": "Routine", "confidence": null}', ANALYSIS_SCHEMA)
+        self.assertEqual(result["suggested_review"], ["Routine"])
+        self.assertEqual(result["confidence"], ANALYSIS_SCHEMA["confidence"])
+        self.assertEqual(set(ANALYSIS_SCHEMA) - set(result), set())
+
+    def test_incremental_matches_whole_text(self):
+        text = "Sure: " + json.dumps(REPORT) + " trailing {junk"
+        extractor = IncrementalExtractor()
+        closed_at = None
+        for i in range(0, len(text), 3):
+            if extractor.feed(text[i:i + 3]) and closed_at is None:
+                closed_at = i
+        self.assertTrue(extractor.complete)
+        self.assertLess(closed_at, len(text) - 10)
+        self.assertEqual(extractor.result(), REPORT)
+
+if __name__ == "__main__":
+    unittest.main()
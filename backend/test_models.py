@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from backend import migrations, models
+from backend.database import Base
+
+NORMAL = {"image_type": "medical", "confidence": "high", "abnormality_location": "None", "image_findings": "Clear lungs."}
+ABNORMAL = {"image_type": "medical", "confidence": "moderate", "abnormality_location": "Right lower lobe",
+            "image_findings": "Consolidation. " * 40}
+
+# The schema before the numbered migrations, as the original create_all made it
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE, hashed_password VARCHAR, role VARCHAR, is_active BOOLEAN);
+CREATE TABLE cases (id INTEGER PRIMARY KEY, patient_id_hash VARCHAR, image_path VARCHAR, status VARCHAR,
+                    ai_result_json TEXT, created_at DATETIME);
+CREATE TABLE reviews (id INTEGER PRIMARY KEY, case_id INTEGER REFERENCES cases (id), doctor_id INTEGER REFERENCES users (id),
+                      content TEXT, is_approved BOOLEAN, created_at DATETIME);
+CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, case_id INTEGER REFERENCES cases (id), sender_id INTEGER REFERENCES users (id),
+                            message TEXT, timestamp DATETIME);
+"""
+
+class TestPromotedFields(unittest.TestCase):
+    def test_triage_flag(self):
+        self.assertFalse(models.promoted_fields(NORMAL)["is_abnormal"])
+        self.assertTrue(models.promoted_fields(ABNORMAL)["is_abnormal"])
+        self.assertFalse(models.promoted_fields({"abnormality_location": "No focal abnormality"})["is_abnormal"])
+        self.assertIsNone(models.promoted_fields({"abnormality_location": "N/A - non-medical"})["is_abnormal"])
+        self.assertTrue(models.promoted_fields({"abnormalities": ["nodule"]})["is_abnormal"])
+        self.assertFalse(models.promoted_fields({"abnormalities": []})["is_abnormal"])
+        self.assertIsNone(models.promoted_fields({})["is_abnormal"])
+
+class TestAiResultStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}")
+        Base.metadata.create_all(bind=self.engine)
+        self.sessions = sessionmaker(bind=self.engine)
+        self.compress_bytes = models.AI_RESULT_COMPRESS_BYTES
+
+    def tearDown(self):
+        models.AI_RESULT_COMPRESS_BYTES = self.compress_bytes
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def store_and_reload(self, result):
+        with self.sessions() as db:
+            case = models.Case(status="pending_review")
+            case.set_ai_result(result)
+            db.add(case)
+            db.commit()
+            case_id = case.id
+        with self.sessions() as db:
+            return db.get(models.Case, case_id)
+
+    def test_plain_round_trip(self):
+        models.AI_RESULT_COMPRESS_BYTES = 0
+        case = self.store_and_reload(ABNORMAL)
+        self.assertIsNone(case.ai_result_zlib)
+        self.assertEqual(case.ai_result_json, ABNORMAL)
+        self.assertEqual(case.get_ai_result(), ABNORMAL)
+        self.assertEqual((case.confidence, case.is_abnormal), ("moderate", True))
+
+    def test_compressed_round_trip(self):
+        models.AI_RESULT_COMPRESS_BYTES = 200
+        large, small = self.store_and_reload(ABNORMAL), self.store_and_reload(NORMAL)
+        self.assertIsNotNone(large.ai_result_zlib)
+        self.assertNotIn("image_findings", large.ai_result_json)  # only the hot fields stay uncompressed
+        self.assertEqual(large.get_ai_result(), ABNORMAL)
+        self.assertEqual(large.abnormality_location, "Right lower lobe")
+        self.assertIsNone(small.ai_result_zlib)
+        self.assertEqual(small.get_ai_result(), NORMAL)
+
+class TestBaselineUpgrade(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'baseline.db')}")
+        with self.engine.begin() as conn:
+            for statement in BASELINE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(text(statement))
+            for case_id, stored in ((1, json.dumps(NORMAL)), (2, json.dumps(ABNORMAL)), (3, None), (4, "[1, 2]")):
+                conn.execute(text("INSERT INTO cases (id, status, ai_result_json) VALUES (:id, 'pending_review', :stored)"),
+                             {"id": case_id, "stored": stored})
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_upgrade_backfills_promoted_columns(self):
+        self.assertEqual(migrations.upgrade(self.engine), migrations.MIGRATIONS[-1][0])
+        columns = {c["name"] for c in inspect(self.engine).get_columns("cases")}
+        self.assertTrue({"ai_result_zlib", "image_type", "confidence", "abnormality_location", "is_abnormal", "image_sha256"} <= columns)
+        self.assertIn("ix_cases_triage", {i["name"] for i in inspect(self.engine).get_indexes("cases")})
+
+        with sessionmaker(bind=self.engine)() as db:
+            normal, abnormal, empty, odd = (db.get(models.Case, i) for i in (1, 2, 3, 4))
+            self.assertEqual((normal.image_type, normal.confidence, normal.is_abnormal), ("medical", "high", False))
+            self.assertEqual((abnormal.confidence, abnormal.abnormality_location, abnormal.is_abnormal),
+                             ("moderate", "Right lower lobe", True))
+            self.assertEqual(abnormal.get_ai_result(), ABNORMAL)  # legacy text reads back as native JSON
+            self.assertIsNone(empty.image_type)
+            self.assertIsNone(odd.image_type)  # not a report object: left alone
+            triage = db.query(models.Case.id).filter(models.Case.confidence == "moderate", models.Case.is_abnormal.is_(True)).all()
+            self.assertEqual([row.id for row in triage], [2])
+        self.assertEqual(migrations.upgrade(self.engine), migrations.MIGRATIONS[-1][0])  # re-running is a no-op
+
+if __name__ == "__main__":
+    unittest.main()
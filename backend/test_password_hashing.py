@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+
+from backend import auth
+
+class TestHashAdmission(unittest.TestCase):
+    def setUp(self):
+        self.limits = auth.PASSWORD_HASH_MAX_PENDING, auth.PASSWORD_HASH_PER_IP
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        auth.PASSWORD_HASH_MAX_PENDING, auth.PASSWORD_HASH_PER_IP = self.limits
+
+    async def _burst(self, client_ips):
+        """ Starts one blocked hash job per address, then one more from the first address. """
+        jobs = [asyncio.ensure_future(auth._run_hash_job(self.release.wait, 5, client_ip=ip)) for ip in client_ips]
+        await asyncio.sleep(0.05)
+        try:
+            with self.assertRaises(HTTPException) as raised:
+                await auth._run_hash_job(self.release.wait, 5, client_ip=client_ips[0])
+        finally:
+            self.release.set()
+            await asyncio.gather(*jobs)
+        self.assertEqual(auth._pending_hashes, 0)
+        self.assertFalse(auth._pending_by_ip)
+        return raised.exception
+
+    def test_queue_full_sheds_with_503(self):
+        auth.PASSWORD_HASH_MAX_PENDING, auth.PASSWORD_HASH_PER_IP = 2, 10
+        error = asyncio.run(self._burst(["10.0.0.1", "10.0.0.2"]))
+        self.assertEqual(error.status_code, 503)
+        self.assertEqual(error.headers["Retry-After"], "1")
+
+    def test_one_client_is_capped_with_429(self):
+        auth.PASSWORD_HASH_MAX_PENDING, auth.PASSWORD_HASH_PER_IP = 10, 1
+        error = asyncio.run(self._burst(["10.0.0.1"]))
+        self.assertEqual(error.status_code, 429)
+
+    def test_outdated_cost_is_rehashed(self):
+        old = auth.CryptContext(schemes=["bcrypt"], bcrypt__rounds=auth.BCRYPT_ROUNDS - 1).hash("pw")
+        is_valid, new_hash = asyncio.run(auth.verify_password_async("pw", old))
+        self.assertTrue(is_valid)
+        self.assertIsNotNone(new_hash)
+        self.assertEqual(asyncio.run(auth.verify_password_async("pw", new_hash)), (True, None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from backend import blob_store, database, models, previews
+from backend.blob_store import LocalBlobStore
+
+def png_bytes(size=(1000, 600)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (120, 30, 200)).save(buf, format="PNG")
+    return buf.getvalue()
+
+class RecordingStore(LocalBlobStore):
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.written = []
+
+    def put_derivative(self, digest: str, name: str, data: bytes):
+        self.written.append(name)
+        super().put_derivative(digest, name, data)
+
+class TestPreviewPyramid(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = RecordingStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_levels_bound_the_longest_edge(self):
+        pyramid = previews.build_pyramid(Image.open(io.BytesIO(png_bytes())))
+        self.assertEqual(set(pyramid), set(previews.PREVIEW_LEVELS))
+        for level, edge in previews.PREVIEW_LEVELS.items():
+            self.assertEqual(max(Image.open(io.BytesIO(pyramid[level])).size), edge or 1000, level)
+
+    def test_smallest_level_is_written_last(self):
+        data = png_bytes()
+        digest = self.store.put(data)
+        previews.generate(self.store, digest, data, "study.png")
+        self.assertEqual(self.store.written[-1], previews.derivative_name("64"))
+        self.assertEqual(len(self.store.written), len(previews.PREVIEW_LEVELS))
+        previews.generate(self.store, digest)  # already complete: nothing is decoded or written again
+        self.assertEqual(len(self.store.written), len(previews.PREVIEW_LEVELS))
+
+    def test_undecodable_upload_is_recorded_once(self):
+        digest = self.store.put(b"not an image")
+        with mock.patch.object(previews.ai_service, "decode_medical_image", wraps=previews.ai_service.decode_medical_image) as decode:
+            previews.generate(self.store, digest, filename="broken.png")
+            previews.generate(self.store, digest, filename="broken.png")
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(self.store.written, [previews.FAILED_MARKER])
+        self.assertIsNotNone(previews.failure(self.store, digest))
+
+class TestPreviewEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        from backend import auth, main
+
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        engine = database.make_engine(url)
+        database.Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        self.async_engine = database.make_async_engine(url)
+        sessions = async_sessionmaker(self.async_engine, expire_on_commit=False)
+
+        async def get_async_db():
+            async with sessions() as db:
+                yield db
+
+        self.store = LocalBlobStore(os.path.join(self.tmp.name, "blobs"))
+        self.previous_store, blob_store._store = blob_store._store, self.store
+        self.good = self.store.put(png_bytes())
+        previews.generate(self.store, self.good, filename="study.png")
+        self.broken = self.store.put(b"not an image")
+        previews.generate(self.store, self.broken, filename="broken.png")
+
+        async def add_cases():
+            async with sessions() as db:
+                db.add_all([models.Case(id=1, image_sha256=self.good), models.Case(id=2, image_sha256=self.broken)])
+                await db.commit()
+        asyncio.run(add_cases())
+
+        self.app = main.app
+        self.app.dependency_overrides[database.get_async_db] = get_async_db
+        self.app.dependency_overrides[auth.get_current_user] = lambda: models.User(username="reviewer", role="reviewer")
+        self.client = TestClient(self.app)
+
+    def tearDown(self):
+        self.app.dependency_overrides.clear()
+        blob_store._store = self.previous_store
+        asyncio.run(self.async_engine.dispose())
+        self.tmp.cleanup()
+
+    def test_strong_etag_and_304(self):
+        response = self.client.get("/cases/1/preview/64")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], f'"{self.good}-{previews.derivative_name("64")}"')
+        self.assertEqual(response.content, self.store.read_derivative(self.good, previews.derivative_name("64")))
+        cached = self.client.get("/cases/1/preview/64", headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(self.client.get("/cases/1/preview/256", headers={"If-None-Match": response.headers["etag"]}).status_code, 200)
+
+    def test_failed_preview_is_415_and_not_requeued(self):
+        with mock.patch.object(previews, "schedule") as schedule:
+            for _ in range(3):
+                self.assertEqual(self.client.get("/cases/2/preview/256").status_code, 415)
+        schedule.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
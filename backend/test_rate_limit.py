@@ -0,0 +1,100 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import llm, rate_limit
+from backend.rate_limit import ModelLimiter, RateLimited, estimate_tokens
+
+class TestModelLimiter(unittest.TestCase):
+    def test_burst_then_reject_past_deadline(self):
+        limiter = ModelLimiter("test", rpm=4, tpm=100000)
+        for _ in range(4):
+            limiter.acquire(10, "analysis", deadline_s=0)
+        with self.assertRaises(RateLimited):
+            limiter.acquire(10, "analysis", deadline_s=1)  # next request slot is 15s away
+
+    def test_queued_call_waits_for_refill(self):
+        limiter = ModelLimiter("test", rpm=600, tpm=100000)  # one request per 0.1s
+        limiter.requests.tokens = 0
+        started = time.monotonic()
+        limiter.acquire(10, "analysis", deadline_s=2)
+        self.assertGreater(time.monotonic() - started, 0.05)
+
+    def test_chat_cannot_use_the_reserve(self):
+        limiter = ModelLimiter("test", rpm=4, tpm=100000)
+        limiter.requests.tokens = 1  # below chat's 25% reserve, enough for analysis
+        with self.assertRaises(RateLimited):
+            limiter.acquire(10, "chat", deadline_s=0.5)
+        limiter.acquire(10, "analysis", deadline_s=0)
+
+    def test_higher_priority_is_served_first(self):
+        limiter = ModelLimiter("test", rpm=600, tpm=100000)
+        limiter.requests.tokens = 60  # exactly symptom's 10% reserve: it queues, analysis doesn't
+        order = []
+
+        def call(priority):
+            limiter.acquire(10, priority, deadline_s=5)
+            order.append(priority)
+
+        symptom = threading.Thread(target=call, args=("symptom",))
+        symptom.start()
+        time.sleep(0.02)
+        analysis = threading.Thread(target=call, args=("analysis",))
+        analysis.start()
+        symptom.join()
+        analysis.join()
+        self.assertEqual(order, ["analysis", "symptom"])
+
+    def test_tokens_are_settled_and_estimated(self):
+        limiter = ModelLimiter("test", rpm=60, tpm=1000)
+        limiter.acquire(600, "analysis", deadline_s=0)
+        limiter.settle(charged=600, used=100)
+        self.assertAlmostEqual(limiter.tokens.tokens, 900, delta=1)
+        self.assertEqual(estimate_tokens(["x" * 400, object()]), 101 + 258)
+
+class _Provider(llm.LLMProvider):
+    name = "gemini"
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def generate(self, model, contents):
+        if self.error:
+            raise self.error
+        return "x" * 400
+
+class TestLimitedCalls(unittest.TestCase):
+    def setUp(self):
+        self.enabled = rate_limit.RATE_LIMIT_ENABLED
+        rate_limit.RATE_LIMIT_ENABLED = "true"
+        self.limiter = rate_limit._limiters["test-model"] = ModelLimiter("test-model", rpm=60, tpm=6000)  # 100 tokens/s refill
+
+    def tearDown(self):
+        rate_limit.RATE_LIMIT_ENABLED = self.enabled
+        rate_limit._limiters.pop("test-model", None)
+        llm.set_provider(None)
+
+    def test_failed_call_refunds_the_output_estimate(self):
+        llm.set_provider(_Provider(llm.LLMError("boom", 500)))
+        with self.assertRaises(llm.LLMError):
+            llm.generate("test-model", "hi")
+        self.assertAlmostEqual(self.limiter.tokens.tokens, 6000 - estimate_tokens("hi"), delta=5)
+
+    def test_upstream_429_still_penalizes(self):
+        llm.set_provider(_Provider(llm.LLMError("quota", 429)))
+        with self.assertRaises(llm.LLMError):
+            llm.generate("test-model", "hi")
+        self.assertLessEqual(self.limiter.tokens.tokens, 1)
+
+    def test_stream_is_charged_for_what_it_yields(self):
+        llm.set_provider(_Provider())
+        self.assertEqual("".join(llm.stream("test-model", "hi")), "x" * 400)
+        self.assertAlmostEqual(self.limiter.tokens.tokens, 6000 - estimate_tokens("hi") - 100, delta=5)
+        self.assertLess(self.limiter.requests.tokens, 60)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.semantic_cache import SemanticCache
+
+class TestSemanticCache(unittest.TestCase):
+    def make_cache(self, **options):
+        options.setdefault("directory", "")
+        return SemanticCache("test", max_entries=options.pop("max_entries", 8), threshold=0.9, dim=256, **options)
+
+    def test_exact_hit_ignores_case_and_punctuation(self):
+        cache = self.make_cache()
+        cache.put("Why do I get headaches?", {"why": "tension"})
+        self.assertEqual(cache.get("why do i get   headaches"), {"why": "tension"})
+        self.assertEqual(cache.stats()["exact_hits"], 1)
+
+    def test_paraphrase_is_a_semantic_hit(self):
+        cache = self.make_cache()
+        cache.put("why do I get headaches", {"why": "tension"})
+        self.assertEqual(cache.get("headache causes"), {"why": "tension"})
+        self.assertEqual(cache.stats()["semantic_hits"], 1)
+
+    def test_different_question_misses(self):
+        cache = self.make_cache()
+        cache.put("chest pain", {"why": "cardiac"})
+        self.assertIsNone(cache.get("back pain"))
+        self.assertIsNone(cache.get("chest pain in children"))
+
+    def test_different_intent_or_direction_misses(self):
+        pairs = [("what causes high blood pressure", "what does high blood pressure cause"),
+                 ("what can diabetes cause", "why do I have diabetes"),
+                 ("when should I take ibuprofen", "how often can I take ibuprofen"),
+                 ("can stress cause headaches", "can headaches cause stress"),
+                 ("can I take ibuprofen with food", "should I take ibuprofen with food")]
+        for cached, asked in pairs:
+            for first, second in ((cached, asked), (asked, cached)):
+                cache = self.make_cache()
+                cache.put(first, {"answer": first})
+                self.assertIsNone(cache.get(second), (first, second))
+
+    def test_same_intent_paraphrases_hit(self):
+        cache = self.make_cache()
+        cache.put("what causes high blood pressure", {"why": "salt"})
+        self.assertEqual(cache.get("high blood pressure causes"), {"why": "salt"})
+        self.assertEqual(cache.get("why do I have high blood pressure"), {"why": "salt"})
+
+    def test_hits_are_copies(self):
+        cache = self.make_cache()
+        cache.put("fever", {"what_to_do": ["Rest"]})
+        cache.get("fever")["what_to_do"].append("mutated")
+        self.assertEqual(cache.get("fever"), {"what_to_do": ["Rest"]})
+
+    def test_ttl_and_lru_eviction(self):
+        cache = self.make_cache(ttl=-1)
+        cache.put("fever", "old")
+        self.assertIsNone(cache.get("fever"))
+
+        cache = self.make_cache(max_entries=2)
+        cache.put("fever", 1)
+        cache.put("nausea", 2)
+        cache.get("fever")
+        cache.put("dizziness", 3)  # evicts nausea, the least recently used
+        self.assertEqual(cache.get("fever"), 1)
+        self.assertIsNone(cache.get("nausea"))
+        self.assertEqual(cache.get("dizziness"), 3)
+
+    def test_persists_across_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = self.make_cache(directory=directory)
+            cache.put("why do I get headaches", {"why": "tension"})
+            cache.put("stale", "gone", expires_at=time.time() - 1)
+            cache.save()
+            reloaded = self.make_cache(directory=directory)
+            self.assertEqual(reloaded.get("headache causes"), {"why": "tension"})
+            self.assertEqual(len(reloaded.entries), 1)
+
+if __name__ == "__main__":
+    unittest.main()
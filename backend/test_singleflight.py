@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from backend import singleflight
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_duplicates_share_one_call(self):
+        calls, release = [], threading.Event()
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return {"findings": ["clear"]}
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(singleflight.do, "test", "same", work) for _ in range(4)]
+            while singleflight.stats()["test"]["followers"] < 3:
+                threading.Event().wait(0.01)
+            release.set()
+            results = [f.result() for f in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r == {"findings": ["clear"]} for r in results))
+        results[0]["findings"].append("mutated")
+        self.assertEqual(results[1], {"findings": ["clear"]})
+        self.assertEqual(singleflight.stats()["test"]["in_flight"], 0)
+
+    def test_errors_reach_every_caller_and_are_not_remembered(self):
+        def fail():
+            raise RuntimeError("engine down")
+        with self.assertRaises(RuntimeError):
+            singleflight.do("test-errors", "key", fail)
+        self.assertEqual(singleflight.do("test-errors", "key", lambda: "ok"), "ok")
+
+    def test_image_key_covers_pixels_and_prompt(self):
+        black, white = Image.new("L", (8, 8), 0), Image.new("L", (8, 8), 255)
+        self.assertEqual(singleflight.image_key(black, "chest"), singleflight.image_key(black.copy(), "chest"))
+        self.assertNotEqual(singleflight.image_key(black, "chest"), singleflight.image_key(white, "chest"))
+        self.assertNotEqual(singleflight.image_key(black, "chest"), singleflight.image_key(black, "knee"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+"""
+Lightweight distributed tracing (W3C trace context, OpenTelemetry-shaped spans).
+
+The backend starts a trace per HTTP request (or continues one from an incoming `traceparent`
+header), `_call_remote_engine` forwards it to the Kaggle engine, and the engine continues it
+in its own middleware, so one /analyze shows up as a single trace across both services.
+The same file is shipped with the Kaggle engine.
+
+Exporters (TRACE_EXPORTER):
+  none (default) - tracing is off; span() is a no-op
+  file           - one JSON span per line appended to TRACE_FILE
+  otlp           - batches POSTed as OTLP/JSON to TRACE_COLLECTOR_URL (e.g. an OpenTelemetry Collector)
+Spans are queued and written by a background thread, so exporting never blocks a request.
+
+Offline attribution across services:
+    python -m backend.tracing backend-traces.jsonl engine-traces.jsonl
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger("MedGemma-Tracing")
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "medgemma-backend")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "service": TRACE_SERVICE_NAME, "name": self.name, "trace_id": self.trace_id,
+            "span_id": self.span_id, "parent_id": self.parent_id,
+            "start_ns": self.start_ns, "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status, "attributes": self.attributes,
+        }
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("medgemma_span", default=None)
+
+def enabled() -> bool:
+    return TRACE_EXPORTER != "none"
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+def parse_traceparent(header: Optional[str]):
+    """ Returns (trace_id, parent span_id), or (None, None) for a missing/invalid header. """
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None, None
+    return match.group(1), match.group(2)
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """ Adds the current span's `traceparent` to outgoing request headers. """
+    span = _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+@contextmanager
+def _activate(span: Span) -> Iterator[Span]:
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.attributes.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current.reset(token)
+        _export(span)
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    """ Root span for an incoming request; continues the caller's trace when `traceparent` is valid. """
+    if not enabled():
+        yield None
+        return
+    trace_id, parent_id = parse_traceparent(traceparent)
+    with _activate(Span(name, trace_id or secrets.token_hex(16), parent_id, attributes)) as span:
+        yield span
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """ Child of the current span. Outside an active trace (e.g. batch worker processes) nothing is recorded. """
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(name, parent.trace_id, parent.span_id, attributes)) as child:
+        yield child
+
+def traced(name: str):
+    """ Decorator form of span(). """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- EXPORT ---
+
+_queue: "queue.Queue[Span]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+dropped = 0
+
+def _export(span: Span):
+    global _worker, dropped
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+                _worker.start()
+    try:
+        _queue.put_nowait(span)
+    except queue.Full:
+        dropped += 1
+
+def _drain(first: Span, max_batch: int = 512):
+    batch = [first]
+    while len(batch) < max_batch:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _export_loop():
+    while True:
+        batch = _drain(_queue.get())
+        try:
+            if TRACE_EXPORTER == "otlp":
+                _post_otlp(batch)
+            else:
+                with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(s.to_dict()) + "\n" for s in batch))
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+def flush(timeout: float = 5.0):
+    """ Waits (up to `timeout`) for queued spans to be written; used at shutdown and in tests. """
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool): return {"boolValue": value}
+    if isinstance(value, int): return {"intValue": str(value)}
+    if isinstance(value, float): return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _post_otlp(batch):
+    import requests
+    spans = [{
+        "traceId": s.trace_id, "spanId": s.span_id, "parentSpanId": s.parent_id or "",
+        "name": s.name, "kind": 1, "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+        "status": {"code": 2 if s.status == "error" else 1},
+    } for s in batch]
+    payload = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "medgemma.tracing"}, "spans": spans}],
+    }]}
+    requests.post(TRACE_COLLECTOR_URL, json=payload, timeout=5).raise_for_status()
+
+# --- OFFLINE ATTRIBUTION ---
+
+def summarize(paths) -> dict:
+    """
+    Merges span files from several services and attributes time per (service, span name):
+    `self_ms` excludes time spent in child spans, so a slow hop is visible even when nested.
+    """
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    child_ms = defaultdict(float)
+    for s in spans:
+        if s["parent_id"]:
+            child_ms[s["parent_id"]] += s["duration_ms"]
+    stats = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "self_ms": 0.0, "errors": 0})
+    for s in spans:
+        entry = stats[f"{s['service']}:{s['name']}"]
+        entry["count"] += 1
+        entry["total_ms"] += s["duration_ms"]
+        entry["self_ms"] += max(s["duration_ms"] - child_ms.get(s["span_id"], 0.0), 0.0)
+        entry["errors"] += s["status"] == "error"
+    traces = len({s["trace_id"] for s in spans})
+    return {"traces": traces, "spans": {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()}
+                                        for name, entry in sorted(stats.items(), key=lambda item: -item[1]["self_ms"])}}
+
+if __name__ == "__main__":
+    print(json.dumps(summarize(sys.argv[1:]), indent=2))
@@ -0,0 +1,115 @@
+"""
+How the preprocessed 448x448 study travels to the analysis backends.
+
+WIRE_ENCODING picks the format of the /analyze upload to the Kaggle engine:
+  png   lossless, zlib level WIRE_PNG_LEVEL (1 is several times faster than PIL's default 6
+        for a few percent more bytes)
+  webp  lossless WebP (smallest lossless payload, slowest to encode)
+  jpeg  quality WIRE_JPEG_QUALITY, 4:4:4 (lossy; smallest and fast)
+  raw   uncompressed uint8 pixels behind a 10-byte header; grayscale studies (R == G == B,
+        which is every DICOM) go as one channel. No encode cost at all - best on a fast link.
+
+The encoding is cached per image (keyed by a digest of the pixels), so the Gemini fallback and
+retries reuse the bytes the engine upload produced instead of encoding again. `decode()` is
+what the engine uses to read any of them back. The same file is shipped with the Kaggle engine.
+"""
+import hashlib
+import io
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+WIRE_ENCODING = os.getenv("WIRE_ENCODING", "png").lower()
+WIRE_PNG_LEVEL = int(os.getenv("WIRE_PNG_LEVEL", "1"))
+WIRE_JPEG_QUALITY = int(os.getenv("WIRE_JPEG_QUALITY", "95"))
+WIRE_CACHE_ENTRIES = int(os.getenv("WIRE_CACHE_ENTRIES", "64"))
+
+FORMATS = ("png", "webp", "jpeg", "raw")
+
+# magic, version, mode (1 = L, 3 = RGB), width, height
+RAW_MAGIC = b"MGRW"
+_RAW_HEADER = struct.Struct(">4sBBHH")
+RAW_MEDIA_TYPE = "application/x-medgemma-raw"
+
+class Encoded(NamedTuple):
+    data: bytes
+    filename: str
+    media_type: str
+
+    @property
+    def is_image(self) -> bool:
+        """ Whether Gemini accepts the bytes as an inline image part. """
+        return self.media_type.startswith("image/")
+
+    def as_part(self) -> dict:
+        return {"mime_type": self.media_type, "data": self.data}
+
+def _is_grayscale(image: Image.Image) -> bool:
+    if image.mode == "L":
+        return True
+    if image.mode != "RGB":
+        return False
+    pixels = np.asarray(image)
+    return bool((pixels[..., 0] == pixels[..., 1]).all() and (pixels[..., 1] == pixels[..., 2]).all())
+
+def encode(image: Image.Image, fmt: str = None) -> Encoded:
+    """ Encodes `image` in `fmt` (default WIRE_ENCODING), uncached. """
+    fmt = (fmt or WIRE_ENCODING).lower()
+    if fmt == "raw":
+        gray = _is_grayscale(image)
+        pixels = image.convert("L" if gray else "RGB")
+        header = _RAW_HEADER.pack(RAW_MAGIC, 1, 1 if gray else 3, *pixels.size)
+        return Encoded(header + pixels.tobytes(), "image.raw", RAW_MEDIA_TYPE)
+    buf = io.BytesIO()
+    if fmt == "webp":
+        image.save(buf, format="WEBP", lossless=True, quality=50, method=2)
+    elif fmt == "jpeg":
+        image.convert("RGB").save(buf, format="JPEG", quality=WIRE_JPEG_QUALITY, subsampling=0)
+    elif fmt == "png":
+        image.save(buf, format="PNG", compress_level=WIRE_PNG_LEVEL)
+    else:
+        raise ValueError(f"Unknown wire encoding {fmt!r} (expected one of {', '.join(FORMATS)})")
+    return Encoded(buf.getvalue(), f"image.{fmt}", f"image/{fmt}")
+
+def decode(data: bytes) -> Image.Image:
+    """ Reads any of the wire formats back (sniffed, so plain uploads work too). """
+    if data[:4] == RAW_MAGIC:
+        _, version, channels, width, height = _RAW_HEADER.unpack_from(data)
+        mode = "L" if channels == 1 else "RGB"
+        return Image.frombytes(mode, (width, height), data[_RAW_HEADER.size:])
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+_cache: "OrderedDict[tuple, Encoded]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _digest(image: Image.Image) -> str:
+    return hashlib.sha256(image.tobytes()).hexdigest() + f"{image.mode}{image.size}"
+
+def cached_encode(image: Image.Image, fmt: str = None) -> Encoded:
+    """ encode() memoized per (pixels, format) in a small LRU. """
+    key = (_digest(image), (fmt or WIRE_ENCODING).lower())
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    encoded = encode(image, fmt)
+    with _cache_lock:
+        _cache[key] = encoded
+        while len(_cache) > WIRE_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return encoded
+
+def gemini_part(image: Image.Image):
+    """
+    What to hand Gemini for `image`: the cached wire bytes when they are an image format
+    Gemini takes, else the PIL image (the SDK then encodes it itself).
+    """
+    encoded = cached_encode(image)
+    return encoded.as_part() if encoded.is_image else image
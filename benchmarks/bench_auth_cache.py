@@ -0,0 +1,62 @@
+"""
+Measures the per-request cost of authenticated GET /cases with and without the
+token / user cache in backend.auth.
+
+Usage:
+    python -m benchmarks.bench_auth_cache --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="medgemma-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import httpx
+
+from backend import auth, main
+
+async def _measure(client, headers, requests: int) -> dict:
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        resp = await client.get("/cases", headers=headers, params={"status": "none"})
+        latencies.append(time.perf_counter() - started)
+        assert resp.status_code == 200, resp.text
+    latencies.sort()
+    return {
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    }
+
+async def run(requests: int) -> dict:
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/register", data={"username": "bench", "password": "pw", "role": "reviewer"})
+            token = (await client.post("/token", data={"username": "bench", "password": "pw"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            ttl = auth.AUTH_CACHE_TTL
+            auth.AUTH_CACHE_TTL = 0
+            uncached = await _measure(client, headers, requests)
+            auth.AUTH_CACHE_TTL = ttl or 30
+            cached = await _measure(client, headers, requests)
+
+    saved = uncached["mean_ms"] - cached["mean_ms"]
+    return {"requests": requests, "uncached": uncached, "cached": cached,
+            "saved_ms_per_request": round(saved, 3), "saved_pct": round(100 * saved / uncached["mean_ms"], 1)}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests))))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,135 @@
+"""
+Query-plan and timing benchmark for the case / review / chat / triage indexes.
+
+Seeds a throwaway SQLite database, runs the reviewer queries without the indexes,
+applies the migrations and runs them again.
+
+Usage:
+    python -m benchmarks.bench_case_queries --cases 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from backend import database, migrations, models
+
+STATUSES = ["pending_ai", "pending_review", "completed"]
+CONFIDENCES = ["high", "moderate", "low"]
+
+QUERIES = {
+    "review_queue": (
+        "SELECT id, created_at FROM cases WHERE status = 'pending_review' "
+        "ORDER BY created_at DESC LIMIT 50", None),
+    "todays_feed": (
+        "SELECT id, status FROM cases WHERE created_at >= :since ORDER BY created_at DESC LIMIT 100", "since"),
+    "case_reviews": (
+        "SELECT id, is_approved FROM reviews WHERE case_id = :case_id ORDER BY created_at", "case_id"),
+    "doctor_reviews": (
+        "SELECT id, case_id FROM reviews WHERE doctor_id = :doctor_id ORDER BY created_at DESC LIMIT 50", "doctor_id"),
+    "case_chat": (
+        "SELECT id, message FROM chat_messages WHERE case_id = :case_id ORDER BY timestamp", "case_id"),
+    "triage": (
+        "SELECT id FROM cases WHERE confidence = 'moderate' AND is_abnormal = 1 AND created_at >= :since "
+        "ORDER BY created_at DESC", "since"),
+}
+
+def seed(engine, cases: int, doctors: int = 50, batch: int = 50_000):
+    """ Bulk-loads synthetic rows through the raw DB-API connection (ORM inserts are far too slow for 1M rows). """
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=365)
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.executemany("INSERT INTO users (id, username, hashed_password, role, is_active) VALUES (?, ?, '', 'reviewer', 1)",
+                        [(i, f"doctor{i}") for i in range(1, doctors + 1)])
+        for offset in range(0, cases, batch):
+            rows, reviews, chats = [], [], []
+            for case_id in range(offset + 1, min(offset + batch, cases) + 1):
+                created = start + timedelta(seconds=case_id * 365 * 86400 / cases)
+                abnormal = rng.random() < 0.3
+                confidence = rng.choice(CONFIDENCES)
+                location = "Right Upper Lobe" if abnormal else "none"
+                report = json.dumps({"image_type": "medical", "confidence": confidence, "abnormality_location": location})
+                rows.append((case_id, "bench", "bench.png", rng.choice(STATUSES), report, created,
+                             "medical", confidence, location, abnormal))
+                if rng.random() < 0.5:
+                    reviews.append((case_id, rng.randint(1, doctors), "ok", 1, created + timedelta(hours=1)))
+                if rng.random() < 0.3:
+                    chats.append((case_id, rng.randint(1, doctors), "hello", created + timedelta(minutes=5)))
+            cur.executemany("INSERT INTO cases (id, patient_id_hash, image_path, status, ai_result_json, created_at, "
+                            "image_type, confidence, abnormality_location, is_abnormal) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            cur.executemany("INSERT INTO reviews (case_id, doctor_id, content, is_approved, created_at) VALUES (?, ?, ?, ?, ?)", reviews)
+            cur.executemany("INSERT INTO chat_messages (case_id, sender_id, message, timestamp) VALUES (?, ?, ?, ?)", chats)
+            raw.commit()
+        cur.execute("ANALYZE")
+        raw.commit()
+    finally:
+        raw.close()
+
+def run_queries(engine, cases: int, repeat: int) -> dict:
+    params = {
+        "since": {"since": datetime.utcnow() - timedelta(days=1)},
+        "case_id": {"case_id": cases // 2},
+        "doctor_id": {"doctor_id": 7},
+    }
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, param_key) in QUERIES.items():
+            bind = params.get(param_key, {}) if param_key else {}
+            plan = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), bind)]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(text(sql), bind).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {"plan": plan, "median_ms": round(sorted(timings)[len(timings) // 2], 3)}
+    return results
+
+def drop_migrated_indexes(engine):
+    """ Drops the composite indexes added by migrations, leaving the original column-level ones. """
+    with engine.begin() as conn:
+        for model in (models.Case, models.Review, models.ChatMessage):
+            for index in model.__table__.indexes:
+                columns = list(index.columns)
+                if not (len(columns) == 1 and columns[0].index):
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = database.make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        drop_migrated_indexes(engine)
+
+        started = time.perf_counter()
+        seed(engine, args.cases)
+        print(f"Seeded {args.cases} cases in {time.perf_counter() - started:.1f}s")
+
+        before = run_queries(engine, args.cases, args.repeat)
+        started = time.perf_counter()
+        migrations.upgrade(engine)
+        migrate_s = time.perf_counter() - started
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after = run_queries(engine, args.cases, args.repeat)
+        engine.dispose()
+
+    print(f"Migration applied in {migrate_s:.1f}s\n")
+    for name in QUERIES:
+        print(f"== {name}")
+        print(f"   before: {before[name]['median_ms']:>10.3f} ms  {' | '.join(before[name]['plan'])}")
+        print(f"   after:  {after[name]['median_ms']:>10.3f} ms  {' | '.join(after[name]['plan'])}")
+    print(json.dumps({"cases": args.cases, "before": before, "after": after}))
+
+if __name__ == "__main__":
+    main()
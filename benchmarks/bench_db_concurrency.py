@@ -0,0 +1,89 @@
+"""
+Concurrent case-insert benchmark for the database profiles in backend/database.py.
+
+Usage:
+    python -m benchmarks.bench_db_concurrency --threads 16 --inserts 200
+    python -m benchmarks.bench_db_concurrency --postgres-url postgresql://user:pw@localhost/medgemma_bench
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import database, models
+
+RESULT = {"image_type": "medical", "image_findings": "Benchmark finding.", "confidence": "high", "abnormality_location": "none"}
+
+def _insert_worker(Session, inserts: int, latencies: list, errors: list):
+    for _ in range(inserts):
+        started = time.perf_counter()
+        db = Session()
+        try:
+            case = models.Case(patient_id_hash="bench", image_path="bench.png", status="pending_review")
+            case.set_ai_result(RESULT)
+            db.add(case)
+            db.commit()
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            db.rollback()
+            errors.append(str(e))
+        finally:
+            db.close()
+
+def run_profile(name: str, engine, threads: int, inserts: int) -> dict:
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    latencies, errors = [], []
+    workers = [threading.Thread(target=_insert_worker, args=(Session, inserts, latencies, errors))
+               for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers: w.start()
+    for w in workers: w.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 2) if latencies else None
+    engine.dispose()
+    return {
+        "profile": name,
+        "threads": threads,
+        "committed": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "inserts_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--inserts", type=int, default=200, help="Inserts per thread")
+    parser.add_argument("--postgres-url", default=os.getenv("BENCH_POSTGRES_URL"))
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Baseline: what database.py used to build (rollback journal, FULL sync, no pragmas).
+        baseline_url = f"sqlite:///{os.path.join(tmp, 'baseline.db')}"
+        baseline = create_engine(baseline_url, connect_args={"check_same_thread": False})
+        results.append(run_profile("sqlite-default", baseline, args.threads, args.inserts))
+
+        tuned_url = f"sqlite:///{os.path.join(tmp, 'tuned.db')}"
+        results.append(run_profile("sqlite-wal", database.make_engine(tuned_url), args.threads, args.inserts))
+
+    if args.postgres_url:
+        results.append(run_profile("postgresql", database.make_engine(args.postgres_url), args.threads, args.inserts))
+
+    for r in results:
+        print(json.dumps(r))
+
+if __name__ == "__main__":
+    main()
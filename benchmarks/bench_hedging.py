@@ -0,0 +1,90 @@
+"""
+Tail latency and extra cost of hedged requests (backend.hedging), fully offline: a heavy-tailed
+FakeEngine as the primary and FakeLLMProvider as the Gemini secondary, with hedging off vs on.
+
+extra_cost is Gemini calls per request beyond what the unhedged run needed (fallbacks happen
+either way); the budget keeps it near HEDGE_BUDGET.
+
+Usage:
+    python -m benchmarks.bench_hedging --calls 300 --concurrency 8 --sigma 1.0
+"""
+import argparse
+import json
+import os
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")  # both runs ask the same questions
+
+from PIL import Image
+
+from backend import ai_service, hedging, llm
+
+from .bench_llm_fallback import _measure
+from .standins import FakeEngine
+
+EVENTS = ("calls", "fallbacks", "hedges", "primary_wins", "secondary_wins", "wasted")
+
+def _events(endpoint: str) -> dict:
+    # The counters are process-wide, so each run reports its own delta
+    return {event: int(hedging.HEDGE_CALLS.value(endpoint, event)) for event in EVENTS}
+
+def _run_endpoint(endpoint: str, fn, engine_provider: llm.FakeLLMProvider, gemini_median_ms: float, calls: int,
+                  concurrency: int, enabled: bool) -> dict:
+    hedging.HEDGE_ENABLED = enabled
+    hedging._endpoints.clear()
+    gemini = llm.FakeLLMProvider(median_ms=gemini_median_ms, sigma=0.3, seed=2)
+    previous = llm.set_provider(gemini)
+    before = _events(endpoint)
+    try:
+        with FakeEngine(provider=engine_provider) as engine:
+            os.environ["AI_SERVICE_URL"] = engine.url
+            try:
+                stats, _ = _measure(fn, calls, concurrency)
+            finally:
+                os.environ.pop("AI_SERVICE_URL")
+    finally:
+        llm.set_provider(previous)
+    after = _events(endpoint)
+    gemini_calls = sum(gemini.calls.values())
+    return {**stats, "gemini_calls_per_request": round(gemini_calls / calls, 3),
+            "events": {event: after[event] - before[event] for event in EVENTS}}
+
+def run(calls: int = 300, concurrency: int = 8, engine_median_ms: float = 150, sigma: float = 1.0,
+        gemini_median_ms: float = 400) -> dict:
+    image = Image.effect_noise((256, 256), 30).convert("RGB")
+    endpoints = {
+        "symptom_analysis": lambda i: ai_service.medical_knowledge_lookup(f"symptom {i}"),
+        "analyze": lambda i: ai_service.analyze_with_gemini(image, f"Benchmark study {i}"),
+    }
+    enabled_before = hedging.HEDGE_ENABLED
+    results = {}
+    try:
+        for name, fn in endpoints.items():
+            runs = {}
+            for label, enabled in (("unhedged", False), ("hedged", True)):
+                # Same seed for both runs, so the engine draws the same latency sequence
+                engine = llm.FakeLLMProvider(median_ms=engine_median_ms, sigma=sigma, rate_429=0.02, seed=1)
+                runs[label] = _run_endpoint(name, fn, engine, gemini_median_ms, calls, concurrency, enabled)
+            runs["extra_cost"] = round(runs["hedged"]["gemini_calls_per_request"]
+                                       - runs["unhedged"]["gemini_calls_per_request"], 3)
+            results[name] = runs
+    finally:
+        hedging.HEDGE_ENABLED = enabled_before
+    results["config"] = {"calls": calls, "concurrency": concurrency, "engine_median_ms": engine_median_ms,
+                         "sigma": sigma, "gemini_median_ms": gemini_median_ms, "budget": hedging.HEDGE_BUDGET,
+                         "percentile": hedging.HEDGE_PERCENTILE}
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--engine-median-ms", type=float, default=150)
+    parser.add_argument("--sigma", type=float, default=1.0, help="Lognormal spread of the engine latency")
+    parser.add_argument("--gemini-median-ms", type=float, default=400)
+    args = parser.parse_args()
+    print(json.dumps(run(args.calls, args.concurrency, args.engine_median_ms, args.sigma, args.gemini_median_ms),
+                     indent=2))
+
+if __name__ == "__main__":
+    main_cli()
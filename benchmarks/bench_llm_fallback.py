@@ -0,0 +1,85 @@
+"""
+Fallback cost and tail latency of the ai_service LLM paths, fully offline (FakeLLMProvider +
+FakeEngine): how much a 429'd / 404'd model, a flaky Kaggle engine or truncated JSON adds.
+
+Usage:
+    python -m benchmarks.bench_llm_fallback --calls 100 --concurrency 8
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from PIL import Image
+
+from backend import ai_service, llm
+
+from .harness import summarize
+from .standins import FakeEngine
+
+def _measure(fn, calls: int, concurrency: int) -> dict:
+    latencies = []
+
+    def one(i):
+        started = time.perf_counter()
+        result = fn(i)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(calls)))
+    return {**summarize(latencies), "calls_per_s": round(calls / (time.perf_counter() - started), 2)}, results
+
+def _with_provider(provider: llm.FakeLLMProvider, fn, calls: int, concurrency: int) -> dict:
+    previous = llm.set_provider(provider)
+    try:
+        stats, results = _measure(fn, calls, concurrency)
+    finally:
+        llm.set_provider(previous)
+    return stats, results, provider.stats()
+
+def run(calls: int = 100, concurrency: int = 8, median_ms: float = 200) -> dict:
+    image = Image.effect_noise((448, 448), 30).convert("RGB")
+    results = {}
+    os.environ.pop("AI_SERVICE_URL", None)
+
+    # Chat walks its model list; the first model is rate limited on this key, as in production
+    stats, _, provider = _with_provider(
+        llm.FakeLLMProvider(median_ms=median_ms, rate_limited={"gemini-flash-lite-latest"}),
+        lambda i: ai_service.chat_with_ai(f"question {i}"), calls, concurrency)
+    results["chat_first_model_429"] = {**stats, "provider": provider}
+
+    # Truncated JSON from the symptom model falls back to the canned answer
+    stats, answers, provider = _with_provider(
+        llm.FakeLLMProvider(median_ms=median_ms, partial_json=0.3),
+        lambda i: ai_service.medical_knowledge_lookup(f"symptom {i}"), calls, concurrency)
+    degraded = sum(a["why"].startswith("Unable") for a in answers)
+    results["symptom_partial_json"] = {**stats, "degraded": degraded, "provider": provider}
+
+    # Flaky engine (20% 429 / 5% truncated): every failure pays the engine latency plus a Gemini call
+    engine_provider = llm.FakeLLMProvider(median_ms=median_ms / 2, sigma=0.6, rate_429=0.2, partial_json=0.05, seed=1)
+    with FakeEngine(provider=engine_provider) as engine:
+        os.environ["AI_SERVICE_URL"] = engine.url
+        try:
+            stats, _, provider = _with_provider(
+                llm.FakeLLMProvider(median_ms=median_ms),
+                lambda i: ai_service.analyze_with_gemini(image, f"Benchmark study {i}"), calls, concurrency)
+        finally:
+            os.environ.pop("AI_SERVICE_URL")
+    results["analyze_flaky_engine"] = {**stats, "engine": engine_provider.stats(), "provider": provider}
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median-ms", type=float, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.calls, args.concurrency, args.median_ms), indent=2))
+
+if __name__ == "__main__":
+    main_cli()
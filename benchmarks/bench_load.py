@@ -0,0 +1,149 @@
+"""
+End-to-end load scenarios against backend.main:app in-process, with the Kaggle engine and
+Gemini replaced by local stand-ins (benchmarks.standins), so results are reproducible offline.
+
+Scenarios:
+    analyze          concurrent POST /analyze served by the stand-in engine
+    analyze_fallback concurrent POST /analyze with the engine unset (Gemini stand-in path)
+    analyze_spike    concurrent POST /analyze of one identical study (coalesced into one engine call)
+    ws_fanout        one /ws/chat message broadcast to N connected clients, incl. the AI reply
+    cases            concurrent authenticated GET /cases over a seeded table
+
+Usage:
+    python -m benchmarks.bench_load --requests 200 --concurrency 16 --clients 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="medgemma-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+os.environ.setdefault("BLOB_STORE_PATH", os.path.join(_tmp, "uploads"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend import database, main, models
+
+from .harness import summarize
+from .standins import FakeEngine, install_fake_llm
+
+def _png(seed: int, size: int = 512) -> bytes:
+    buf = io.BytesIO()
+    Image.effect_noise((size, size), 20 + seed % 50).save(buf, format="PNG")
+    return buf.getvalue()
+
+async def _concurrent(request, total: int, concurrency: int) -> dict:
+    gate = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with gate:
+            started = time.perf_counter()
+            resp = await request(i)
+            latencies.append(time.perf_counter() - started)
+            errors += resp.status_code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    return {**summarize(latencies), "errors": errors, "requests_per_s": round(total / elapsed, 2)}
+
+async def scenario_analyze(client, total: int, concurrency: int) -> dict:
+    images = [_png(i) for i in range(8)]
+    return await _concurrent(lambda i: client.post(
+        "/analyze", files={"image": (f"study{i}.png", images[i % len(images)], "image/png")},
+        data={"prompt": f"Benchmark study {i}"}), total, concurrency)
+
+async def scenario_analyze_spike(client, total: int, concurrency: int, engine) -> dict:
+    image, before = _png(0), engine.requests
+    stats = await _concurrent(lambda i: client.post(
+        "/analyze", files={"image": ("viral.png", image, "image/png")}, data={"prompt": "Viral case"}),
+        total, concurrency)
+    return {**stats, "engine_calls": engine.requests - before}
+
+async def scenario_cases(client, total: int, concurrency: int, seed_rows: int) -> dict:
+    db = database.SessionLocal()
+    try:
+        for i in range(seed_rows):
+            case = models.Case(patient_id_hash=f"bench{i}", image_path="bench", status="pending_review")
+            case.set_ai_result({"image_type": "medical", "image_findings": "Bench " * 20, "confidence": "high",
+                                "abnormality_location": "none"})
+            db.add(case)
+        db.commit()
+    finally:
+        db.close()
+    await client.post("/register", data={"username": "bench", "password": "bench-pw", "role": "reviewer"})
+    token = (await client.post("/token", data={"username": "bench", "password": "bench-pw"})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    return await _concurrent(lambda i: client.get("/cases", headers=headers), total, concurrency)
+
+def scenario_ws_fanout(clients: int, messages: int) -> dict:
+    latencies = []
+    with TestClient(main.app) as client:
+        sockets = [client.websocket_connect("/ws/chat").__enter__() for _ in range(clients)]
+        try:
+            for ws in sockets:
+                ws.receive_text()  # welcome
+            for i in range(messages):
+                started = time.perf_counter()
+                sockets[i % clients].send_text(f"Benchmark question {i}")
+                for ws in sockets:
+                    ws.receive_text()  # "Patient: ..."
+                    ws.receive_text()  # "AI Assistant: ..."
+                latencies.append(time.perf_counter() - started)
+        finally:
+            for ws in sockets:
+                ws.__exit__(None, None, None)
+    return {**summarize(latencies), "clients": clients, "deliveries_per_s": round(2 * clients * messages / sum(latencies), 2)}
+
+async def _run_async(requests: int, concurrency: int, seed_rows: int, engine) -> dict:
+    results = {}
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            os.environ["AI_SERVICE_URL"] = engine.url
+            results["analyze"] = await scenario_analyze(client, requests, concurrency)
+            results["analyze_spike"] = await scenario_analyze_spike(client, concurrency * 4, concurrency * 4, engine)
+            os.environ.pop("AI_SERVICE_URL")
+            results["analyze_fallback"] = await scenario_analyze(client, max(requests // 4, 1), concurrency)
+            results["cases"] = await scenario_cases(client, requests, concurrency, seed_rows)
+    return results
+
+def run(requests: int = 100, concurrency: int = 8, clients: int = 10, messages: int = 20, seed_rows: int = 200,
+        engine_latency_ms: float = 50, gemini_latency_ms: float = 300) -> dict:
+    install_fake_llm(gemini_latency_ms)
+    with FakeEngine(engine_latency_ms) as engine:
+        results = asyncio.run(_run_async(requests, concurrency, seed_rows, engine))
+        os.environ["AI_SERVICE_URL"] = engine.url
+        try:
+            results["ws_fanout"] = scenario_ws_fanout(clients, messages)
+        finally:
+            os.environ.pop("AI_SERVICE_URL")
+    results["config"] = {"requests": requests, "concurrency": concurrency, "clients": clients, "messages": messages,
+                         "seed_rows": seed_rows, "engine_latency": engine_latency_ms, "gemini_latency": gemini_latency_ms}
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--seed-rows", type=int, default=200)
+    parser.add_argument("--engine-latency-ms", type=float, default=50)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, args.concurrency, args.clients, args.messages, args.seed_rows,
+                         args.engine_latency_ms, args.gemini_latency_ms), indent=2))
+
+if __name__ == "__main__":
+    main_cli()
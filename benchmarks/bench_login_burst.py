@@ -0,0 +1,77 @@
+"""
+Login burst benchmark: N concurrent POST /token requests against backend.main:app in-process,
+measuring login throughput and event-loop lag while bcrypt runs.
+
+Usage:
+    python -m benchmarks.bench_login_burst --logins 200
+    PASSWORD_HASH_WORKERS=0 python -m benchmarks.bench_login_burst   # baseline: hash on the event loop
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="medgemma-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'bench.db')}")
+# The burst comes from a single client address; lift the per-IP cap so admission control doesn't reject it
+os.environ.setdefault("PASSWORD_HASH_PER_IP", "100000")
+os.environ.setdefault("PASSWORD_HASH_MAX_PENDING", "100000")
+
+import httpx
+
+from backend import auth, main
+
+async def _loop_lag_probe(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+async def run(logins: int) -> dict:
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/register", data={"username": "bench", "password": "bench-password"})
+
+            stop, lag = asyncio.Event(), []
+            probe = asyncio.create_task(_loop_lag_probe(stop, lag))
+            latencies = []
+
+            async def login():
+                started = time.perf_counter()
+                resp = await client.post("/token", data={"username": "bench", "password": "bench-password"})
+                latencies.append(time.perf_counter() - started)
+                return resp.status_code
+
+            started = time.perf_counter()
+            codes = await asyncio.gather(*(login() for _ in range(logins)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await probe
+
+    latencies.sort()
+    lag.sort()
+    pick = lambda values, q: round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 2) if values else None
+    return {
+        "logins": logins,
+        "hash_workers": auth.PASSWORD_HASH_WORKERS,
+        "bcrypt_rounds": auth.BCRYPT_ROUNDS,
+        "ok": codes.count(200),
+        "elapsed_s": round(elapsed, 3),
+        "logins_per_s": round(logins / elapsed, 1),
+        "latency_p50_ms": pick(latencies, 0.50),
+        "latency_p99_ms": pick(latencies, 0.99),
+        "loop_lag_p50_ms": pick(lag, 0.50),
+        "loop_lag_max_ms": pick(lag, 1.0),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.logins))))
+
+if __name__ == "__main__":
+    main_cli()
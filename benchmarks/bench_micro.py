@@ -0,0 +1,196 @@
+"""
+Micro-benchmarks: process_medical_image on synthetic DICOM / PNG studies of several sizes,
+the Kaggle engine's deduplicate_sentences on looping model output (plus long, repetitive
+reports against the original all-pairs comparison, whole and streamed), semantic_cache
+lookups (exact, semantic hit, miss) against a full cache, the wire encodings of a
+preprocessed study (encode / decode time and bytes on the wire), and json_extract on
+complete, truncated and token-streamed model output.
+
+Usage:
+    python -m benchmarks.bench_micro --repeat 20
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+
+from backend import ai_service, json_extract, semantic_cache, wire_encoding
+
+from .harness import time_calls
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-engine"))
+from text_dedup import SentenceDeduplicator, deduplicate_sentences  # noqa: E402
+
+SIZES = (256, 512, 1024, 2048)
+
+def synthetic_pixels(size: int, seed: int = 0) -> np.ndarray:
+    """ Chest-film-like 12-bit gradient with noise, so compression and windowing do real work. """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    body = 2000 * np.exp(-(((x - size / 2) / (size / 3)) ** 2 + ((y - size / 2) / (size / 2.2)) ** 2))
+    return np.clip(body + rng.normal(0, 60, (size, size)), 0, 4095).astype(np.uint16)
+
+def synthetic_dicom(size: int) -> bytes:
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = "CR"
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+    ds.WindowCenter, ds.WindowWidth = 40, 400
+    ds.PixelData = synthetic_pixels(size).tobytes()
+
+    buf = io.BytesIO()
+    try:
+        pydicom.dcmwrite(buf, ds, enforce_file_format=True)  # pydicom >= 3
+    except TypeError:
+        pydicom.dcmwrite(buf, ds, write_like_original=False)
+    return buf.getvalue()
+
+def synthetic_png(size: int) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray((synthetic_pixels(size) >> 4).astype(np.uint8)).save(buf, format="PNG")
+    return buf.getvalue()
+
+def synthetic_report(sentences: int = 40, seed: int = 0) -> str:
+    """ Model-style output that keeps rephrasing the same few findings. """
+    rng = random.Random(seed)
+    findings = [
+        "The lungs are clear bilaterally without focal consolidation",
+        "There is no pleural effusion or pneumothorax",
+        "The cardiac silhouette is within normal limits",
+        "Mild degenerative changes are seen in the thoracic spine",
+        "No acute osseous abnormality is identified",
+    ]
+    fillers = ["", "Overall, ", "Again, ", "Notably, "]
+    return ". ".join(rng.choice(fillers) + rng.choice(findings).lower() for _ in range(sentences)) + "."
+
+def long_report(sentences: int, seed: int = 0) -> str:
+    """ A long degenerate generation: many distinct findings, each restated several ways. """
+    rng = random.Random(seed)
+    regions = ["upper", "middle", "lower", "apical", "basal", "hilar", "retrocardiac", "perihilar"]
+    sides = ["left", "right", "bilateral"]
+    findings = ["nodule", "opacity", "consolidation", "atelectasis", "effusion", "calcification", "scarring"]
+    verbs = ["there is a", "there appears to be a", "again noted is a", "redemonstrated is a", "possible"]
+    return ". ".join(
+        f"{rng.choice(verbs)} {rng.randint(2, 40)} mm {rng.choice(sides)} {rng.choice(regions)} zone "
+        f"{rng.choice(findings)} measuring {rng.randint(2, 40)} mm" for _ in range(sentences)) + "."
+
+def pairwise_dedup(text: str) -> str:
+    """ The previous deduplicate_sentences: every sentence's word set against every kept one. """
+    kept = []
+    for s in (s.strip() for s in text.split(".") if s.strip()):
+        words = set(s.lower().split())
+        if not any(len(words & set(k.lower().split())) / len(words) > 0.7 for k in kept):
+            kept.append(s)
+    return ". ".join(kept[:8]) + "."
+
+def bench_long_dedup(repeat: int) -> dict:
+    results = {}
+    for sentences in (1000, 5000):
+        text = long_report(sentences)
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        def streamed_uncapped():  # keeps every distinct sentence, so nothing exits early
+            dedup = SentenceDeduplicator(max_sentences=None)
+            for token in tokens:
+                dedup.feed(token)
+            return dedup.finish()
+
+        results[f"sentences_{sentences}"] = {
+            "pairwise": time_calls(lambda: pairwise_dedup(text), max(1, repeat // 10)),
+            "deduplicate_sentences": time_calls(lambda: deduplicate_sentences(text), repeat),
+            "streamed_uncapped": time_calls(streamed_uncapped, max(1, repeat // 4)),
+            "kept_uncapped": len(SentenceDeduplicator(max_sentences=None).feed(text)),
+        }
+    return results
+
+def run(repeat: int) -> dict:
+    results = {"process_medical_image": {}, "deduplicate_sentences": {}}
+    for size in SIZES:
+        for kind, data, filename in (("dicom", synthetic_dicom(size), "study.dcm"), ("png", synthetic_png(size), "study.png")):
+            stats = time_calls(lambda: ai_service.process_medical_image(data, filename), repeat)
+            stats["bytes"] = len(data)
+            results["process_medical_image"][f"{kind}_{size}"] = stats
+    for sentences in (10, 50, 200):
+        text = synthetic_report(sentences)
+        results["deduplicate_sentences"][f"sentences_{sentences}"] = time_calls(lambda: deduplicate_sentences(text), repeat * 10)
+    results["deduplicate_sentences"]["long_reports"] = bench_long_dedup(repeat)
+    cache = semantic_cache.SemanticCache("bench", max_entries=5000, directory="")
+    for i in range(cache.max_entries):
+        cache.put(f"why do I get symptom {i} after exercise", {"why": "cached"})
+    results["semantic_cache_5000"] = {
+        "exact": time_calls(lambda: cache.get("Why do I get symptom 42 after exercise?"), repeat * 10),
+        "semantic": time_calls(lambda: cache.get("symptom 42 after exercise causes"), repeat * 10),
+        "miss": time_calls(lambda: cache.get("persistent dry cough at night"), repeat * 10),
+    }
+    results["wire_encoding"] = bench_wire_encoding(repeat)
+    results["json_extract"] = bench_json_extract(repeat)
+    return results
+
+def bench_json_extract(repeat: int) -> dict:
+    report = {"image_type": "medical", "image_findings": synthetic_report(30), "confidence": "moderate",
+              "suggested_review": ["Review with radiologist"] * 3}
+    text = "```json\n" + json.dumps(report) + "\n```"
+    truncated = text[: len(text) * 2 // 3]
+    tokens = [text[i:i + 4] for i in range(0, len(text), 4)]  # ~4 characters per token
+
+    def streamed():
+        extractor = json_extract.IncrementalExtractor()
+        for token in tokens:
+            extractor.feed(token)
+        return extractor.result()
+
+    return {
+        "chars": len(text),
+        "complete": time_calls(lambda: json_extract.extract(text, json_extract.ANALYSIS_SCHEMA), repeat * 10),
+        "truncated": time_calls(lambda: json_extract.extract(truncated, json_extract.ANALYSIS_SCHEMA), repeat * 10),
+        "streamed_4char_tokens": time_calls(streamed, repeat * 10),
+    }
+
+def bench_wire_encoding(repeat: int) -> dict:
+    study = ai_service.process_medical_image(synthetic_dicom(1024), "study.dcm")
+    results = {}
+
+    def png_default():  # what analyze_with_gemini used to send
+        buf = io.BytesIO()
+        study.save(buf, format="PNG")
+        return buf.getvalue()
+    stats = time_calls(png_default, repeat)
+    results["png_default"] = {"encode": stats, "bytes": len(png_default())}
+    for fmt in wire_encoding.FORMATS:
+        encoded = wire_encoding.encode(study, fmt)
+        results[fmt] = {
+            "encode": time_calls(lambda: wire_encoding.encode(study, fmt), repeat),
+            "decode": time_calls(lambda: wire_encoding.decode(encoded.data), repeat),
+            "bytes": len(encoded.data),
+        }
+    results["cached_hit"] = time_calls(lambda: wire_encoding.cached_encode(study), repeat)
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
+
+if __name__ == "__main__":
+    main_cli()
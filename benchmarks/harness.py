@@ -0,0 +1,93 @@
+"""
+Shared pieces of the benchmark suite: latency summaries, JSON baselines and regression checks.
+
+Baselines live in benchmarks/baselines/<suite>.json (per machine; they are not committed).
+A metric regresses when it is worse than its baseline by more than the tolerance: latencies
+(`*_ms`, `*_s`) may not grow, throughputs (`*_per_s`, `*_per_minute`) may not shrink.
+"""
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+BASELINE_DIR = os.getenv("BENCH_BASELINE_DIR", os.path.join(os.path.dirname(__file__), "baselines"))
+
+HIGHER_IS_BETTER = ("_per_s", "_per_minute")
+LOWER_IS_BETTER = ("_ms", "_s")
+NOT_COMPARED = ("max_ms",)  # a single outlier sample; too noisy to gate on
+
+def summarize(samples: List[float]) -> dict:
+    """ Latency summary in milliseconds for a list of durations in seconds. """
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 3)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def time_calls(fn: Callable[[], object], repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def _flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def baseline_path(suite: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{suite}.json")
+
+def save_baseline(suite: str, results: dict) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(suite)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "suite": suite,
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    return path
+
+def load_baseline(suite: str):
+    try:
+        with open(baseline_path(suite), encoding="utf-8") as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return None
+
+def compare(baseline: dict, results: dict, tolerance: float = 0.25) -> List[str]:
+    """ Returns one human-readable line per regressed metric. """
+    regressions = []
+    before, after = _flatten(baseline), _flatten(results)
+    for key, old in before.items():
+        new = after.get(key)
+        if new is None or not old:
+            continue
+        name = key.rsplit(".", 1)[-1]
+        if name in NOT_COMPARED:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            if new < old * (1 - tolerance):
+                regressions.append(f"{key}: {new} < baseline {old} (-{(1 - new / old) * 100:.0f}%)")
+        elif name.endswith(LOWER_IS_BETTER):
+            if new > old * (1 + tolerance):
+                regressions.append(f"{key}: {new} > baseline {old} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
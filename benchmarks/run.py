@@ -0,0 +1,54 @@
+"""
+Runs the benchmark suites, compares them with the saved JSON baselines and flags regressions.
+
+Usage:
+    python -m benchmarks.run --save                 # record baselines on this machine
+    python -m benchmarks.run                        # compare; exits 1 if any metric regressed
+    python -m benchmarks.run --suite micro --tolerance 0.1
+"""
+import argparse
+import json
+import sys
+
+from . import harness
+
+def run_suite(suite: str, quick: bool) -> dict:
+    # Imported lazily: bench_load configures a throwaway database via env vars at import time
+    if suite == "micro":
+        from . import bench_micro
+        return bench_micro.run(repeat=5 if quick else 20)
+    from . import bench_load
+    if quick:
+        return bench_load.run(requests=20, concurrency=4, clients=4, messages=5, seed_rows=50)
+    return bench_load.run()
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=("micro", "load", "all"), default="all")
+    parser.add_argument("--save", action="store_true", help="Overwrite the baselines with this run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs (noisier; for smoke checks)")
+    args = parser.parse_args()
+
+    report, regressed = {}, False
+    for suite in (("micro", "load") if args.suite == "all" else (args.suite,)):
+        results = run_suite(suite, args.quick)
+        entry = {"results": results}
+        baseline = harness.load_baseline(suite)
+        if args.save:
+            entry["saved"] = harness.save_baseline(suite, results)
+        elif baseline is None:
+            entry["baseline"] = "missing (run with --save)"
+        else:
+            entry["regressions"] = harness.compare(baseline, results, args.tolerance)
+            regressed |= bool(entry["regressions"])
+        report[suite] = entry
+
+    print(json.dumps(report, indent=2))
+    for suite, entry in report.items():
+        for line in entry.get("regressions", []):
+            print(f"REGRESSION [{suite}] {line}", file=sys.stderr)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,74 @@
+"""
+Offline stand-ins for the external services the backend calls, so load scenarios run with no network:
+
+- FakeEngine: a stdlib HTTP server that answers the Kaggle engine's /analyze, /symptom_analysis,
+  /chat and /health with simulated latency / errors.
+- install_fake_llm(): makes backend.llm serve every Gemini call from FakeLLMProvider.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from backend import llm
+from backend.llm import FakeLLMProvider, LLMError
+
+# Prompts that make FakeLLMProvider answer in the shape of each engine endpoint
+_ENGINE_PROMPTS = {"/analyze": "JSON image_findings", "/symptom_analysis": 'JSON "why"'}
+
+class FakeEngine:
+    """
+    Stand-in for the Kaggle engine. Latency, 429/404 errors and truncated JSON come from a
+    FakeLLMProvider, so the engine hop can be made as flaky as the Gemini one.
+    Runs on 0.0.0.0 because the backend treats literal localhost/127.0.0.1 URLs as mock mode.
+    """
+
+    def __init__(self, latency_ms: float = 50, provider: Optional[FakeLLMProvider] = None):
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: str):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply(200, json.dumps({"status": "healthy", "model": "benchmark-standin"}))
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                engine.requests += 1
+                path = self.path.split("?")[0]
+                try:
+                    text = engine.provider.generate("kaggle-engine", _ENGINE_PROMPTS.get(path, "chat"))
+                except LLMError as e:
+                    self._reply(e.status, json.dumps({"error": str(e)}))
+                    return
+                self._reply(200, text if path in _ENGINE_PROMPTS else json.dumps({"response": text}))
+
+            def log_message(self, *args):
+                pass
+
+        self.provider = provider or FakeLLMProvider(median_ms=latency_ms, sigma=0.2)
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("0.0.0.0", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://0.0.0.0:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-engine", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def install_fake_llm(median_ms: float = 300, sigma: float = 0.4, **options) -> FakeLLMProvider:
+    """ Routes every Gemini call through an in-process FakeLLMProvider (see backend.llm). """
+    fake = FakeLLMProvider(median_ms=median_ms, sigma=sigma, **options)
+    llm.set_provider(fake)
+    return fake